@@ -7,4 +7,49 @@ TOP_N = 20
 BENCHMARK_INDEX = '000300.SH'
 
 # 新增：技术因子计算窗口N
-TECHNICAL_FACTOR_WINDOWS = [5, 20, 60, 120, 250]  # 可灵活调节，统一控制
\ No newline at end of file
+TECHNICAL_FACTOR_WINDOWS = [5, 20, 60, 120, 250]  # 可灵活调节，统一控制
+
+# 新增：本地数据缓存目录（按数据集/年/月分区的Parquet文件）
+DATA_CACHE_DIR = 'data/cache'
+
+# 新增：数据下载并发与限速（按Tushare账号积分对应的每分钟调用上限设置）
+TUSHARE_CALLS_PER_MINUTE = 500
+FETCH_MAX_WORKERS = 8
+FETCH_MAX_RETRIES = 5
+
+# 新增：数据源选择：'tushare' 直连；'record' 直连并录制响应；'replay' 离线回放已录制的响应
+DATA_SOURCE = 'tushare'
+REPLAY_DIR = 'data/replay'
+
+# 新增：复权价格面板存储目录，因子和回测默认使用后复权价格（'hfq'），也可改为前复权（'qfq'）
+ADJUSTED_PANEL_DIR = 'data/panels/adjusted'
+PRICE_ADJUST = 'hfq'
+
+# 新增：股票池过滤，上市不足N个交易日的次新股不参与选股、IC计算和回测
+NEW_STOCK_DAYS = 60
+
+# 新增：因子结果缓存目录及大小上限（MB），超出后按最近访问时间淘汰
+FACTOR_CACHE_DIR = 'data/factor_cache'
+FACTOR_CACHE_MAX_MB = 2048
+
+# 新增：因子计算进程数（None为CPU核数，1为单进程）
+FACTOR_MAX_WORKERS = None
+
+# 新增：全市场每日汇总中创新高/新低的回看交易日数
+# 回看窗口内按有交易的日期取最高/最低价，窗口内有交易的天数不足MARKET_HIGH_LOW_MIN_DAYS的股票（新股、长期停牌）不参与统计；
+# 行情起始日早于分析区间MARKET_HIGH_LOW_WINDOW个交易日（约1年）时，分析区间内的新高/新低都按完整窗口判断
+MARKET_HIGH_LOW_WINDOW = 250
+MARKET_HIGH_LOW_MIN_DAYS = 60
+
+# 新增：IC衰减分析的未来收益周期（交易日）
+IC_DECAY_HORIZONS = [1, 2, 5, 10, 20, 60]
+
+# 新增：每日IC历史存储目录（只追加已实现的IC，按月累计统计量）
+IC_STORE_DIR = 'data/ic_store'
+
+# 新增：分层回测的分组数和调仓周期（交易日）
+QUANTILE_GROUPS = 5
+QUANTILE_REBALANCE_DAYS = 5
+
+# 新增：因子冗余剔除的秩相关阈值（时间平均截面秩相关绝对值不低于该值的因子归为一类，只保留ICIR最高的一个）
+REDUNDANCY_CORR_THRESHOLD = 0.7
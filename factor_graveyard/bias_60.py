@@ -2,16 +2,23 @@
 """
 Bias_60 因子计算
 计算规则：当前价格与60日均线的偏离度
+通过因子注册表计算，复用技术因子中已注册的60日均线中间量
 """
 
-import pandas as pd
+from factors.factor_registry import REGISTRY, compute_factors
+from factors.technical_factors import _bias, _moving_average
+
+# 技术因子窗口配置不含60日时，单独注册60日均线和乖离率
+if 'bias_60' not in REGISTRY.nodes:
+    REGISTRY.add('ma_60', _moving_average, inputs=['close'], params={'window': 60}, lookback=59)
+    REGISTRY.add('bias_60', _bias, inputs=['close', 'ma_60'])
+
 
 def calculate_bias_60(stock_data):
     """
     计算60日价格偏离度
-    :param stock_data: 单只股票的历史行情数据，包含trade_date和close列
-    :return: stock_data DataFrame，新增bias_60列
+    :param stock_data: 行情数据，包含ts_code、trade_date和close列
+    :return: DataFrame，包含ts_code、trade_date、bias_60列
     """
-    stock_data['ma_60'] = stock_data['close'].rolling(window=60).mean()
-    stock_data['bias_60'] = (stock_data['close'] - stock_data['ma_60']) / stock_data['ma_60']
-    return stock_data[['ts_code', 'trade_date', 'bias_60']]
\ No newline at end of file
+    stock_data = compute_factors(stock_data, ['bias_60'])
+    return stock_data[['ts_code', 'trade_date', 'bias_60']]
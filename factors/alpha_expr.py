@@ -0,0 +1,421 @@
+# alpha_expr.py
+# Alpha表达式语言：如 rank(ts_mean(close, 5) / delay(close, 20))
+# 表达式解析为AST（可哈希的元组），整批表达式共享公共子表达式，只计算一次；
+# 在 date×stock 面板上向量化求值：时间序列算子沿日期轴，截面算子沿股票轴
+
+import re
+import warnings
+import numpy as np
+from scipy.stats import rankdata
+from numpy.lib.stride_tricks import sliding_window_view
+from utils.panel_store import long_to_panel
+from utils.schema import to_date_key
+
+_TOKEN = re.compile(r'\s*(?:(\d+\.?\d*(?:[eE][-+]?\d+)?)|([A-Za-z_]\w*)|(<=|>=|==|!=|[-+*/(),<>]))')
+
+
+# ===== 解析：表达式字符串 -> AST =====
+# AST节点：('num', 值) | ('var', 名称) | ('neg', 子节点) | ('bin', 运算符, 左, 右) | ('call', 函数名, (参数, ...))
+
+def tokenize(expr):
+    tokens, pos = [], 0
+    expr = expr.strip()
+    while pos < len(expr):
+        match = _TOKEN.match(expr, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f'表达式 "{expr}" 第{pos}个字符无法识别: {expr[pos:pos + 10]!r}')
+        number, name, op = match.groups()
+        if number is not None:
+            tokens.append(('num', float(number)))
+        elif name is not None:
+            tokens.append(('name', name))
+        else:
+            tokens.append(('op', op))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    """
+    递归下降解析，优先级：比较 < 加减 < 乘除 < 一元负号 < 函数调用/括号
+    """
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.tokens = tokenize(expr)
+        self.i = 0
+
+    def peek(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else (None, None)
+
+    def take(self, op=None):
+        token = self.peek()
+        if op is not None and token != ('op', op):
+            raise ValueError(f'表达式 "{self.expr}" 期望 {op!r}，实际为 {token[1]!r}')
+        self.i += 1
+        return token
+
+    def parse(self):
+        node = self.comparison()
+        if self.i != len(self.tokens):
+            raise ValueError(f'表达式 "{self.expr}" 存在多余内容: {self.peek()[1]!r}')
+        return node
+
+    def comparison(self):
+        node = self.additive()
+        while self.peek()[0] == 'op' and self.peek()[1] in ('<', '>', '<=', '>=', '==', '!='):
+            op = self.take()[1]
+            node = _binary(op, node, self.additive())
+        return node
+
+    def additive(self):
+        node = self.term()
+        while self.peek() in (('op', '+'), ('op', '-')):
+            op = self.take()[1]
+            node = _binary(op, node, self.term())
+        return node
+
+    def term(self):
+        node = self.unary()
+        while self.peek() in (('op', '*'), ('op', '/')):
+            op = self.take()[1]
+            node = _binary(op, node, self.unary())
+        return node
+
+    def unary(self):
+        if self.peek() == ('op', '-'):
+            self.take()
+            node = self.unary()
+            return ('num', -node[1]) if node[0] == 'num' else ('neg', node)
+        return self.atom()
+
+    def atom(self):
+        kind, value = self.take()
+        if kind == 'num':
+            return ('num', value)
+        if kind == 'op' and value == '(':
+            node = self.comparison()
+            self.take(')')
+            return node
+        if kind == 'name':
+            if self.peek() != ('op', '('):
+                return ('var', value)
+            self.take('(')
+            args = []
+            if self.peek() != ('op', ')'):
+                args.append(self.comparison())
+                while self.peek() == ('op', ','):
+                    self.take()
+                    args.append(self.comparison())
+            self.take(')')
+            if value not in OPERATORS:
+                raise ValueError(f'表达式 "{self.expr}" 使用了未知函数: {value}')
+            return ('call', value, tuple(args))
+        raise ValueError(f'表达式 "{self.expr}" 语法错误，位置: {value!r}')
+
+
+def _binary(op, left, right):
+    # 加法和乘法满足交换律，操作数按固定顺序排列，使 a+b 与 b+a 识别为同一子表达式
+    if op in ('+', '*') and repr(right) < repr(left):
+        left, right = right, left
+    return ('bin', op, left, right)
+
+
+def parse(expr):
+    """
+    表达式字符串 -> AST
+    """
+    return _Parser(expr).parse()
+
+
+def variables(node):
+    """
+    AST中用到的变量名（即需要的面板字段）
+    """
+    if node[0] == 'var':
+        return {node[1]}
+    if node[0] == 'neg':
+        return variables(node[1])
+    if node[0] == 'bin':
+        return variables(node[2]) | variables(node[3])
+    if node[0] == 'call':
+        return set().union(*[variables(arg) for arg in node[2]])
+    return set()
+
+
+# ===== 面板算子（输入为[n_dates, n_stocks] float64，窗口内存在NaN时结果为NaN） =====
+
+def _window(d):
+    d = int(d)
+    if d < 1:
+        raise ValueError(f'窗口长度必须为正整数: {d}')
+    return d
+
+
+def _shift(x, d):
+    out = np.full_like(x, np.nan)
+    if d < len(x):
+        out[d:] = x[:len(x) - d]
+    return out
+
+
+def _rolling_sum(x, d):
+    valid = ~np.isnan(x)
+    csum = np.concatenate([np.zeros((1, x.shape[1])), np.cumsum(np.where(valid, x, 0.0), axis=0)])
+    ccount = np.concatenate([np.zeros((1, x.shape[1])), np.cumsum(valid, axis=0)])
+    total = csum[d:] - csum[:-d]
+    count = ccount[d:] - ccount[:-d]
+    out = np.full_like(x, np.nan)
+    out[d - 1:] = np.where(count == d, total, np.nan)
+    return out
+
+
+def _rolling_apply(x, d, func):
+    out = np.full_like(x, np.nan)
+    if d <= len(x):
+        # 窗口视图 [n_dates - d + 1, n_stocks, d]，不复制数据
+        out[d - 1:] = func(sliding_window_view(x, d, axis=0))
+    return out
+
+
+def ts_mean(x, d):
+    return _rolling_sum(x, _window(d)) / _window(d)
+
+
+def ts_sum(x, d):
+    return _rolling_sum(x, _window(d))
+
+
+def ts_std(x, d):
+    d = _window(d)
+    s1, s2 = _rolling_sum(x, d), _rolling_sum(x * x, d)
+    return np.sqrt(np.maximum((s2 - s1 * s1 / d) / (d - 1), 0.0))
+
+
+def ts_min(x, d):
+    return _rolling_apply(x, _window(d), lambda w: w.min(axis=-1))
+
+
+def ts_max(x, d):
+    return _rolling_apply(x, _window(d), lambda w: w.max(axis=-1))
+
+
+def ts_rank(x, d):
+    """
+    当前值在过去d日中的分位（1/d ~ 1，并列按平均名次）
+    """
+    def rank_last(w):
+        last = w[..., -1:]
+        return ((w < last).sum(axis=-1) + ((w == last).sum(axis=-1) + 1) / 2) / w.shape[-1]
+    out = _rolling_apply(x, _window(d), rank_last)
+    return np.where(np.isnan(ts_sum(x, d)), np.nan, out)
+
+
+def ts_corr(x, y, d):
+    d = _window(d)
+    both = ~(np.isnan(x) | np.isnan(y))
+    x, y = np.where(both, x, np.nan), np.where(both, y, np.nan)
+    sx, sy = _rolling_sum(x, d), _rolling_sum(y, d)
+    cov = _rolling_sum(x * y, d) - sx * sy / d
+    var_x = _rolling_sum(x * x, d) - sx * sx / d
+    var_y = _rolling_sum(y * y, d) - sy * sy / d
+    return cov / np.sqrt(var_x * var_y)
+
+
+def delay(x, d):
+    return _shift(x, int(d))
+
+
+def delta(x, d):
+    return x - _shift(x, int(d))
+
+
+def rank(x):
+    """
+    截面百分位排名（并列取平均名次，同pandas rank(pct=True)）
+    """
+    ranks = rankdata(x, axis=1, nan_policy='omit')
+    return ranks / np.sum(~np.isnan(x), axis=1, keepdims=True)
+
+
+def zscore(x):
+    return (x - np.nanmean(x, axis=1, keepdims=True)) / np.nanstd(x, axis=1, ddof=1, keepdims=True)
+
+
+def demean(x):
+    return x - np.nanmean(x, axis=1, keepdims=True)
+
+
+def scale(x):
+    """
+    截面缩放到绝对值之和为1
+    """
+    return x / np.nansum(np.abs(x), axis=1, keepdims=True)
+
+
+def where(condition, x, y):
+    return np.where(np.isnan(condition), np.nan, np.where(condition > 0, x, y))
+
+
+# 函数名 -> (实现, 常数参数位置)：常数参数（窗口长度）必须是数字字面量
+OPERATORS = {
+    'delay': (delay, (1,)),
+    'delta': (delta, (1,)),
+    'ts_mean': (ts_mean, (1,)),
+    'ts_sum': (ts_sum, (1,)),
+    'ts_std': (ts_std, (1,)),
+    'ts_min': (ts_min, (1,)),
+    'ts_max': (ts_max, (1,)),
+    'ts_rank': (ts_rank, (1,)),
+    'ts_corr': (ts_corr, (2,)),
+    'rank': (rank, ()),
+    'zscore': (zscore, ()),
+    'demean': (demean, ()),
+    'scale': (scale, ()),
+    'where': (where, ()),
+    'abs': (np.abs, ()),
+    'log': (lambda x: np.log(np.where(x > 0, x, np.nan)), ()),
+    'sign': (np.sign, ()),
+    'max': (np.fmax, ()),
+    'min': (np.fmin, ()),
+}
+
+_BINARY = {
+    '+': np.add, '-': np.subtract, '*': np.multiply, '/': np.divide,
+    '<': np.less, '>': np.greater, '<=': np.less_equal, '>=': np.greater_equal,
+    '==': np.equal, '!=': np.not_equal,
+}
+
+
+# ===== 求值 =====
+
+def _children(node):
+    """
+    节点求值时需要的子节点（常数参数不求值）
+    """
+    if node[0] == 'neg':
+        return [node[1]]
+    if node[0] == 'bin':
+        return [node[2], node[3]]
+    if node[0] == 'call':
+        constant_args = OPERATORS[node[1]][1] if node[1] in OPERATORS else ()
+        return [arg for i, arg in enumerate(node[2]) if i not in constant_args]
+    return []
+
+
+class AlphaEvaluator:
+    """
+    在一组 date×stock 面板上批量求值表达式，所有表达式共用同一个子表达式缓存（公共子表达式消除）
+    先用plan统计公共子表达式消除后每个节点被引用的次数，最后一个使用者求值完后即释放该节点的面板，
+    内存占用只取决于同时存活的中间结果，而不是表达式总数
+    """
+
+    def __init__(self, panels):
+        self.panels = {name: np.asarray(panel, dtype=np.float64) for name, panel in panels.items()}
+        self.memo = {}
+        self.refs = {}
+
+    def plan(self, roots):
+        """
+        统计引用次数：每个不同的节点只求值一次，对其子节点各计一次引用；每个根表达式计一次外部引用
+        """
+        seen = set()
+        stack = list(roots)
+        for root in roots:
+            self.refs[root] = self.refs.get(root, 0) + 1
+        while stack:
+            node = stack.pop()
+            if node in seen or node in self.memo:
+                continue
+            seen.add(node)
+            for child in _children(node):
+                self.refs[child] = self.refs.get(child, 0) + 1
+                stack.append(child)
+
+    def release(self, node):
+        """
+        使用者求值完成后减少节点的引用次数，降为0时释放缓存的面板（未经plan的节点一直缓存）
+        """
+        if node not in self.refs:
+            return
+        self.refs[node] -= 1
+        if self.refs[node] <= 0:
+            del self.refs[node]
+            self.memo.pop(node, None)
+
+    def evaluate(self, node):
+        if node in self.memo:
+            return self.memo[node]
+        kind = node[0]
+        if kind == 'num':
+            value = node[1]
+        elif kind == 'var':
+            if node[1] not in self.panels:
+                raise KeyError(f'缺少变量面板: {node[1]}')
+            value = self.panels[node[1]]
+        elif kind == 'neg':
+            value = -self.evaluate(node[1])
+        elif kind == 'bin':
+            left, right = self.evaluate(node[2]), self.evaluate(node[3])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                value = _BINARY[node[1]](left, right)
+            if node[1] not in ('+', '-', '*', '/'):
+                # 比较结果用1/0表示，任一侧缺失时为NaN
+                value = np.where(np.isnan(left) | np.isnan(right), np.nan, value.astype(np.float64))
+        else:
+            func, constant_args = OPERATORS[node[1]]
+            args = []
+            for i, arg in enumerate(node[2]):
+                if i in constant_args:
+                    if arg[0] != 'num':
+                        raise ValueError(f'{node[1]} 的第{i + 1}个参数必须是数字常量')
+                    args.append(arg[1])
+                else:
+                    args.append(self.evaluate(arg))
+            # 全为NaN的截面（如非交易日）会触发nanmean等的空切片警告，结果为NaN即可
+            with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                value = func(*args)
+        self.memo[node] = value
+        for child in _children(node):
+            self.release(child)
+        return value
+
+
+def evaluate_alphas(expressions, panels):
+    """
+    批量计算alpha表达式
+    :param expressions: {因子名: 表达式字符串}
+    :param panels: {变量名: [n_dates, n_stocks]面板}
+    :return: {因子名: float32面板}
+    """
+    evaluator = AlphaEvaluator(panels)
+    roots = {name: parse(expr) for name, expr in expressions.items()}
+    evaluator.plan(list(roots.values()))
+    shape = next(iter(evaluator.panels.values())).shape
+    results = {}
+    for name, root in roots.items():
+        results[name] = np.broadcast_to(evaluator.evaluate(root), shape).astype(np.float32)
+        evaluator.release(root)
+    return results
+
+
+def calculate_alpha_factors(df, expressions):
+    """
+    在长表上批量计算alpha表达式：只把用到的列转换为面板一次，求值后按行写回
+    面板的时间轴为交易日历，停牌日为NaN，含停牌日的时间序列窗口结果为NaN
+    结果列可直接用于 calculate_ic(df, factor_cols=list(expressions))
+    :param df: 行情数据（ts_code, trade_date及表达式用到的列）
+    :param expressions: {因子名: 表达式字符串}
+    :return: df（增加各因子列）
+    """
+    fields = sorted(set().union(*[variables(parse(expr)) for expr in expressions.values()]))
+    dates, symbols, panels = long_to_panel(df, fields)
+    alphas = evaluate_alphas(expressions, panels)
+
+    df = df.copy()
+    row = np.searchsorted(dates, to_date_key(df['trade_date']))
+    col = np.searchsorted(symbols, df['ts_code'].astype(str).to_numpy())
+    for name, panel in alphas.items():
+        df[name] = panel[row, col]
+    return df
@@ -1,30 +1,174 @@
 import pandas as pd
+import numpy as np
 import os
 import shutil
 from collections import defaultdict
+from config import IC_DECAY_HORIZONS
+from factors.preprocessing import rank_block, tie_bounds, argsort_nan_last
+from utils.panel_store import long_to_panel
+from utils.schema import from_date_key
 
 
-def calculate_ic(all_data, future_return_col='future_5d_return'):
+def get_factor_columns(all_data):
+    """
+    按列名前缀识别候选因子列
+    """
+    return [col for col in all_data.columns if
+            col.startswith(('momentum', 'volatility', 'bias', 'pe', 'roe', 'turnover', 'sentiment'))]
+
+
+def rank_ic(factor_values, returns, chunk_size=64):
+    """
+    批量计算每日Rank IC（Spearman秩相关，样本为因子值和收益都有效的股票，并列取平均名次，与pandas一致）
+    因子块按日期分块，每块内所有因子一次排名，再对名次做Pearson相关
+    :param factor_values: [n_dates, n_stocks, n_factors]
+    :param returns: [n_dates, n_stocks] 未来收益面板
+    :return: ic [n_dates, n_factors]（样本不足2个或名次无差异时为NaN），count [n_dates, n_factors] 每日样本数
+    """
+    n_dates, _, n_factors = factor_values.shape
+    ic = np.full((n_dates, n_factors), np.nan)
+    count = np.zeros((n_dates, n_factors), dtype=np.int64)
+    for start in range(0, n_dates, chunk_size):
+        end = start + chunk_size
+        ic[start:end], count[start:end] = _rank_ic_chunk(factor_values[start:end], returns[start:end])
+    return ic, count
+
+
+def _rank_ic_chunk(factor_values, returns):
+    returns = np.asarray(returns, dtype=np.float64)
+    has_return = ~np.isnan(returns)
+    # 换成 [n_dates, n_factors, n_stocks]，沿股票轴连续存放
+    # 收益缺失处的因子值置为NaN后排名：每个因子的名次恰好在 因子、收益都有效 的样本内计算
+    values = np.where(has_return[:, None, :], np.moveaxis(factor_values, 1, -1), np.nan)
+    factor_ranks = rank_block(values, pct=False, axis=-1)
+
+    # 收益每日只排序一次，相关系数与股票顺序无关，直接在收益排序后的顺序上计算：
+    # 某个因子有效样本内的收益名次 = 排序后该因子有效样本的累计个数（并列组取平均）
+    order = argsort_nan_last(returns, axis=1)
+    first, last = tie_bounds(np.take_along_axis(returns, order, axis=1))
+    factor_ranks = np.take_along_axis(factor_ranks, order[:, None, :], axis=-1)
+    valid = ~np.isnan(factor_ranks)
+    count = valid.sum(axis=-1)
+    cumulative = np.cumsum(valid, axis=-1, dtype=np.int32)
+    before = np.take_along_axis(cumulative - valid, first[:, None, :], axis=-1)
+    in_group = np.take_along_axis(cumulative, last[:, None, :], axis=-1) - before
+    return_ranks = before + (in_group + 1) / 2
+
+    # 两组名次的均值都是 (n + 1) / 2
+    mean = ((count + 1) / 2)[:, :, None]
+    x = np.where(valid, factor_ranks - mean, 0.0)
+    y = np.where(valid, return_ranks - mean, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ic = np.einsum('tfn,tfn->tf', x, y) / np.sqrt(np.einsum('tfn,tfn->tf', x, x) * np.einsum('tfn,tfn->tf', y, y))
+    return np.where(count >= 2, ic, np.nan), count
+
+
+def calculate_ic(all_data, future_return_col='future_5d_return', factor_cols=None, return_counts=False):
     """
     计算每日IC（Information Coefficient），基于Spearman秩相关系数
     :param all_data: 包含因子列和未来收益率列的DataFrame
-    :return: 每日IC DataFrame
+    :param factor_cols: 可选，需要计算IC的因子列（如alpha表达式因子），默认按列名前缀识别
+    :param return_counts: 是否同时返回每日样本数
+    :return: 每日IC DataFrame（日期索引，float）；return_counts为True时返回 (每日IC, 每日样本数)
     """
-    factor_cols = [col for col in all_data.columns if
-                   col.startswith(('momentum', 'volatility', 'bias', 'pe', 'roe', 'turnover', 'sentiment'))]
+    if factor_cols is None:
+        factor_cols = get_factor_columns(all_data)
 
-    ic_df = pd.DataFrame(index=all_data['trade_date'].unique(), columns=factor_cols)
-
-    for date, group in all_data.groupby('trade_date'):
-        for factor in factor_cols:
-            if group[factor].isnull().all():
-                continue
-            ic = group[factor].corr(group[future_return_col], method='spearman')
-            ic_df.at[date, factor] = ic
+    dates, _, panels = long_to_panel(all_data, list(dict.fromkeys(factor_cols + [future_return_col])))
+    factor_values = np.stack([panels[factor] for factor in factor_cols], axis=-1)
+    ic, count = rank_ic(factor_values, panels[future_return_col])
 
+    index = pd.DatetimeIndex(from_date_key(dates), name='trade_date')
+    ic_df = pd.DataFrame(ic, index=index, columns=factor_cols)
+    if return_counts:
+        return ic_df, pd.DataFrame(count, index=index, columns=factor_cols)
     return ic_df
 
 
+def forward_returns(close, horizons):
+    """
+    由一个价格面板一次生成多个周期的未来收益：close[t + h] / close[t] - 1（超出日历末尾或价格缺失为NaN）
+    :param close: [n_dates, n_stocks] 价格面板
+    :return: [n_horizons, n_dates, n_stocks]
+    """
+    close = np.asarray(close, dtype=np.float64)
+    returns = np.full((len(horizons),) + close.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i, horizon in enumerate(horizons):
+            if horizon < len(close):
+                returns[i, :-horizon] = close[horizon:] / close[:-horizon] - 1
+    return returns
+
+
+def ic_half_life(horizons, ic_mean, ic_tstat=None, min_tstat=2.0):
+    """
+    由各周期IC均值估计IC半衰期（交易日）
+    假设日收益互不相关且波动相同，h日累计收益的IC约为前h个逐日IC之和 / sqrt(h)，
+    相邻周期之间（第h_{i-1}+1至h_i日）的平均逐日IC ≈ (IC(h_i)·sqrt(h_i) - IC(h_{i-1})·sqrt(h_{i-1})) / (h_i - h_{i-1})，
+    半衰期为逐日IC衰减到首个周期一半所经过的天数（线性插值）
+    :param ic_mean: [n_horizons, n_factors]
+    :param ic_tstat: 可选，首个周期IC均值的t值 [n_factors]，不显著（绝对值小于min_tstat）的因子半衰期为NaN
+    :return: [n_factors]，在最长周期内未衰减到一半的为NaN
+    """
+    horizons = np.asarray(horizons, dtype=np.float64)
+    scaled = ic_mean * np.sqrt(horizons)[:, None]
+    daily = np.vstack([scaled[:1] / horizons[0], np.diff(scaled, axis=0) / np.diff(horizons)[:, None]])
+    # 每段平均逐日IC对应该段日期的中点
+    points = np.concatenate([horizons[:1], (horizons[:-1] + 1 + horizons[1:]) / 2])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = daily / daily[:1]
+    half_life = np.full(ic_mean.shape[1], np.nan)
+    for j in range(ic_mean.shape[1]):
+        if ic_tstat is not None and not np.abs(ic_tstat[j]) >= min_tstat:
+            continue
+        below = np.flatnonzero(ratio[1:, j] <= 0.5)
+        if len(below) == 0:
+            continue
+        i = below[0] + 1
+        r0, r1 = ratio[i - 1, j], ratio[i, j]
+        half_life[j] = points[i - 1] + (r0 - 0.5) / (r0 - r1) * (points[i] - points[i - 1]) - points[0]
+    return half_life
+
+
+def calculate_ic_decay(factor_block, prices, horizons=IC_DECAY_HORIZONS, price_col='close'):
+    """
+    IC衰减分析：一次构建多周期未来收益，计算每个因子在每个周期上的IC均值、IC标准差、ICIR和IC半衰期
+    :param factor_block: 因子块（factors.preprocessing.FactorBlock，可为预处理/中性化后的因子）
+    :param prices: 含ts_code, trade_date和价格列的日频数据（与因子块按日期键和代码对齐）
+    :param horizons: 未来收益周期（交易日）
+    :return: DataFrame（factor, horizon, ic_mean, ic_std, icir, n_dates, half_life）
+    """
+    _, _, panels = long_to_panel(prices, [price_col], dates=factor_block.dates, symbols=factor_block.symbols)
+    returns = forward_returns(panels[price_col], horizons)
+
+    ic_mean, ic_std, n_dates = [], [], []
+    for i in range(len(horizons)):
+        ic, _ = rank_ic(factor_block.values, returns[i])
+        valid = ~np.isnan(ic)
+        count = valid.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(valid, ic, 0.0).sum(axis=0) / count
+            std = np.sqrt(np.where(valid, (ic - mean) ** 2, 0.0).sum(axis=0) / (count - 1))
+        ic_mean.append(mean)
+        ic_std.append(std)
+        n_dates.append(count)
+    ic_mean, ic_std, n_dates = np.array(ic_mean), np.array(ic_std), np.array(n_dates)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        icir = ic_mean / ic_std
+
+    factors = factor_block.factors
+    n_horizons, n_factors = len(horizons), len(factors)
+    return pd.DataFrame({
+        'factor': np.tile(factors, n_horizons),
+        'horizon': np.repeat(horizons, n_factors),
+        'ic_mean': ic_mean.ravel(),
+        'ic_std': ic_std.ravel(),
+        'icir': icir.ravel(),
+        'n_dates': n_dates.ravel(),
+        'half_life': np.tile(ic_half_life(horizons, ic_mean, ic_tstat=icir[0] * np.sqrt(n_dates[0])), n_horizons),
+    }).sort_values(['factor', 'horizon']).reset_index(drop=True)
+
+
 def calculate_monthly_icir(ic_df):
     """
     计算月度IC均值和ICIR（IC均值/IC标准差）
@@ -101,26 +245,47 @@ def log_factor_retreat(factor_name, graveyard_path):
         f.write(f'{pd.Timestamp.now()} - {factor_name} retired due to 3 consecutive months ICIR < 0.3\n')
 
 
-def evaluate_and_filter_factors(all_data, future_return_col='future_5d_return'):
+def evaluate_and_filter_factors(all_data, future_return_col='future_5d_return', universe=None, ic_store=None):
     """
     因子评估流程：
     1. 每日IC计算
     2. 月度IC和ICIR计算
     3. 因子筛选
     4. 因子退场机制（连续3个月ICIR<0.3的因子移入factor_graveyard）
+    :param universe: 可选，股票池掩码（utils.universe.Universe），只在可交易股票上计算IC
+    :param ic_store: 可选，IC历史存储（factors.ic_store.ICStore），只计算并追加新实现日期的IC，月度统计直接读取累计量
+                     （all_data需包含ic_store的价格列，未来收益按交易日历由价格计算；
+                     ic_store.future_return_col须与future_return_col一致）
     :return: 保留因子列表，每日IC，月度IC，月度ICIR
     """
-    print("📊 计算每日IC...")
-    ic_df = calculate_ic(all_data, future_return_col)
+    # IC存储的未来收益由完整行情（含股票池外的 股票×日期）按交易日历计算
+    prices = all_data
+    if universe is not None:
+        all_data = universe.filter(all_data, 'tradable')
+
+    if ic_store is not None:
+        if ic_store.future_return_col != future_return_col:
+            raise ValueError(f'IC存储对应 {ic_store.future_return_col}，与评估使用的 {future_return_col} 不一致')
+        factor_cols = get_factor_columns(all_data)
+        print("📊 追加新实现日期的每日IC...")
+        ic_store.update(all_data, factor_cols, prices=prices)
+        ic_df = ic_store.daily_ic(factor_cols)
+
+        print("📊 读取月度IC和ICIR...")
+        monthly_ic, icir_df = ic_store.monthly_stats(factor_cols)
+    else:
+        print("📊 计算每日IC...")
+        ic_df = calculate_ic(all_data, future_return_col)
 
-    print("📊 计算月度IC和ICIR...")
-    monthly_ic, icir_df = calculate_monthly_icir(ic_df)
+        print("📊 计算月度IC和ICIR...")
+        monthly_ic, icir_df = calculate_monthly_icir(ic_df)
 
     print("📊 筛选有效因子...")
     selected_factors = filter_factors_by_icir(monthly_ic, icir_df)
 
     print("📊 检查并执行因子退场机制...")
-    retired_factors = track_and_remove_underperforming_factors(icir_df)
+    # 退场检查只需要最近3个月的ICIR
+    retired_factors = track_and_remove_underperforming_factors(icir_df.iloc[-3:])
 
     print(f"✅ 保留因子: {selected_factors}")
     print(f"❌ 退场因子: {retired_factors}")
@@ -0,0 +1,193 @@
+# factor_cache.py
+# 因子结果磁盘缓存：以因子定义指纹（代码+参数）为键，每个因子一个Parquet列式文件
+# - 输入数据在已缓存区间内没有变化时直接读取缓存（行集合相同，缓存值按(ts_code, trade_date)排序后的行顺序存储），只对新增日期增量计算（按因子声明的lookback取历史）
+# - 因子代码或参数变化会改变指纹，自动视为新因子重新计算
+# - 缓存总大小超过上限时按最近访问时间（LRU）淘汰
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+from config import FACTOR_CACHE_DIR, FACTOR_CACHE_MAX_MB, FACTOR_MAX_WORKERS
+from factors.factor_registry import REGISTRY
+from factors.segment_ops import segment_positions
+from factors.parallel_factors import evaluate_parallel
+from utils.schema import to_date_key
+
+
+def input_version(df, columns, end_key):
+    """
+    输入数据版本：截至end_key（含）的 ts_code、trade_date 及因子依赖列的内容哈希
+    """
+    date_keys = to_date_key(df['trade_date'])
+    columns = sorted(column for column in columns if column in df.columns)
+    subset = df.loc[date_keys <= end_key, ['ts_code', 'trade_date'] + columns]
+    hashes = pd.util.hash_pandas_object(subset, index=False).to_numpy()
+    return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+
+class FactorCache:
+    """
+    因子缓存目录：
+    - {指纹}/data.parquet：value（按(ts_code, trade_date)排序后的行顺序）
+    - {指纹}/meta.json：因子名、已缓存截止日期、输入数据版本
+    - _index.json：各条目大小与最近访问时间（LRU淘汰依据）
+    """
+
+    def __init__(self, root=FACTOR_CACHE_DIR, max_mb=FACTOR_CACHE_MAX_MB):
+        self.root = root
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        os.makedirs(root, exist_ok=True)
+
+    def _index_path(self):
+        return os.path.join(self.root, '_index.json')
+
+    def _load_index(self):
+        if not os.path.exists(self._index_path()):
+            return {}
+        with open(self._index_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_index(self, index):
+        tmp_path = self._index_path() + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._index_path())
+
+    def _touch(self, key, size=None):
+        index = self._load_index()
+        entry = index.setdefault(key, {'bytes': 0})
+        entry['last_access'] = time.time()
+        if size is not None:
+            entry['bytes'] = size
+        self._save_index(index)
+
+    def meta(self, key):
+        path = os.path.join(self.root, key, 'meta.json')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def load(self, key):
+        """
+        读取缓存的因子值（float32数组），并刷新最近访问时间
+        """
+        values = pd.read_parquet(os.path.join(self.root, key, 'data.parquet'))['value'].to_numpy()
+        self._touch(key)
+        return values
+
+    def store(self, key, values, meta):
+        """
+        写入（覆盖）一个因子的缓存，写完后按LRU淘汰超出上限的条目
+        """
+        directory = os.path.join(self.root, key)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, 'data.parquet')
+        pd.DataFrame({'value': np.asarray(values, dtype=np.float32)}).to_parquet(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+        with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        self._touch(key, size=os.path.getsize(path))
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """
+        缓存总大小超过上限时，从最久未访问的条目开始删除（不删除keep）
+        """
+        index = self._load_index()
+        total = sum(entry['bytes'] for entry in index.values())
+        for key in sorted(index, key=lambda k: index[k].get('last_access', 0)):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+            total -= index.pop(key)['bytes']
+        self._save_index(index)
+
+
+def _incremental_rows(pos, is_new, lookback):
+    """
+    增量计算需要的行：新增日期的行 + 每只股票在新增日期之前的lookback行历史
+    """
+    segment = np.cumsum(pos == 0) - 1
+    n_old = np.bincount(segment, weights=~is_new).astype(np.int64)[segment]
+    return is_new | (pos >= n_old - lookback)
+
+
+def compute_factors_cached(df, names, cache=None, registry=REGISTRY, n_workers=FACTOR_MAX_WORKERS):
+    """
+    带缓存的因子计算，结果与compute_factors一致
+    :param df: 行情数据（ts_code, trade_date及因子依赖的原始列）
+    :param names: 需要输出的因子名列表
+    :param cache: FactorCache，默认使用配置的缓存目录
+    :param n_workers: 需要全量重算时的进程数（1为单进程；多进程只支持全局注册表）
+    :return: 按(ts_code, trade_date)排序的df（增加names对应的float32列）
+    """
+    cache = cache or FactorCache()
+    df = df.sort_values(['ts_code', 'trade_date'], kind='stable').reset_index(drop=True)
+    codes = df['ts_code'].astype(str).to_numpy()
+    pos = segment_positions(codes)
+    date_keys = to_date_key(df['trade_date'])
+    end_key = int(date_keys.max())
+
+    # 依赖列相同的因子共用一次输入数据哈希
+    versions = {}
+
+    def version(name, end):
+        columns = tuple(sorted(registry.leaf_columns(name)))
+        if (columns, end) not in versions:
+            versions[(columns, end)] = input_version(df, columns, end)
+        return versions[(columns, end)]
+
+    full, partial, results = [], {}, {}
+    for name in names:
+        key = registry.fingerprint(name)
+        meta = cache.meta(key)
+        # 已缓存区间内的输入（含行集合）与缓存时一致才可复用
+        if meta is None or version(name, meta['end']) != meta['version']:
+            full.append(name)
+            continue
+        values = cache.load(key).astype(np.float64)
+        if meta['end'] < end_key:
+            partial[name] = (meta['end'], values)
+        else:
+            results[name] = values
+
+    print(f"📊 因子缓存：命中 {len(results)} 个，增量 {len(partial)} 个，重新计算 {len(full)} 个")
+    updated = {}
+    if full:
+        if registry is REGISTRY:
+            updated.update(evaluate_parallel(df, full, pos, n_workers))
+        else:
+            values = registry.evaluate(df, full, pos)
+            updated.update({name: values[name] for name in full})
+
+    # 增量因子按（缓存截止日期, 是否依赖全部历史）分组，同组因子共用一次计算（取组内最长的lookback）
+    groups = {}
+    for name, (end, _) in partial.items():
+        groups.setdefault((end, registry.total_lookback(name) is None), []).append(name)
+    for (cached_end, unbounded), group in sorted(groups.items()):
+        is_new = date_keys > cached_end
+        if unbounded:
+            rows = np.ones(len(df), dtype=bool)
+        else:
+            rows = _incremental_rows(pos, is_new, max(registry.total_lookback(name) for name in group))
+        values = registry.evaluate(df[rows].reset_index(drop=True), group, segment_positions(codes[rows]))
+        for name in group:
+            merged = np.full(len(df), np.nan)
+            merged[rows] = values[name]
+            merged[~is_new] = partial[name][1]
+            updated[name] = merged
+
+    for name, values in updated.items():
+        cache.store(registry.fingerprint(name), values, {'factor': name, 'end': end_key, 'version': version(name, end_key)})
+    results.update(updated)
+
+    for name in names:
+        df[name] = results[name].astype(np.float32)
+    return df
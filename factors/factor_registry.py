@@ -0,0 +1,176 @@
+# factor_registry.py
+# 因子注册表：每个因子（及共享中间量）声明输入和参数，求值时按依赖DAG拓扑排序，
+# 每个中间量只计算一次，最终只把请求的因子写入df
+
+import hashlib
+import inspect
+import json
+import numpy as np
+import pandas as pd
+from factors.segment_ops import segment_positions
+
+
+class FactorNode:
+    """
+    注册表中的一个节点
+    :param name: 节点名（因子名或中间量名）
+    :param func: 计算函数 func(pos, *inputs, **params) -> 一维数组，pos为行在所属股票内的序号
+    :param inputs: 依赖的节点名或df原始列名
+    :param params: 计算参数
+    :param intermediate: 是否为中间量（中间量不会被list_factors列出，也不会写入df，除非显式请求）
+    :param lookback: 计算某一行时需要的同一股票此前行数（None表示依赖全部历史，如EMA）
+    """
+
+    def __init__(self, name, func, inputs=(), params=None, intermediate=False, lookback=0):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = dict(params or {})
+        self.intermediate = intermediate
+        self.lookback = lookback
+
+    def definition(self):
+        """
+        节点定义（函数源码+输入+参数），用于计算因子指纹
+        """
+        try:
+            source = inspect.getsource(self.func)
+        except (OSError, TypeError):
+            source = getattr(self.func, '__qualname__', repr(self.func))
+        return {'name': self.name, 'source': source, 'inputs': self.inputs, 'params': self.params,
+                'lookback': self.lookback}
+
+
+class FactorRegistry:
+    """
+    因子注册表
+    """
+
+    def __init__(self):
+        self.nodes = {}
+
+    def add(self, name, func, inputs=(), params=None, intermediate=False, lookback=0):
+        """
+        注册一个节点（同名节点会被覆盖）
+        """
+        self.nodes[name] = FactorNode(name, func, inputs, params, intermediate, lookback)
+        return func
+
+    def register(self, name, inputs=(), params=None, intermediate=False, lookback=0):
+        """
+        装饰器形式的注册
+        """
+        def decorator(func):
+            return self.add(name, func, inputs, params, intermediate, lookback)
+        return decorator
+
+    def list_factors(self, prefix=None):
+        """
+        列出已注册的因子（不含中间量）
+        """
+        return [name for name, node in self.nodes.items()
+                if not node.intermediate and (prefix is None or name.startswith(prefix))]
+
+    def resolve(self, names, columns=()):
+        """
+        按依赖关系拓扑排序，返回需要计算的节点名（依赖在前）
+        :param columns: df中已有的原始列，作为DAG的叶子
+        """
+        order, visiting, done = [], set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name not in self.nodes:
+                if name in columns:
+                    done.add(name)
+                    return
+                raise KeyError(f'未注册的因子或缺失的输入列: {name}')
+            if name in visiting:
+                raise ValueError(f'因子依赖存在循环: {name}')
+            visiting.add(name)
+            for dependency in self.nodes[name].inputs:
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in names:
+            visit(name)
+        return order
+
+    def leaf_columns(self, name):
+        """
+        节点最终依赖的df原始列
+        """
+        if name not in self.nodes:
+            return {name}
+        return set().union(*[self.leaf_columns(dependency) for dependency in self.nodes[name].inputs])
+
+    def total_lookback(self, name):
+        """
+        节点沿依赖链累计需要的历史行数（任一环节为None则为None）
+        """
+        if name not in self.nodes:
+            return 0
+        node = self.nodes[name]
+        lookbacks = [self.total_lookback(dependency) for dependency in node.inputs]
+        if node.lookback is None or any(lookback is None for lookback in lookbacks):
+            return None
+        return node.lookback + max(lookbacks, default=0)
+
+    def fingerprint(self, name):
+        """
+        因子指纹：因子及其全部依赖节点定义的哈希，任一环节的代码或参数变化都会改变指纹
+        """
+        definitions = [self.nodes[node].definition() for node in self.resolve([name], columns=self.leaf_columns(name))]
+        payload = json.dumps(definitions, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def evaluate(self, df, names, pos):
+        """
+        在已按(ts_code, trade_date)排序的df上计算指定节点，返回 {name: float64数组}（含中间量）
+        df中不存在的可选输入列按全NaN处理
+        """
+        columns = set(df.columns)
+        values = {}
+
+        def get(name):
+            if name not in values:
+                if name in columns and name not in self.nodes:
+                    values[name] = df[name].to_numpy(dtype=np.float64)
+                else:
+                    values[name] = np.full(len(df), np.nan)
+            return values[name]
+
+        optional = {dependency for node in self.nodes.values() for dependency in node.inputs
+                    if dependency not in self.nodes}
+        for name in self.resolve(names, columns=columns | optional):
+            node = self.nodes[name]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values[name] = np.asarray(node.func(pos, *[get(dependency) for dependency in node.inputs], **node.params),
+                                          dtype=np.float64)
+        return values
+
+
+# 全局注册表，各因子模块导入时把自己的因子注册进来
+REGISTRY = FactorRegistry()
+
+
+def compute_factors(df, names, registry=REGISTRY, pos=None):
+    """
+    计算并写入指定因子，只计算这些因子依赖到的中间量
+    :param df: 行情数据（ts_code, trade_date及因子依赖的原始列）
+    :param names: 需要输出的因子名列表
+    :param pos: 可选，段内序号；传入时认为df已按(ts_code, trade_date)排序，不再排序
+    :return: 按(ts_code, trade_date)排序的df（增加names对应的float32列）
+    """
+    if pos is None:
+        df = df.sort_values(['ts_code', 'trade_date'], kind='stable').reset_index(drop=True)
+        codes = df['ts_code']
+        codes = codes.cat.codes.to_numpy() if isinstance(codes.dtype, pd.CategoricalDtype) else codes.to_numpy()
+        pos = segment_positions(codes)
+    values = registry.evaluate(df, names, pos)
+    for name in names:
+        df[name] = values[name].astype(np.float32)
+    return df
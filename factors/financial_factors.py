@@ -1,64 +1,170 @@
-# financial_factors.py
-# 财务因子计算模块，计算每个个股的核心财务指标
+# factors/financial_factors.py
+"""
+财务因子计算模块
+先在按 股票×报告期 的季度表（每只股票约20行）上计算单季/TTM/同比等报告期指标，
+再按公告日时点规则广播到日频，最后只在日频上计算需要市值的估值比率
+"""
 
 import numpy as np
 import pandas as pd
+from utils.schema import compact_frame
+
+# 利润表流量项（年初至今累计值）：因子内部名 -> 报表字段
+FLOW_FIELDS = {
+    'revenue': 'total_revenue',
+    'net_profit': 'n_income_attr_p',
+    'ebitda': 'ebitda',
+}
+
+# 资产负债表存量项（期末值）
+STOCK_FIELDS = {
+    'net_asset': 'total_hldr_eqy_exc_min_int',
+    'total_liability': 'total_liab',
+    'cash': 'money_cap',
+}
+
+# 财务指标表中直接使用的报告期比率
+INDICATOR_FIELDS = ['grossprofit_margin', 'debt_to_assets']
+
+# Tushare每日指标的总市值单位为万元，报表金额单位为元
+MARKET_CAP_UNIT = 10000
+
+
+def _first_announced(table, fields):
+    """
+    每个 (ts_code, end_date) 只保留首次公告的版本：后续更正公告的数据在首次公告时并不可知
+    """
+    if table is None or table.empty:
+        return None
+    table = table.copy()
+    if 'report_type' in table.columns:
+        # 只用合并报表
+        table = table[table['report_type'].astype(str) == '1']
+    table = table[table['ann_date'] > 0].sort_values(['ts_code', 'end_date', 'ann_date'])
+    table = table.drop_duplicates(['ts_code', 'end_date'], keep='first')
+    table['ts_code'] = table['ts_code'].astype(str)
+    return table[['ts_code', 'end_date', 'ann_date'] + [col for col in fields if col in table.columns]]
+
 
-def calculate_financial_factors(df):
+def merge_report_tables(income=None, balancesheet=None, indicator=None):
     """
-    根据财务数据计算多种财务因子
-    这些因子可以作为选股多因子体系的重要组成部分
+    合并利润表、资产负债表、财务指标为 股票×报告期 的季度表
+    同一报告期各表公告日不同时取最晚的公告日（全部可得后才生效）
     """
+    parts = [
+        (_first_announced(income, list(FLOW_FIELDS.values())), FLOW_FIELDS),
+        (_first_announced(balancesheet, list(STOCK_FIELDS.values())), STOCK_FIELDS),
+        (_first_announced(indicator, INDICATOR_FIELDS), {}),
+    ]
+    reports = None
+    for table, rename in parts:
+        if table is None:
+            continue
+        table = table.rename(columns={source: name for name, source in rename.items()})
+        if reports is None:
+            reports = table
+            continue
+        reports = reports.merge(table, on=['ts_code', 'end_date'], how='outer', suffixes=('', '_other'))
+        reports['ann_date'] = np.fmax(reports['ann_date'], reports.pop('ann_date_other')).astype(np.int32)
+    if reports is None:
+        raise ValueError('没有可用的财务报表数据')
+    return reports.sort_values(['ts_code', 'end_date']).reset_index(drop=True)
 
-    # 成长性因子
-    df['revenue_growth'] = df['revenue'].pct_change(4)  # 四季度同比增长
-    df['profit_growth'] = df['net_profit'].pct_change(4)
 
-    # 估值因子（假设市值已在外部计算加入）
-    df['pe'] = df['market_cap'] / df['net_profit']
-    df['pb'] = df['market_cap'] / df['net_asset']
-    df['ev_ebitda'] = (df['market_cap'] + df['total_liability'] - df['cash']) / df['ebitda']
+def _period_lookup(reports, period_keys, column):
+    """
+    按 (ts_code, 报告期) 精确匹配取值（找不到的为NaN）
+    """
+    values = pd.Series(reports[column].to_numpy(dtype=np.float64),
+                       index=pd.MultiIndex.from_arrays([reports['ts_code'], reports['end_date']]))
+    index = pd.MultiIndex.from_arrays([reports['ts_code'], period_keys])
+    return values.reindex(index).to_numpy()
 
-    # 财务健康因子
-    df['debt_to_asset'] = df['total_liability'] / df['net_asset']
-    df['cash_ratio'] = df['cash'] / df['total_liability']
 
-    # 质量因子
-    df['roe'] = df['net_profit'] / df['net_asset']
+def _safe_divide(numerator, denominator):
+    """
+    分母非正时为NaN（亏损/负净资产时的估值比率没有意义）
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
 
-    # 特殊处理，防止极端值干扰
-    for col in ['pe', 'pb', 'ev_ebitda']:
-        df[col] = np.clip(df[col], 0, np.percentile(df[col].dropna(), 95))  # 剔除极端值
 
-    return df
+def build_quarterly_financials(reports):
+    """
+    在季度表上计算报告期指标（同比和TTM都按报告期精确匹配，不依赖行数）
+    - {flow}_q：单季值（Q1取累计值，其余为本期累计 - 上一季度累计）
+    - {flow}_ttm：滚动四季度（年报取累计值，其余为本期累计 + 上年年报 - 上年同期累计）
+    - {flow}_yoy：累计值同比（本期累计 / 上年同期累计 - 1，分母取绝对值）
+    - roe_ttm、net_debt（有息负债近似：总负债 - 货币资金），供日频估值比率使用
+    :param reports: merge_report_tables的结果（end_date/ann_date为int32日期键）
+    :return: 季度表（增加上述列）
+    """
+    reports = reports.copy()
+    end_date = reports['end_date'].to_numpy(dtype=np.int64)
+    year, month_day = end_date // 10000, end_date % 10000
+    quarter = np.select([month_day == 331, month_day == 630, month_day == 930, month_day == 1231], [1, 2, 3, 4], 0)
+
+    last_year_same = end_date - 10000
+    last_annual = (year - 1) * 10000 + 1231
+    previous_quarter = np.select([quarter == 2, quarter == 3, quarter == 4],
+                                 [year * 10000 + 331, year * 10000 + 630, year * 10000 + 930], 0)
+
+    for name in FLOW_FIELDS:
+        if name not in reports.columns:
+            continue
+        ytd = reports[name].to_numpy(dtype=np.float64)
+        same = _period_lookup(reports, last_year_same, name)
+        annual = _period_lookup(reports, last_annual, name)
+        previous = _period_lookup(reports, previous_quarter, name)
+        reports[f'{name}_q'] = np.where(quarter == 1, ytd, ytd - previous)
+        reports[f'{name}_ttm'] = np.where(quarter == 4, ytd, ytd + annual - same)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            reports[f'{name}_yoy'] = np.where(same != 0, (ytd - same) / np.abs(same), np.nan)
+        # 非标准报告期（quarter == 0）无法匹配
+        for suffix in ('_q', '_ttm', '_yoy'):
+            reports.loc[quarter == 0, f'{name}{suffix}'] = np.nan
+
+    if {'net_profit_ttm', 'net_asset'} <= set(reports.columns):
+        reports['roe_ttm'] = _safe_divide(reports['net_profit_ttm'].to_numpy(), reports['net_asset'].to_numpy())
+    if {'total_liability', 'cash'} <= set(reports.columns):
+        reports['net_debt'] = reports['total_liability'] - reports['cash'].fillna(0)
+    return compact_frame(reports)
 
-# factors/financial_factors.py
-"""
-财务因子计算模块
-支持从财务数据中计算盈利能力、估值等因子
-"""
 
 def calculate_financial_factors(all_data):
     """
     计算财务因子
-    :param all_data: 合并后的行情+财务数据（包含trade_date, ts_code, pe, roe等列）
+    :param all_data: 日频数据，已按公告日as-of连接季度表（build_quarterly_financials的结果），
+                     有total_mv（每日指标，万元）时计算估值因子
     :return: all_data（增加财务因子列）
     """
+    columns = set(all_data.columns)
 
-    # 估值因子
-    all_data['pe_ttm'] = all_data['pe_ttm'].replace([None, 0], pd.NA).fillna(method='ffill')
-    all_data['pb'] = all_data['pb'].replace([None, 0], pd.NA).fillna(method='ffill')
-    all_data['ps_ttm'] = all_data['ps_ttm'].replace([None, 0], pd.NA).fillna(method='ffill')
+    # 估值因子：市值 / 报告期指标（分母非正时为NaN）
+    if 'total_mv' in columns:
+        market_cap = all_data['total_mv'].to_numpy(dtype=np.float64) * MARKET_CAP_UNIT
+        if 'net_profit_ttm' in columns:
+            all_data['pe_ttm'] = _safe_divide(market_cap, all_data['net_profit_ttm'].to_numpy(dtype=np.float64))
+        if 'net_asset' in columns:
+            all_data['pb'] = _safe_divide(market_cap, all_data['net_asset'].to_numpy(dtype=np.float64))
+        if 'revenue_ttm' in columns:
+            all_data['ps_ttm'] = _safe_divide(market_cap, all_data['revenue_ttm'].to_numpy(dtype=np.float64))
+        if {'net_debt', 'ebitda_ttm'} <= columns:
+            enterprise_value = market_cap + all_data['net_debt'].to_numpy(dtype=np.float64)
+            all_data['ev_ebitda'] = _safe_divide(enterprise_value, all_data['ebitda_ttm'].to_numpy(dtype=np.float64))
 
-    # 盈利能力因子
-    all_data['roe_ttm'] = all_data['roe'].replace([None], pd.NA).fillna(method='ffill')
-    all_data['gross_profit_margin'] = all_data['grossprofit_margin'].replace([None], pd.NA).fillna(method='ffill')
+    # 盈利能力因子（roe_ttm已在季度表上计算）
+    if 'grossprofit_margin' in columns:
+        all_data['gross_profit_margin'] = all_data['grossprofit_margin']
 
     # 财务杠杆因子
-    all_data['debt_asset_ratio'] = all_data['debt_to_assets'].replace([None], pd.NA).fillna(method='ffill')
+    if 'debt_to_assets' in columns:
+        all_data['debt_asset_ratio'] = all_data['debt_to_assets']
 
-    # 增长因子
-    all_data['revenue_growth'] = all_data['revenue_yoy'].replace([None], pd.NA).fillna(method='ffill')
-    all_data['net_profit_growth'] = all_data['netprofit_yoy'].replace([None], pd.NA).fillna(method='ffill')
+    # 增长因子（按报告期匹配的同比）
+    if 'revenue_yoy' in columns:
+        all_data['revenue_growth'] = all_data['revenue_yoy']
+    if 'net_profit_yoy' in columns:
+        all_data['net_profit_growth'] = all_data['net_profit_yoy']
 
-    return all_data
\ No newline at end of file
+    return all_data
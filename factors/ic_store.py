@@ -0,0 +1,226 @@
+# ic_store.py
+# 每日IC历史持久化存储：按 因子×日期 保存已实现的IC（未来收益周期已走完的日期），按月累计样本数、IC之和、IC平方和
+# - 每次运行只追加新实现的日期，月度IC均值、标准差、ICIR由累计量直接得到，不重算全部历史
+# - 因子筛选和退场检查只需读取最近N个月的月度统计
+# - 每个因子的历史按 因子定义指纹（FactorRegistry.fingerprint；未注册的财务/情绪因子用所在模块的源码哈希）
+#   + 预处理/股票池/中性化设置 + 收益周期 的键区分，因子定义或设置变化后自动开始新的历史；
+#   读取时只返回当前因子列表对应键的历史
+# - 存储的IC使用按交易日历对齐的未来收益（close[t + horizon] / close[t] - 1），日历上已走完horizon日的日期结果不再变化，
+#   存储名称future_{horizon}d_return必须与收益周期一致
+
+import os
+import re
+import json
+import hashlib
+import inspect
+import importlib
+import numpy as np
+import pandas as pd
+from config import IC_STORE_DIR
+from factors.factor_analysis import rank_ic, forward_returns, get_factor_columns
+from factors.factor_registry import REGISTRY
+from utils.panel_store import long_to_panel
+from utils.schema import to_date_key, from_date_key
+
+DAILY_COLUMNS = ['trade_date', 'factor', 'key', 'ic', 'n']
+MONTHLY_COLUMNS = ['month', 'factor', 'key', 'n', 'ic_sum', 'ic_sumsq']
+
+# 不在因子注册表中的因子（财务因子、情绪因子）由这些模块计算，模块源码哈希代替注册表指纹参与因子键的计算
+UNREGISTERED_FACTOR_MODULES = ('factors.financial_factors', 'factors.sentiment_factors')
+
+RETURN_COL_PATTERN = re.compile(r'^future_(\d+)d_return$')
+
+
+def source_hash(module_names):
+    """
+    若干模块源码的哈希（模块中任一因子的计算方式变化后哈希随之变化）
+    """
+    digest = hashlib.sha1()
+    for name in module_names:
+        digest.update(inspect.getsource(importlib.import_module(name)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ICStore:
+    """
+    IC存储目录（每个未来收益列一个子目录）：
+    - daily.parquet：trade_date, factor, key, ic, n（每日IC及样本数）
+    - monthly.parquet：month, factor, key, n, ic_sum, ic_sumsq（月度累计量）
+    - meta.json：各因子键已存储的最后日期（int32日期键）
+    """
+
+    def __init__(self, future_return_col='future_5d_return', horizon=5, root=IC_STORE_DIR, settings=None,
+                 price_col='close', registry=REGISTRY, unregistered_modules=UNREGISTERED_FACTOR_MODULES):
+        """
+        :param future_return_col: 存储名称（对应的未来收益列，须为future_{horizon}d_return；
+                                  IC由price_col按交易日历重新计算收益，不读取该列）
+        :param horizon: 未来收益周期（交易日），日期之后已有horizon个交易日时该日IC才确定
+        :param settings: 可选，影响因子值的设置（预处理、股票池、中性化等，可JSON序列化的dict），参与因子键的计算
+        :param price_col: 计算未来收益的价格列
+        :param unregistered_modules: 计算未注册因子的模块，其源码哈希参与这些因子键的计算
+        """
+        match = RETURN_COL_PATTERN.match(future_return_col)
+        if match is None or int(match.group(1)) != horizon:
+            raise ValueError(f'未来收益列 {future_return_col} 与收益周期 {horizon} 不一致，应为 future_{horizon}d_return')
+        self.future_return_col = future_return_col
+        self.horizon = horizon
+        self.settings = dict(settings or {})
+        self.price_col = price_col
+        self.registry = registry
+        self.unregistered_source = source_hash(unregistered_modules)
+        self.root = os.path.join(root, future_return_col)
+        os.makedirs(self.root, exist_ok=True)
+
+    def factor_keys(self, factor_cols):
+        """
+        各因子的历史键 {factor: key}：因子名 + 注册表指纹（未注册的因子用计算模块的源码哈希）+ 设置 + 收益周期的哈希
+        """
+        keys = {}
+        for factor in factor_cols:
+            fingerprint = (self.registry.fingerprint(factor) if factor in self.registry.nodes
+                           else self.unregistered_source)
+            payload = json.dumps({'factor': factor, 'fingerprint': fingerprint, 'settings': self.settings,
+                                  'horizon': self.horizon, 'price_col': self.price_col},
+                                 sort_keys=True, ensure_ascii=False, default=str)
+            keys[factor] = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+        return keys
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _read(self, name, columns):
+        if not os.path.exists(self._path(name)):
+            return pd.DataFrame(columns=columns)
+        df = pd.read_parquet(self._path(name))
+        # 没有因子键的旧格式存储无法判断是否可比，不再使用
+        return df if 'key' in df.columns else pd.DataFrame(columns=columns)
+
+    def _extend(self, name, columns, new):
+        """
+        在已有文件后追加行（文件不存在时直接写入）
+        """
+        if os.path.exists(self._path(name)):
+            existing = self._read(name, columns)
+            if not existing.empty:
+                new = pd.concat([existing, new], ignore_index=True)
+        return new
+
+    def _write(self, name, df):
+        df.to_parquet(self._path(name) + '.tmp', index=False)
+        os.replace(self._path(name) + '.tmp', self._path(name))
+
+    def last_dates(self):
+        """
+        各因子键已存储的最后日期 {key: int32日期键}
+        """
+        if not os.path.exists(self._path('meta.json')):
+            return {}
+        with open(self._path('meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return meta.get('last_dates_by_key', {})
+
+    def append(self, ic_df, count_df=None):
+        """
+        追加每日IC（只保留各因子键已存储最后日期之后的行），并累加到月度统计量
+        :param ic_df: 每日IC（日期索引，因子列）
+        :param count_df: 可选，每日样本数，与ic_df同形
+        :return: 实际追加的行数
+        """
+        last_dates = self.last_dates()
+        long = ic_df.rename_axis('trade_date').reset_index().melt(id_vars='trade_date', var_name='factor', value_name='ic')
+        if count_df is not None:
+            counts = count_df.rename_axis('trade_date').reset_index().melt(id_vars='trade_date', var_name='factor', value_name='n')
+            long = long.merge(counts, on=['trade_date', 'factor'], how='left')
+        else:
+            long['n'] = np.nan
+        long['key'] = long['factor'].map(self.factor_keys(ic_df.columns))
+        date_keys = to_date_key(long['trade_date'])
+        is_new = date_keys > long['key'].map(last_dates).fillna(0).to_numpy()
+        if not is_new.any():
+            return 0
+        # 当日IC为NaN（因子缺失）的日期同样记为已处理，下次不再重复计算
+        last_dates.update({key: int(date) for key, date in
+                           pd.Series(date_keys[is_new], index=long['key'].to_numpy()[is_new]).groupby(level=0).max().items()})
+        new = long[is_new & long['ic'].notna().to_numpy()].copy()
+        new['ic'] = new['ic'].astype(np.float64)
+
+        if not new.empty:
+            self._accumulate(new)
+        with open(self._path('meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'last_dates_by_key': last_dates}, f, ensure_ascii=False)
+        return len(new)
+
+    def _accumulate(self, new):
+        daily = self._extend('daily.parquet', DAILY_COLUMNS, new[DAILY_COLUMNS])
+        self._write('daily.parquet', daily.sort_values(['factor', 'key', 'trade_date']).reset_index(drop=True))
+
+        new = new.assign(month=new['trade_date'].dt.strftime('%Y-%m'), ic_sq=new['ic'] ** 2)
+        increments = new.groupby(['month', 'factor', 'key']).agg(
+            n=('ic', 'size'), ic_sum=('ic', 'sum'), ic_sumsq=('ic_sq', 'sum')).reset_index()
+        monthly = self._extend('monthly.parquet', MONTHLY_COLUMNS, increments)
+        self._write('monthly.parquet', monthly.groupby(['month', 'factor', 'key'], as_index=False).sum())
+
+    def _current(self, df, factor_cols):
+        """
+        只保留当前因子列表及其当前键的历史
+        """
+        return df[df['key'].isin(set(self.factor_keys(factor_cols).values()))]
+
+    def daily_ic(self, factor_cols):
+        """
+        每日IC宽表（日期索引，factor_cols列）
+        """
+        daily = self._current(self._read('daily.parquet', DAILY_COLUMNS), factor_cols)
+        return daily.pivot(index='trade_date', columns='factor', values='ic').reindex(columns=list(factor_cols))
+
+    def monthly_stats(self, factor_cols, last_n=None):
+        """
+        由月度累计量得到月度IC均值和ICIR（与calculate_monthly_icir一致：标准差为样本标准差）
+        :param factor_cols: 当前因子列表，只返回这些因子当前键的统计
+        :param last_n: 可选，只取最近N个月
+        :return: 月度IC, 月度ICIR（月份索引'YYYY-MM'，factor_cols列）
+        """
+        monthly = self._current(self._read('monthly.parquet', MONTHLY_COLUMNS), factor_cols)
+        n = monthly.pivot(index='month', columns='factor', values='n').sort_index().reindex(columns=list(factor_cols))
+        if last_n is not None:
+            n = n.iloc[-last_n:]
+        ic_sum = monthly.pivot(index='month', columns='factor', values='ic_sum').reindex(index=n.index, columns=n.columns)
+        ic_sumsq = monthly.pivot(index='month', columns='factor', values='ic_sumsq').reindex(index=n.index, columns=n.columns)
+        monthly_ic = ic_sum / n
+        variance = (ic_sumsq - ic_sum ** 2 / n) / (n - 1)
+        icir_df = monthly_ic / np.sqrt(variance.clip(lower=0))
+        return monthly_ic, icir_df
+
+    def update(self, all_data, factor_cols=None, prices=None):
+        """
+        计算并追加新实现的每日IC：已存储的因子只计算其最后日期之后的日期，新出现的因子（或键变化的因子）计算全部已实现日期
+        :param all_data: 包含因子列的日频数据（可已按股票池过滤）
+        :param prices: 可选，含ts_code, trade_date和价格列的完整行情（不按股票池过滤，默认all_data），
+                       交易日历和未来收益都由它确定
+        :return: 追加的行数
+        """
+        if factor_cols is None:
+            factor_cols = get_factor_columns(all_data)
+        if not factor_cols:
+            return 0
+        prices = all_data if prices is None else prices
+        keys = self.factor_keys(factor_cols)
+        last_dates = self.last_dates()
+        start = min(last_dates.get(keys[factor], 0) for factor in factor_cols)
+
+        price_dates = to_date_key(prices['trade_date'])
+        calendar = np.unique(price_dates[price_dates > start])
+        if len(calendar) <= self.horizon:
+            return 0
+        realized = calendar[:-self.horizon]
+
+        symbols, price_panels = long_to_panel(prices[price_dates > start], [self.price_col], dates=calendar)[1:]
+        returns = forward_returns(price_panels[self.price_col], [self.horizon])[0][:-self.horizon]
+        date_keys = to_date_key(all_data['trade_date'])
+        rows = (date_keys > start) & (date_keys <= realized[-1])
+        _, _, panels = long_to_panel(all_data[rows], factor_cols, dates=realized, symbols=symbols)
+        ic, count = rank_ic(np.stack([panels[factor] for factor in factor_cols], axis=-1), returns)
+
+        index = pd.DatetimeIndex(from_date_key(realized), name='trade_date')
+        return self.append(pd.DataFrame(ic, index=index, columns=factor_cols),
+                           pd.DataFrame(count, index=index, columns=factor_cols))
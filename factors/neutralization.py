@@ -0,0 +1,98 @@
+# neutralization.py
+# 因子中性化：每个交易日把因子对 行业哑变量 + 对数市值 做截面回归，保留残差
+# 同一日期所有因子共用一个设计矩阵，按正规方程 (X'X + λI)β = X'Y 对所有日期批量求解，不逐日逐因子做OLS
+
+import numpy as np
+from factors.preprocessing import FactorBlock, zscore
+from utils.panel_store import long_to_panel
+
+# 正规方程的岭项：保证当日没有股票的行业列（X'X对角为0）也可求解，对残差几乎没有影响
+NEUTRALIZE_RIDGE = 1e-6
+
+
+def industry_codes(symbols, stock_basic, column='industry'):
+    """
+    按stock_basic的行业字段给股票编号
+    :return: (codes, industries)，codes与symbols对齐，没有行业的股票为-1
+    """
+    industry = stock_basic.drop_duplicates('ts_code').set_index('ts_code')[column]
+    industry = industry.reindex(np.asarray(symbols).astype(str))
+    industry = industry.where(industry.notna() & (industry.astype(str) != ''))
+    codes, industries = industry.factorize()
+    return codes.astype(np.int64), np.asarray(industries)
+
+
+def _neutralize_chunk(values, onehot, codes, log_mcap, ridge):
+    missing = np.isnan(values)
+    # 参与回归的样本：有行业、有市值、至少有一个因子值
+    sample = (codes >= 0)[None, :] & ~np.isnan(log_mcap) & ~missing.all(axis=-1)
+    observed = sample[:, :, None] & ~missing
+
+    # 市值按日去均值改善条件数（行业哑变量已包含截距，残差不变）
+    size = np.where(sample, log_mcap, 0.0)
+    size = np.where(sample, size - (size.sum(axis=1) / np.maximum(sample.sum(axis=1), 1))[:, None], 0.0)
+    # 设计矩阵 [n_dates, n_stocks, n_industries + 1]，样本外的股票整行为0（不参与回归）
+    design = np.empty(sample.shape + (onehot.shape[1] + 1,), dtype=np.float32)
+    np.multiply(onehot[None, :, :], sample[:, :, None], out=design[:, :, :-1])
+    design[:, :, -1] = size
+
+    # 共用设计矩阵，个别缺失的因子值用当日均值代替（回归后恢复为NaN）
+    # （预处理时已填充缺失值的因子块没有这种情况）
+    y = np.where(observed, values, np.float32(0))
+    imputed = sample[:, :, None] & missing
+    if imputed.any():
+        mean = (y.sum(axis=1) / np.maximum(observed.sum(axis=1), 1)).astype(np.float32)
+        y = np.where(imputed, mean[:, None, :], y)
+
+    xt = design.transpose(0, 2, 1)
+    xtx = (xt @ design).astype(np.float64)
+    xtx[:, np.arange(xtx.shape[1]), np.arange(xtx.shape[1])] += ridge
+    beta = np.linalg.solve(xtx, (xt @ y).astype(np.float64)).astype(np.float32)
+    return np.where(observed, values - design @ beta, np.nan)
+
+
+def neutralize_block(values, codes, log_mcap, ridge=NEUTRALIZE_RIDGE, chunk_size=64):
+    """
+    批量截面回归取残差（按日期分块控制内存）
+    :param values: 因子块 [n_dates, n_stocks, n_factors]
+    :param codes: 股票行业编号 [n_stocks]（-1为无行业）
+    :param log_mcap: 对数市值面板 [n_dates, n_stocks]
+    :return: float32残差 [n_dates, n_stocks, n_factors]；没有行业或市值的股票、原值为NaN的位置为NaN
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    n_industries = int(codes.max()) + 1 if len(codes) else 0
+    onehot = np.zeros((len(codes), n_industries), dtype=np.float32)
+    has_industry = codes >= 0
+    onehot[np.flatnonzero(has_industry), codes[has_industry]] = 1.0
+
+    values = np.asarray(values, dtype=np.float32)
+    residuals = np.empty(values.shape, dtype=np.float32)
+    for start in range(0, values.shape[0], chunk_size):
+        end = start + chunk_size
+        residuals[start:end] = _neutralize_chunk(values[start:end], onehot, codes, log_mcap[start:end], ridge)
+    return residuals
+
+
+def neutralize_factors(factor_block, df, stock_basic, mcap_col='total_mv', standardize=True, fill=True):
+    """
+    对因子块做行业+市值中性化
+    :param factor_block: 预处理后的因子块（factors.preprocessing.FactorBlock）
+    :param df: 含ts_code, trade_date和市值列的日频数据
+    :param stock_basic: 股票基础信息（含industry）
+    :param standardize: 残差是否重新截面标准化
+    :param fill: 标准化后是否把参与回归的 股票×日期 的缺失值填0（与preprocess_factors一致）
+    :return: 新的FactorBlock（因子名不变）
+    """
+    _, _, panels = long_to_panel(df, [mcap_col], dates=factor_block.dates, symbols=factor_block.symbols)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        log_mcap = np.log(np.where(panels[mcap_col] > 0, panels[mcap_col], np.nan).astype(np.float64))
+    codes, _ = industry_codes(factor_block.symbols, stock_basic)
+
+    residuals = neutralize_block(factor_block.values, codes, log_mcap)
+    if standardize:
+        residuals = zscore(residuals.astype(np.float64))
+        if fill:
+            # 参与回归的 股票×日期 缺失值填0，缺少行业或市值（残差整行为NaN）的保持NaN
+            regressed = ~np.isnan(residuals).all(axis=-1, keepdims=True)
+            residuals = np.where(regressed, np.nan_to_num(residuals), np.nan)
+    return FactorBlock(factor_block.dates, factor_block.symbols, factor_block.factors, residuals.astype(np.float32))
@@ -0,0 +1,281 @@
+# online_factors.py
+# 技术因子的增量（在线）计算：每只股票维护环形缓冲区、滚动和及EMA状态，
+# 每新增一个交易日只做 O(股票数 × 因子数) 的更新，不重算全部历史
+# 计算口径与 technical_factors.calculate_technical_factors 一致（RSI为14日简单均值口径）
+
+import json
+import numpy as np
+import pandas as pd
+from config import TECHNICAL_FACTOR_WINDOWS
+
+
+class _RollingWindows:
+    """
+    多窗口滚动和：一个环形缓冲区（长度为最大窗口）+ 每个窗口的 sum / sumsq / 有效值个数
+    窗口内存在缺失值时结果为NaN（同pandas rolling默认min_periods=window）
+    加减递推的浮点误差会累积，每只股票每写满一轮缓冲区（观测数为length的整数倍）时由缓冲区重算一次
+    """
+
+    def __init__(self, windows, n_stocks):
+        self.windows = list(windows)
+        self.length = max(self.windows)
+        self.buffer = np.full((self.length, n_stocks), np.nan)
+        self.sums = {w: np.zeros(n_stocks) for w in self.windows}
+        self.sumsqs = {w: np.zeros(n_stocks) for w in self.windows}
+        self.counts = {w: np.zeros(n_stocks, dtype=np.int64) for w in self.windows}
+
+    def extend(self, n_new):
+        self.buffer = np.hstack([self.buffer, np.full((self.length, n_new), np.nan)])
+        for w in self.windows:
+            self.sums[w] = np.append(self.sums[w], np.zeros(n_new))
+            self.sumsqs[w] = np.append(self.sumsqs[w], np.zeros(n_new))
+            self.counts[w] = np.append(self.counts[w], np.zeros(n_new, dtype=np.int64))
+
+    def push(self, cols, n_obs, values):
+        """
+        写入一批股票的新值
+        :param cols: 股票列下标
+        :param n_obs: 这些股票写入前已有的观测数（即新值在股票内的序号）
+        :param values: 新值
+        """
+        valid = ~np.isnan(values)
+        new = np.where(valid, values, 0.0)
+        for w in self.windows:
+            # 移出窗口的值：序号为 n_obs - w 的观测
+            has_old = n_obs >= w
+            old = self.buffer[(n_obs - w) % self.length, cols]
+            old_valid = has_old & ~np.isnan(old)
+            old = np.where(old_valid, old, 0.0)
+            self.sums[w][cols] += new - old
+            self.sumsqs[w][cols] += new * new - old * old
+            self.counts[w][cols] += valid.astype(np.int64) - old_valid.astype(np.int64)
+        self.buffer[n_obs % self.length, cols] = values
+        refresh = (n_obs + 1) % self.length == 0
+        if refresh.any():
+            self._recompute(cols[refresh], n_obs[refresh] + 1)
+
+    def _recompute(self, cols, n_obs):
+        """
+        由缓冲区重算这些股票的 sum / sumsq / 有效值个数（n_obs >= length，缓冲区内都是实际观测）
+        """
+        # 按时间倒序取最近length个观测：第k列为序号 n_obs - 1 - k 的观测
+        rows = (n_obs[:, None] - 1 - np.arange(self.length)[None, :]) % self.length
+        recent = self.buffer[rows, cols[:, None]]
+        valid = ~np.isnan(recent)
+        recent = np.where(valid, recent, 0.0)
+        for w in self.windows:
+            self.sums[w][cols] = recent[:, :w].sum(axis=1)
+            self.sumsqs[w][cols] = (recent[:, :w] ** 2).sum(axis=1)
+            self.counts[w][cols] = valid[:, :w].sum(axis=1)
+
+    def full(self, cols, window):
+        return self.counts[window][cols] == window
+
+    def mean(self, cols, window):
+        return np.where(self.full(cols, window), self.sums[window][cols] / window, np.nan)
+
+    def std(self, cols, window):
+        s1 = self.sums[window][cols]
+        var = (self.sumsqs[window][cols] - s1 * s1 / window) / (window - 1)
+        return np.where(self.full(cols, window), np.sqrt(np.maximum(var, 0.0)), np.nan)
+
+    def state(self, prefix):
+        arrays = {f'{prefix}buffer': self.buffer}
+        for w in self.windows:
+            arrays[f'{prefix}sum_{w}'] = self.sums[w]
+            arrays[f'{prefix}sumsq_{w}'] = self.sumsqs[w]
+            arrays[f'{prefix}count_{w}'] = self.counts[w]
+        return arrays
+
+    def restore(self, prefix, arrays):
+        self.buffer = arrays[f'{prefix}buffer']
+        for w in self.windows:
+            self.sums[w] = arrays[f'{prefix}sum_{w}']
+            self.sumsqs[w] = arrays[f'{prefix}sumsq_{w}']
+            self.counts[w] = arrays[f'{prefix}count_{w}']
+
+
+def _ema_step(prev, cur, alpha, first):
+    """
+    EMA递推一步（同group_ema）：首个观测取原值，缺失值沿用上一期，上一期缺失时从当前值开始
+    """
+    ema = np.where(np.isnan(prev), cur, alpha * cur + (1 - alpha) * prev)
+    ema = np.where(np.isnan(cur), prev, ema)
+    return np.where(first, cur, ema)
+
+
+class OnlineTechnicalState:
+    """
+    技术因子在线状态（按股票代码列存储），update()每次接收一个交易日的行情并返回当日因子值
+    - 动量：收盘价环形缓冲区（长度为最大窗口+1）
+    - 波动率：日收益率的多窗口滚动 sum / sumsq
+    - 均线/乖离率：收盘价多窗口滚动 sum
+    - 换手率：成交量/流通股本的20日滚动 sum
+    - MACD：短期、长期、信号线三个EMA状态
+    - RSI：涨幅/跌幅的14日滚动 sum（与批量计算的简单均值口径一致）
+    """
+
+    def __init__(self, symbols=(), windows=None, macd_windows=(12, 26, 9), rsi_window=14, turnover_window=20):
+        self.windows = list(windows or TECHNICAL_FACTOR_WINDOWS)
+        self.macd_windows = tuple(macd_windows)
+        self.rsi_window = rsi_window
+        self.turnover_window = turnover_window
+        self.last_date = 0
+
+        self.symbols = np.array([], dtype=str)
+        self._symbol_index = {}
+        self.n_obs = np.zeros(0, dtype=np.int64)
+        self.last_close = np.zeros(0)
+        self.close_length = max(self.windows) + 1
+        self.close_buffer = np.full((self.close_length, 0), np.nan)
+        self.emas = np.full((3, 0), np.nan)  # 短期EMA、长期EMA、信号线
+        self.close_sums = _RollingWindows(self.windows, 0)
+        self.return_sums = _RollingWindows(self.windows, 0)
+        self.turnover_sums = _RollingWindows([self.turnover_window], 0)
+        self.rsi_sums = {'gain': _RollingWindows([self.rsi_window], 0), 'loss': _RollingWindows([self.rsi_window], 0)}
+        self._add_symbols(symbols)
+
+    def _rolling(self):
+        return [self.close_sums, self.return_sums, self.turnover_sums, self.rsi_sums['gain'], self.rsi_sums['loss']]
+
+    def _add_symbols(self, codes):
+        """
+        新出现的股票（如新上市）追加到状态末尾
+        """
+        new = [code for code in pd.unique(np.asarray(codes, dtype=str)) if code not in self._symbol_index]
+        if not new:
+            return
+        n_new = len(new)
+        for code in new:
+            self._symbol_index[code] = len(self._symbol_index)
+        self.symbols = np.append(self.symbols, new)
+        self.n_obs = np.append(self.n_obs, np.zeros(n_new, dtype=np.int64))
+        self.last_close = np.append(self.last_close, np.full(n_new, np.nan))
+        self.close_buffer = np.hstack([self.close_buffer, np.full((self.close_length, n_new), np.nan)])
+        self.emas = np.hstack([self.emas, np.full((3, n_new), np.nan)])
+        for rolling in self._rolling():
+            rolling.extend(n_new)
+
+    def update(self, bars):
+        """
+        接收一个交易日的行情，更新状态并返回当日因子
+        :param bars: 当日行情（ts_code, trade_date, close，可选 vol, float_share），每只股票一行
+        :return: 当日因子DataFrame（列与calculate_technical_factors新增的列一致）
+        """
+        codes = bars['ts_code'].astype(str).to_numpy()
+        self._add_symbols(codes)
+        cols = np.array([self._symbol_index[code] for code in codes], dtype=np.int64)
+        n_obs = self.n_obs[cols]
+        close = bars['close'].to_numpy(dtype=np.float64)
+        first = n_obs == 0
+        out = {}
+
+        # 动量：与 w 个观测之前的收盘价比较
+        for w in self.windows:
+            past = self.close_buffer[(n_obs - w) % self.close_length, cols]
+            out[f'momentum_{w}'] = np.where(n_obs >= w, close / past - 1, np.nan)
+        self.close_buffer[n_obs % self.close_length, cols] = close
+
+        # 日收益率和价格差分（首个观测为NaN，与批量计算的段内平移一致）
+        prev_close = np.where(first, np.nan, self.last_close[cols])
+        returns = close / prev_close - 1
+        delta = close - prev_close
+        self.last_close[cols] = close
+
+        self.return_sums.push(cols, n_obs, returns)
+        for w in self.windows:
+            out[f'volatility_{w}'] = self.return_sums.std(cols, w)
+
+        self.close_sums.push(cols, n_obs, close)
+        for w in self.windows:
+            ma = self.close_sums.mean(cols, w)
+            out[f'ma_{w}'] = ma
+            out[f'bias_{w}'] = (close - ma) / ma
+
+        if 'float_share' in bars.columns:
+            turnover = bars['vol'].to_numpy(dtype=np.float64) / bars['float_share'].to_numpy(dtype=np.float64)
+        else:
+            turnover = np.full(len(bars), np.nan)
+        self.turnover_sums.push(cols, n_obs, turnover)
+        out['turnover_rate'] = turnover
+        out['avg_turnover_20'] = self.turnover_sums.mean(cols, self.turnover_window)
+
+        short, long_, signal = self.macd_windows
+        ema_short = _ema_step(self.emas[0, cols], close, 2.0 / (short + 1), first)
+        ema_long = _ema_step(self.emas[1, cols], close, 2.0 / (long_ + 1), first)
+        macd = ema_short - ema_long
+        macd_signal = _ema_step(self.emas[2, cols], macd, 2.0 / (signal + 1), first)
+        self.emas[:, cols] = np.vstack([ema_short, ema_long, macd_signal])
+        out['macd'] = macd
+        out['macd_signal'] = macd_signal
+        out['macd_hist'] = macd - macd_signal
+
+        # 首个观测差分为NaN时记为0，与批量计算一致
+        self.rsi_sums['gain'].push(cols, n_obs, np.where(delta > 0, delta, 0.0))
+        self.rsi_sums['loss'].push(cols, n_obs, np.where(delta < 0, -delta, 0.0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rs = self.rsi_sums['gain'].mean(cols, self.rsi_window) / self.rsi_sums['loss'].mean(cols, self.rsi_window)
+            out['rsi'] = 100 - 100 / (1 + rs)
+
+        self.n_obs[cols] += 1
+        self.last_date = int(pd.to_datetime(bars['trade_date']).max().strftime('%Y%m%d')) if len(bars) else self.last_date
+
+        result = bars[['ts_code', 'trade_date']].reset_index(drop=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for name, values in out.items():
+                result[name] = np.asarray(values, dtype=np.float32)
+        return result
+
+    @classmethod
+    def from_history(cls, df, **kwargs):
+        """
+        用历史行情逐日回放建立状态（只需在首次上线时执行一次）
+        :return: (state, 历史每日因子DataFrame)
+        """
+        state = cls(**kwargs)
+        df = df.sort_values(['trade_date', 'ts_code'], kind='stable')
+        frames = [state.update(bars) for _, bars in df.groupby('trade_date', sort=True)]
+        history = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        return state, history
+
+    def save(self, path):
+        """
+        状态序列化为单个.npz文件（参数存为JSON字符串）
+        """
+        params = {
+            'windows': self.windows,
+            'macd_windows': list(self.macd_windows),
+            'rsi_window': self.rsi_window,
+            'turnover_window': self.turnover_window,
+            'last_date': self.last_date,
+        }
+        arrays = {
+            'params': np.array(json.dumps(params)),
+            'symbols': self.symbols.astype(str),
+            'n_obs': self.n_obs,
+            'last_close': self.last_close,
+            'close_buffer': self.close_buffer,
+            'emas': self.emas,
+        }
+        for prefix, rolling in zip(['ma_', 'return_', 'turnover_', 'gain_', 'loss_'], self._rolling()):
+            arrays.update(rolling.state(prefix))
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+        params = json.loads(str(arrays['params']))
+        state = cls(windows=params['windows'], macd_windows=params['macd_windows'],
+                    rsi_window=params['rsi_window'], turnover_window=params['turnover_window'])
+        state.last_date = params['last_date']
+        state.symbols = arrays['symbols']
+        state._symbol_index = {code: i for i, code in enumerate(state.symbols)}
+        state.n_obs = arrays['n_obs']
+        state.last_close = arrays['last_close']
+        state.close_buffer = arrays['close_buffer']
+        state.emas = arrays['emas']
+        for prefix, rolling in zip(['ma_', 'return_', 'turnover_', 'gain_', 'loss_'], state._rolling()):
+            rolling.restore(prefix, arrays)
+        return state
@@ -0,0 +1,121 @@
+# parallel_factors.py
+# 多进程分片计算因子：按股票把已排序的长表切成若干分片，输入列和输出面板都放在共享内存中，
+# 子进程只接收共享内存名称和行区间，不序列化DataFrame；每个分片的因子直接写入预分配的共享输出面板
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from config import FACTOR_MAX_WORKERS
+from factors.factor_registry import REGISTRY, FactorRegistry
+from factors.segment_ops import segment_positions
+
+
+def shard_bounds(pos, n_shards):
+    """
+    按行数大致均分，分片边界只落在股票首行，保证同一股票不会跨分片
+    :return: [(start, end), ...]
+    """
+    starts = np.flatnonzero(pos == 0)
+    n_rows = len(pos)
+    targets = np.linspace(0, n_rows, n_shards + 1)[1:-1]
+    cuts = np.unique(starts[np.minimum(np.searchsorted(starts, targets), len(starts) - 1)])
+    bounds = np.concatenate(([0], cuts[cuts > 0], [n_rows]))
+    return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def _attach(name, shape, dtype):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _compute_shard(task):
+    """
+    子进程：从共享内存读取分片输入，计算因子并写入共享输出面板
+    """
+    # spawn方式启动的子进程需要重新导入因子模块完成注册
+    import factors.technical_factors  # noqa: F401
+
+    (input_name, input_shape, columns), (output_name, output_shape), pos_name, names, start, end, extra_nodes = task
+    registry = REGISTRY
+    if extra_nodes:
+        # 调用方注册表中全局注册表没有的节点（如非默认窗口的MACD/RSI），在子进程的注册表副本中补上
+        registry = FactorRegistry()
+        registry.nodes = {**REGISTRY.nodes, **extra_nodes}
+    input_shm, inputs = _attach(input_name, input_shape, np.float64)
+    output_shm, outputs = _attach(output_name, output_shape, np.float32)
+    pos_shm, pos = _attach(pos_name, (input_shape[1],), np.int64)
+    try:
+        shard = pd.DataFrame({column: inputs[i, start:end] for i, column in enumerate(columns)})
+        values = registry.evaluate(shard, names, pos[start:end])
+        for i, name in enumerate(names):
+            outputs[i, start:end] = values[name]
+    finally:
+        del inputs, outputs, pos
+        input_shm.close()
+        output_shm.close()
+        pos_shm.close()
+    return end - start
+
+
+def _to_shared(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+    return shm
+
+
+def evaluate_parallel(df, names, pos, n_workers=FACTOR_MAX_WORKERS, registry=REGISTRY):
+    """
+    在已按(ts_code, trade_date)排序的df上多进程计算因子
+    :param registry: 注册表（子进程使用全局注册表，registry中全局注册表没有的节点随任务传给子进程，节点函数需可pickle）
+    :return: {name: float32数组}
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    pos = np.asarray(pos, dtype=np.int64)
+    if n_workers == 1 or len(df) == 0:
+        values = registry.evaluate(df, names, pos)
+        return {name: values[name].astype(np.float32) for name in names}
+
+    extra_nodes = {name: node for name, node in registry.nodes.items() if REGISTRY.nodes.get(name) is not node}
+    columns = sorted(set().union(*[registry.leaf_columns(name) for name in names]) & set(df.columns))
+    # 输入列 [n_columns, n_rows] float64，输出面板 [n_factors, n_rows] float32
+    inputs = np.stack([df[column].to_numpy(dtype=np.float64) for column in columns]) if columns \
+        else np.zeros((0, len(df)))
+    input_shm = _to_shared(inputs)
+    pos_shm = _to_shared(pos)
+    output_shm = shared_memory.SharedMemory(create=True, size=max(len(names) * len(df) * 4, 1))
+    try:
+        # 分片数多于进程数，平衡不同股票历史长度带来的负载差异
+        tasks = [((input_shm.name, inputs.shape, columns), (output_shm.name, (len(names), len(df))),
+                  pos_shm.name, list(names), start, end, extra_nodes)
+                 for start, end in shard_bounds(pos, n_workers * 4)]
+        del inputs
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(_compute_shard, tasks))
+        outputs = np.ndarray((len(names), len(df)), dtype=np.float32, buffer=output_shm.buf)
+        results = {name: outputs[i].copy() for i, name in enumerate(names)}
+        del outputs
+    finally:
+        for shm in (input_shm, pos_shm, output_shm):
+            shm.close()
+            shm.unlink()
+    return results
+
+
+def compute_factors_parallel(df, names, n_workers=FACTOR_MAX_WORKERS, registry=REGISTRY):
+    """
+    多进程分片计算因子，结果与compute_factors一致
+    :param df: 行情数据（ts_code, trade_date及因子依赖的原始列）
+    :param names: 需要输出的因子名列表
+    :param n_workers: 进程数，默认取配置（None为CPU核数）
+    :param registry: 注册表（默认全局注册表）
+    :return: 按(ts_code, trade_date)排序的df（增加names对应的float32列）
+    """
+    df = df.sort_values(['ts_code', 'trade_date'], kind='stable').reset_index(drop=True)
+    codes = df['ts_code']
+    codes = codes.cat.codes.to_numpy() if isinstance(codes.dtype, pd.CategoricalDtype) else codes.to_numpy()
+    values = evaluate_parallel(df, names, segment_positions(codes), n_workers, registry=registry)
+    for name in names:
+        df[name] = values[name]
+    return df
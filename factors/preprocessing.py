@@ -0,0 +1,252 @@
+# preprocessing.py
+# 截面预处理：把多个因子组成 date×stock×factor 三维块，一次性对所有日期、所有因子做
+# 去极值（MAD/分位数）、标准化、排名和缺失值填充（全部为沿股票轴的NaN感知数组运算，不逐日groupby）
+# 结果保存在FactorBlock中，供IC计算、综合评分和机器学习模型共用
+
+import warnings
+import numpy as np
+from utils.panel_store import long_to_panel, panel_to_long, PanelStore
+from utils.schema import to_date_key
+
+# MAD换算为标准差的一致性系数（正态分布下 1.4826 × MAD ≈ σ）
+MAD_SCALE = 1.4826
+
+
+def _quiet(func, *args, **kwargs):
+    """
+    全为NaN的截面会触发nanmedian等的空切片警告，结果为NaN即可
+    """
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return func(*args, **kwargs)
+
+
+def _nanmedian(block, axis=1):
+    """
+    沿axis的NaN感知中位数（排序后按有效个数取中间位置，比np.nanmedian快数倍），保留维度
+    """
+    ordered = np.sort(block, axis=axis)  # NaN排在最后
+    count = np.sum(~np.isnan(block), axis=axis, keepdims=True)
+    low = np.take_along_axis(ordered, np.maximum((count - 1) // 2, 0), axis=axis)
+    high = np.take_along_axis(ordered, np.maximum(count // 2, 0) - (count == 0), axis=axis)
+    return np.where(count > 0, (low + high) / 2, np.nan)
+
+
+def winsorize_mad(block, n_mad=5.0):
+    """
+    每个日期、每个因子按 中位数 ± n_mad × 1.4826 × MAD 截断
+    :param block: [n_dates, n_stocks, n_factors]
+    """
+    median = _nanmedian(block)
+    mad = _nanmedian(np.abs(block - median)) * MAD_SCALE
+    # 过半股票取值相同（MAD为0）时不截断，避免整个截面被压成中位数
+    return np.where(mad > 0, np.clip(block, median - n_mad * mad, median + n_mad * mad), block)
+
+
+def winsorize_percentile(block, lower=0.01, upper=0.99):
+    """
+    每个日期、每个因子按截面分位数截断
+    """
+    bounds = _quiet(np.nanquantile, block, [lower, upper], axis=1, keepdims=True)
+    return np.clip(block, bounds[0], bounds[1])
+
+
+def zscore(block):
+    """
+    每个日期、每个因子截面标准化（样本标准差）
+    """
+    valid = ~np.isnan(block)
+    count = valid.sum(axis=1, keepdims=True)
+    filled = np.where(valid, block, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = filled.sum(axis=1, keepdims=True) / count
+        var = np.where(valid, (block - mean) ** 2, 0.0).sum(axis=1, keepdims=True) / (count - 1)
+        return (block - mean) / (np.sqrt(var) + 1e-8)
+
+
+def tie_bounds(ordered):
+    """
+    已沿axis=1升序排列的二维数组中，每个位置所在并列组的首、末位置（NaN与任何值不等，各自成组）
+    :return: (first, last) int32数组
+    """
+    n = ordered.shape[1]
+    start = np.ones(ordered.shape, dtype=bool)
+    start[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    end = np.ones(ordered.shape, dtype=bool)
+    end[:, :-1] = start[:, 1:]
+    idx = np.arange(n, dtype=np.int32)
+    first = np.maximum.accumulate(np.where(start, idx, 0), axis=1)
+    last = np.minimum.accumulate(np.where(end, idx, n)[:, ::-1], axis=1)[:, ::-1]
+    return first, last
+
+
+def _average_rank_sorted(ordered):
+    """
+    已沿最后一轴升序排列（NaN在最后）的数组中每个位置的平均名次（从1开始，并列取平均），只修正存在并列值的行
+    """
+    shape, n = ordered.shape, ordered.shape[-1]
+    ordered = ordered.reshape(-1, n)
+    ranks = np.broadcast_to(np.arange(1, n + 1, dtype=np.float64), ordered.shape).copy()
+    rows = np.flatnonzero((ordered[:, 1:] == ordered[:, :-1]).any(axis=1))
+    if len(rows):
+        first, last = tie_bounds(ordered[rows])
+        ranks[rows] = (first + last) / 2 + 1
+    return ranks.reshape(shape)
+
+
+def argsort_nan_last(values, axis=-1):
+    """
+    NaN排在最后的argsort：排序前把NaN换成正无穷（含NaN时numpy排序退出向量化快速路径，慢数倍），
+    原有的正无穷换成最大有限值，仍排在NaN之前
+    """
+    largest = np.finfo(values.dtype).max if np.issubdtype(values.dtype, np.floating) else None
+    if largest is None:
+        return np.argsort(values, axis=axis)
+    keys = np.where(values == np.inf, largest, values)
+    keys[np.isnan(keys)] = np.inf
+    return np.argsort(keys, axis=axis)
+
+
+def rank_block(block, pct=True, axis=1):
+    """
+    每个日期、每个因子截面排名，并列取平均名次（同pandas rank(pct=True)），NaN保持NaN
+    排名轴换到最后一维连续存放后排序一次，按并列组首末位置计算平均名次
+    :param axis: 股票所在的轴（默认[n_dates, n_stocks, n_factors]的第1维）
+    """
+    values = np.ascontiguousarray(np.moveaxis(block, axis, -1))
+    order = argsort_nan_last(values)
+    ranks = np.empty(values.shape, dtype=np.float64)
+    np.put_along_axis(ranks, order, _average_rank_sorted(np.sort(values, axis=-1)), axis=-1)
+    missing = np.isnan(values)
+    ranks[missing] = np.nan
+    if pct:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ranks /= np.sum(~missing, axis=-1, keepdims=True)
+    return np.moveaxis(ranks, -1, axis)
+
+
+def fill_missing(block, value=0.0):
+    """
+    缺失值填充（标准化之后填0即截面均值）
+    """
+    return np.where(np.isnan(block), value, block)
+
+
+class FactorBlock:
+    """
+    date×stock×factor 因子块
+    - values：预处理后的因子值 [n_dates, n_stocks, n_factors]
+    - ranks：截面百分位排名（首次访问时计算并缓存）
+    """
+
+    def __init__(self, dates, symbols, factors, values):
+        self.dates = np.asarray(dates)
+        self.symbols = np.asarray(symbols)
+        self.factors = list(factors)
+        self.values = values
+        self._ranks = None
+
+    @property
+    def ranks(self):
+        if self._ranks is None:
+            self._ranks = rank_block(self.values).astype(np.float32)
+        return self._ranks
+
+    def filled(self, value=0.0):
+        """
+        缺失值填充后的新因子块：只填充至少有一个因子值的 股票×日期（用于综合评分等不能处理NaN的环节，
+        IC、分层回测和相关性分析应使用未填充的因子块，避免填充值在截面中间形成大量并列）
+        """
+        present = ~np.isnan(self.values).all(axis=-1, keepdims=True)
+        values = np.where(present, fill_missing(self.values, value), np.nan).astype(np.float32)
+        return FactorBlock(self.dates, self.symbols, self.factors, values)
+
+    def factor(self, name):
+        """
+        单个因子的 [n_dates, n_stocks] 面板
+        """
+        return self.values[:, :, self.factors.index(name)]
+
+    def to_long(self, dropna=True):
+        """
+        因子块 -> 长表（ts_code, trade_date, 各因子列）
+        """
+        return panel_to_long(self.dates, self.symbols, {name: self.factor(name) for name in self.factors},
+                             dropna=dropna)
+
+    def lookup(self, df, date_col='trade_date'):
+        """
+        取与df逐行对齐的预处理因子值 [n_rows, n_factors]（不在块内的行为NaN）
+        """
+        date_keys = to_date_key(df[date_col])
+        codes = df['ts_code'].astype(str).to_numpy()
+        row = np.searchsorted(self.dates, date_keys)
+        col = np.searchsorted(self.symbols, codes)
+        valid = (row < len(self.dates)) & (col < len(self.symbols))
+        valid[valid] = (self.dates[row[valid]] == date_keys[valid]) & (self.symbols[col[valid]] == codes[valid])
+        result = np.full((len(df), len(self.factors)), np.nan, dtype=np.float32)
+        result[valid] = self.values[row[valid], col[valid]]
+        return result
+
+    def save(self, root):
+        """
+        保存为面板存储（每个因子一个内存映射文件）
+        """
+        store = PanelStore.create(root, self.dates, self.symbols)
+        for name in self.factors:
+            store.write(name, self.factor(name))
+        store.save_meta(factors=self.factors)
+        return store
+
+    @classmethod
+    def load(cls, root):
+        store = PanelStore(root)
+        factors = store.load_meta()['factors']
+        values = np.stack([np.asarray(store[name]) for name in factors], axis=-1)
+        return cls(store.dates, store.symbols, factors, values)
+
+
+def build_factor_block(df, factors, dates=None, symbols=None, mask=None):
+    """
+    长表 -> 原始因子块
+    :param dates/symbols: 可选，块的日历和代码索引（如与股票池对齐）
+    :param mask: 可选，与dates×symbols对齐的布尔掩码，掩码外记为NaN
+    :return: FactorBlock（未预处理）
+    """
+    dates, symbols, panels = long_to_panel(df, factors, dates=dates, symbols=symbols)
+    values = np.stack([panels[name] for name in factors], axis=-1)
+    if mask is not None:
+        values[~mask] = np.nan
+    return FactorBlock(dates, symbols, factors, values)
+
+
+def preprocess_factors(df, factors, winsorize='mad', n_mad=5.0, limits=(0.01, 0.99), standardize=True, fill=True,
+                       universe=None, universe_masks=('tradable',)):
+    """
+    截面预处理主流程：去极值 -> 标准化 -> 缺失值填充，所有日期和因子一次完成
+    :param factors: 需要预处理的因子列
+    :param winsorize: 'mad' 中位数绝对偏差截断；'percentile' 分位数截断；None 不截断
+    :param limits: 分位数截断的上下分位
+    :param fill: 是否把缺失值填为0（只在标准化后有意义；股票池外的位置始终为NaN）
+    :param universe: 可选，股票池（utils.universe.Universe），截面统计只在掩码内的股票上计算
+    :return: FactorBlock
+    """
+    if universe is not None:
+        mask = universe.mask(*universe_masks)
+        block = build_factor_block(df, factors, dates=universe.dates, symbols=universe.symbols, mask=mask)
+    else:
+        block = build_factor_block(df, factors)
+    values = block.values.astype(np.float64)
+    present = ~np.isnan(values).all(axis=-1, keepdims=True)
+
+    if winsorize == 'mad':
+        values = winsorize_mad(values, n_mad)
+    elif winsorize == 'percentile':
+        values = winsorize_percentile(values, *limits)
+    if standardize:
+        values = zscore(values)
+        if fill:
+            # 只填充有行情（至少有一个因子值）的位置，没有数据的 股票×日期 保持NaN
+            values = np.where(present, fill_missing(values), np.nan)
+    block.values = values.astype(np.float32)
+    return block
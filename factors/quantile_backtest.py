@@ -0,0 +1,133 @@
+# quantile_backtest.py
+# 分层回测：每个调仓日把所有因子同时按截面名次分成N组（所有 日期×因子 沿股票轴一次排名），
+# 计算各组等权持有期收益、多空收益（最高组 - 最低组）、各组换手率和累计净值，不逐因子groupby + qcut
+
+import warnings
+import numpy as np
+import pandas as pd
+from config import QUANTILE_GROUPS, QUANTILE_REBALANCE_DAYS
+from factors.factor_analysis import forward_returns
+from factors.preprocessing import rank_block
+from utils.panel_store import long_to_panel
+from utils.schema import from_date_key
+
+# 年化使用的每年交易日数（与utils.performance一致）
+TRADING_DAYS_PER_YEAR = 250
+
+
+def quantile_labels(factor_values, n_groups=QUANTILE_GROUPS):
+    """
+    截面分组：按因子值从小到大等分为n_groups组，按平均名次分组（并列值必在同一组，离散因子各组股票数可能不等）
+    :param factor_values: [n_dates, n_stocks, n_factors]
+    :return: int8 [n_dates, n_factors, n_stocks]，组号0..n_groups-1，因子值缺失为-1
+    """
+    ranks = rank_block(np.moveaxis(factor_values, 1, -1), pct=False, axis=-1)
+    count = (~np.isnan(ranks)).sum(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore'):
+        labels = np.floor((ranks - 1) * n_groups / np.maximum(count, 1))
+    return np.where(np.isnan(labels), -1, labels).astype(np.int8)
+
+
+def _group_cells(labels, n_groups):
+    """
+    每个元素在 (日期, 因子, 组) 展平后的格子号，缺失（-1）放到每个 日期×因子 末尾的额外格子
+    """
+    n_dates, n_factors, _ = labels.shape
+    offset = np.arange(n_dates * n_factors, dtype=np.int64).reshape(n_dates, n_factors, 1) * (n_groups + 1)
+    return (offset + np.where(labels >= 0, labels, n_groups)).ravel()
+
+
+def _group_sums(cells, shape, weights=None):
+    """
+    按格子累加weights（为None时计数）：一次bincount
+    :param shape: (n_dates, n_factors, n_groups)
+    :return: [n_dates, n_factors, n_groups]
+    """
+    n_dates, n_factors, n_groups = shape
+    sums = np.bincount(cells, weights=weights, minlength=n_dates * n_factors * (n_groups + 1))
+    return sums.reshape(n_dates, n_factors, n_groups + 1)[:, :, :n_groups]
+
+
+def _max_drawdown(nav):
+    return (nav / np.maximum.accumulate(nav, axis=0) - 1).min(axis=0)
+
+
+def quantile_backtest(factor_block, prices, n_groups=QUANTILE_GROUPS, period=QUANTILE_REBALANCE_DAYS,
+                      price_col='close', chunk_size=64):
+    """
+    所有因子同时做分层回测：每period个交易日调仓一次，组内等权持有到下一调仓日
+    :param factor_block: 因子块（factors.preprocessing.FactorBlock），组合构建在块内有因子值的股票上进行
+    :param prices: 含ts_code, trade_date和价格列的日频数据（与因子块按日期键和代码对齐）
+    :return: (summary, nav)
+             summary：每个 因子×组（Q1..Qn为因子值从低到高，LS为多空）一行，
+                      mean_return（每期）、ann_return、ann_vol、sharpe、max_drawdown、turnover（每期单边）、
+                      monotonicity（各组平均收益与组号的秩相关，每个因子一个值）
+             nav：调仓日索引，(factor, group) 两级列的累计净值（float32）
+    """
+    _, _, panels = long_to_panel(prices, [price_col], dates=factor_block.dates, symbols=factor_block.symbols)
+    rebalance = np.arange(0, len(factor_block.dates), period)
+    returns = forward_returns(panels[price_col], [period])[0][rebalance]
+    n_dates, n_factors = len(rebalance), len(factor_block.factors)
+
+    group_returns = np.full((n_dates, n_factors, n_groups), np.nan)
+    turnover = np.full((n_dates, n_factors, n_groups), np.nan)
+    # 上一调仓日的分组和各组股票数（第一期之前视为空仓，换手率记为NaN）
+    previous = np.full((n_factors, len(factor_block.symbols)), -1, dtype=np.int8)
+    previous_count = np.zeros((n_factors, n_groups))
+    for start in range(0, n_dates, chunk_size):
+        end = min(start + chunk_size, n_dates)
+        labels = quantile_labels(factor_block.values[rebalance[start:end]], n_groups)
+        shape = labels.shape[:2] + (n_groups,)
+        cells = _group_cells(labels, n_groups)
+        members = _group_sums(cells, shape)
+        # 持有期收益缺失（停牌、退市）的股票不计入组收益
+        chunk_returns = np.broadcast_to(returns[start:end, None, :], labels.shape)
+        has_return = ~np.isnan(chunk_returns)
+        held = _group_sums(cells, shape, has_return.ravel().astype(np.float64))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            group_returns[start:end] = _group_sums(cells, shape, np.where(has_return, chunk_returns, 0.0).ravel()) / held
+
+        # 换手率：等权组合相邻两期权重变化绝对值之和的一半（留在组内的股票权重由1/n_before变为1/n）
+        labels_before = np.concatenate([previous[None], labels[:-1]])
+        count_before = np.concatenate([previous_count[None], members[:-1]])
+        overlap = _group_sums(_group_cells(np.where(labels == labels_before, labels, -1), n_groups), shape)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            change = (overlap * np.abs(1 / members - 1 / count_before)
+                      + (members - overlap) / members + (count_before - overlap) / count_before) / 2
+        turnover[start:end] = np.where((members > 0) & (count_before > 0), change, np.nan)
+        previous, previous_count = labels[-1], members[-1]
+
+    long_short = group_returns[:, :, -1] - group_returns[:, :, 0]
+    period_returns = np.concatenate([group_returns, long_short[:, :, None]], axis=-1)
+    nav = np.cumprod(1 + np.nan_to_num(period_returns), axis=0)
+
+    group_names = [f'Q{i + 1}' for i in range(n_groups)] + ['LS']
+    periods_per_year = TRADING_DAYS_PER_YEAR / period
+    # 全部为NaN的组（如因子整段缺失）统计量为NaN
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean_return = np.nanmean(period_returns, axis=0)
+        valid_periods = (~np.isnan(period_returns)).sum(axis=0)
+        ann_return = nav[-1] ** (periods_per_year / np.maximum(valid_periods, 1)) - 1
+        volatility = np.nanstd(period_returns, axis=0, ddof=1) * np.sqrt(periods_per_year)
+        sharpe = mean_return * periods_per_year / volatility
+        mean_turnover = np.nanmean(turnover, axis=0)
+    # 单调性：各组平均收益的秩与组号的相关系数（1为严格单调递增）
+    monotonicity = pd.DataFrame(mean_return[:, :n_groups].T).rank().corrwith(
+        pd.Series(np.arange(n_groups, dtype=np.float64)), method='pearson').to_numpy()
+
+    summary = pd.DataFrame({
+        'factor': np.repeat(factor_block.factors, n_groups + 1),
+        'group': np.tile(group_names, n_factors),
+        'mean_return': mean_return.ravel(),
+        'ann_return': ann_return.ravel(),
+        'ann_vol': volatility.ravel(),
+        'sharpe': sharpe.ravel(),
+        'max_drawdown': _max_drawdown(nav).ravel(),
+        'turnover': np.concatenate([mean_turnover, np.full((n_factors, 1), np.nan)], axis=1).ravel(),
+        'monotonicity': np.repeat(monotonicity, n_groups + 1),
+    })
+    columns = pd.MultiIndex.from_product([factor_block.factors, group_names], names=['factor', 'group'])
+    nav = pd.DataFrame(nav.reshape(n_dates, -1).astype(np.float32), columns=columns,
+                       index=pd.DatetimeIndex(from_date_key(factor_block.dates[rebalance]), name='trade_date'))
+    return summary, nav
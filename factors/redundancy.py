@@ -0,0 +1,100 @@
+# redundancy.py
+# 因子冗余分析：在因子块上批量计算每日截面秩相关矩阵并做时间平均（按日期分块，每块一次批量矩阵乘法），
+# 按ICIR从高到低贪心聚类，每类只保留ICIR最高的代表因子；也可按ICIR顺序对因子做逐日Gram-Schmidt正交化
+
+import numpy as np
+import pandas as pd
+from config import REDUNDANCY_CORR_THRESHOLD
+from factors.preprocessing import FactorBlock, rank_block, zscore
+
+
+def rank_correlation_matrix(factor_block, factors=None, chunk_size=64):
+    """
+    时间平均的截面Spearman相关矩阵
+    每日每个因子在自身有值的股票上截面排名，每对因子只在两者都有值的股票上计算名次的Pearson相关
+    （缺失值不填充，避免填充值形成的并列组抬高或压低相关），各项和由批量矩阵乘法一次得到
+    :param factors: 可选，参与计算的因子（默认因子块全部因子）
+    :return: DataFrame（因子×因子），各日相关系数的均值（当日共同样本不足或某因子无差异时不计入）
+    """
+    factors = list(factor_block.factors) if factors is None else list(factors)
+    columns = [factor_block.factors.index(factor) for factor in factors]
+    n_factors = len(columns)
+    corr_sum = np.zeros((n_factors, n_factors))
+    corr_count = np.zeros((n_factors, n_factors))
+    for start in range(0, len(factor_block.dates), chunk_size):
+        ranks = rank_block(factor_block.values[start:start + chunk_size][:, :, columns])
+        valid = (~np.isnan(ranks)).astype(np.float64)
+        ranks = np.nan_to_num(ranks)
+        ranks_t, valid_t = ranks.transpose(0, 2, 1), valid.transpose(0, 2, 1)
+        # [n_dates, F, F]：共同样本数、x在共同样本上的和与平方和、xy之和（y的和与平方和为转置）
+        n = valid_t @ valid
+        sum_x = ranks_t @ valid
+        sum_xx = (ranks_t ** 2) @ valid
+        sum_xy = ranks_t @ ranks
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sum_y, sum_yy = sum_x.transpose(0, 2, 1), sum_xx.transpose(0, 2, 1)
+            cov = sum_xy - sum_x * sum_y / n
+            var_x = sum_xx - sum_x ** 2 / n
+            var_y = sum_yy - sum_y ** 2 / n
+            corr = np.where((n > 2) & (var_x > 0) & (var_y > 0), cov / np.sqrt(var_x * var_y), np.nan)
+        has_corr = ~np.isnan(corr)
+        corr_sum += np.where(has_corr, corr, 0.0).sum(axis=0)
+        corr_count += has_corr.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.DataFrame(corr_sum / corr_count, index=factors, columns=factors)
+
+
+def cluster_factors(corr, scores, threshold=REDUNDANCY_CORR_THRESHOLD):
+    """
+    贪心聚类：按得分从高到低遍历，与已有代表因子的相关系数绝对值不低于threshold的归入该代表因子（取相关最高的），
+    否则成为新的代表因子
+    :param corr: 因子相关矩阵（rank_correlation_matrix的结果）
+    :param scores: 因子得分（如月度ICIR均值），Series，得分缺失的因子排在最后
+    :return: {代表因子: [成员因子（含代表因子本身）]}，按代表因子得分从高到低
+    """
+    order = scores.reindex(corr.index).sort_values(ascending=False, na_position='last').index
+    clusters = {}
+    for factor in order:
+        if clusters:
+            similarity = corr.loc[factor, list(clusters)].abs()
+            if similarity.max() >= threshold:
+                clusters[similarity.idxmax()].append(factor)
+                continue
+        clusters[factor] = [factor]
+    return clusters
+
+
+def prune_redundant_factors(factor_block, factors, scores, threshold=REDUNDANCY_CORR_THRESHOLD):
+    """
+    冗余剔除：相关矩阵在因子块的全部候选因子上计算，在factors中按高相关聚类，每类只保留得分最高的代表因子
+    :param factors: 参与聚类的因子（如filter_factors_by_icir筛选出的因子）
+    :param scores: 因子得分（如全样本月度ICIR均值），得分缺失的因子排在最后
+    :return: 保留因子列表（保持factors中的顺序）, 全部候选因子的相关矩阵, 聚类结果
+    """
+    corr = rank_correlation_matrix(factor_block)
+    if not factors:
+        return [], corr, {}
+    clusters = cluster_factors(corr.loc[list(factors), list(factors)], scores, threshold)
+    return [factor for factor in factors if factor in clusters], corr, clusters
+
+
+def orthogonalize_factors(factor_block, factors, scores=None, chunk_size=64):
+    """
+    逐日Gram-Schmidt正交化：按得分从高到低，每个因子对排在它之前的因子做截面回归取残差后重新标准化
+    （所有日期一次批量QR分解），得分最高的因子保持不变
+    :param factors: 参与正交化的因子
+    :param scores: 可选，因子得分，决定正交化顺序（默认按factors顺序）
+    :return: 新的FactorBlock（只含factors，按正交化顺序排列）
+    """
+    order = list(factors) if scores is None else \
+        list(scores.reindex(list(factors)).sort_values(ascending=False, na_position='last').index)
+    columns = [factor_block.factors.index(factor) for factor in order]
+    residuals = np.empty(factor_block.values.shape[:2] + (len(columns),), dtype=np.float32)
+    for start in range(0, len(factor_block.dates), chunk_size):
+        values = factor_block.values[start:start + chunk_size][:, :, columns].astype(np.float64)
+        missing = np.isnan(values)
+        q, r = np.linalg.qr(np.where(missing, 0.0, values))
+        # 第k列残差 = Q[:, k] × R[k, k]（前k-1列张成空间之外的部分）
+        orthogonal = q * np.diagonal(r, axis1=1, axis2=2)[:, None, :]
+        residuals[start:start + chunk_size] = zscore(np.where(missing, np.nan, orthogonal))
+    return FactorBlock(factor_block.dates, factor_block.symbols, order, residuals)
@@ -0,0 +1,93 @@
+# segment_ops.py
+# 分段数组算子：输入均为按股票连续排列（按(ts_code, trade_date)排序）的一维数组，pos为行在所属股票内的序号
+# 滚动窗口用累计和相减，股票边界用段内位置掩码；因子注册表和各因子模块共用，本模块不依赖任何因子模块
+
+import numpy as np
+
+
+def segment_positions(codes):
+    """
+    计算每行在所属股票内的序号（股票首行为0）
+    :param codes: 已按股票连续排列的股票代码/编号数组
+    """
+    codes = np.asarray(codes)
+    n = len(codes)
+    starts = np.ones(n, dtype=bool)
+    starts[1:] = codes[1:] != codes[:-1]
+    idx = np.arange(n)
+    return idx - np.maximum.accumulate(np.where(starts, idx, 0))
+
+
+def group_shift(values, pos, n):
+    """
+    段内平移：out[i] = values[i - n]，跨股票的位置为NaN（n为负数时向后取）
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    if n > 0:
+        valid = pos[n:] >= n
+        out[n:][valid] = values[:-n][valid]
+    elif n < 0:
+        m = -n
+        # 向后取时，目标行须与当前行属于同一股票：目标行的pos = 当前行pos + m
+        valid = pos[m:] == pos[:-m] + m
+        out[:-m][valid] = values[m:][valid]
+    else:
+        out[:] = values
+    return out
+
+
+def rolling_sum(values, pos, window):
+    """
+    段内滚动求和，窗口内必须全部为有效值（同pandas rolling(window)默认min_periods=window）
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    csum = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+    ccount = np.concatenate(([0], np.cumsum(valid)))
+    end = np.arange(1, len(values) + 1)
+    begin = np.maximum(end - window, 0)
+    total = csum[end] - csum[begin]
+    count = ccount[end] - ccount[begin]
+    return np.where((pos >= window - 1) & (count == window), total, np.nan)
+
+
+def rolling_mean(values, pos, window):
+    """
+    段内滚动均值
+    """
+    return rolling_sum(values, pos, window) / window
+
+
+def rolling_std(values, pos, window):
+    """
+    段内滚动样本标准差（ddof=1）
+    """
+    values = np.asarray(values, dtype=np.float64)
+    s1 = rolling_sum(values, pos, window)
+    s2 = rolling_sum(values * values, pos, window)
+    var = (s2 - s1 * s1 / window) / (window - 1)
+    return np.sqrt(np.maximum(var, 0.0))
+
+
+def group_ema(values, pos, span):
+    """
+    段内指数移动平均（同pandas ewm(span, adjust=False)），每只股票首行取原值
+    按段内序号逐步推进，每一步对所有股票向量化计算，循环次数为单只股票的最大行数
+    """
+    values = np.asarray(values, dtype=np.float64)
+    alpha = 2.0 / (span + 1)
+    out = np.empty(len(values))
+    starts = np.flatnonzero(pos == 0)
+    lengths = np.diff(np.append(starts, len(values)))
+    for p in range(lengths.max() if len(lengths) else 0):
+        idx = starts[lengths > p] + p
+        if p == 0:
+            out[idx] = values[idx]
+        else:
+            prev = out[idx - 1]
+            cur = values[idx]
+            # 缺失值沿用上一期的EMA；此前全为缺失时从首个有效值开始
+            ema = np.where(np.isnan(prev), cur, alpha * cur + (1 - alpha) * prev)
+            out[idx] = np.where(np.isnan(cur), prev, ema)
+    return out
@@ -1,13 +1,104 @@
 # factors/sentiment_factors.py
 # 计算典型情绪因子（个股+市场整体情绪）
+# 连板、连涨/连跌、距上次涨跌停天数等游程类因子在按(ts_code, trade_date)排序后的连续数组上向量化计算，
+# 涨跌停按板块（主板/创业板/科创板/北交所）和ST状态的涨跌幅限制判断
 
+import numpy as np
 import pandas as pd
+from factors.segment_ops import segment_positions
+from utils.schema import to_date_key
+from utils.universe import price_limit_ratio, limit_hits, is_st_name
+from utils.market_summary import build_market_summary
 
-def calculate_sentiment_factors(stock_data, market_data):
+
+# ===== 游程算子（输入为按股票连续排列的一维数组，pos为行在所属股票内的序号） =====
+
+def run_length(flag, pos):
+    """
+    截至当前行连续满足条件的天数（不满足的行为0），在股票边界处重新计数
+    累计计数减去最近一次中断（不满足条件的行或股票首行之前）时的累计计数
+    """
+    flag = np.asarray(flag, dtype=bool)
+    count = np.cumsum(flag)
+    # 中断点（不满足条件的行、股票首行）记录该行之前的累计计数，向后取最大值即最近一次中断时的计数
+    breaks = np.where(~flag | (pos == 0), count - flag, 0)
+    return count - np.maximum.accumulate(breaks)
+
+
+def days_since(flag, pos):
+    """
+    距离本股票最近一次满足条件的交易日数（当日满足为0），此前从未满足为NaN
+    """
+    flag = np.asarray(flag, dtype=bool)
+    idx = np.arange(len(flag))
+    last = np.maximum.accumulate(np.where(flag, idx, -1))
+    return np.where(last >= idx - pos, idx - last, np.nan)
+
+
+def limit_flags(df, stock_basic=None):
+    """
+    按板块和ST状态判断每行是否收盘涨停/跌停
+    - 有close/pre_close时按涨停价/跌停价判断（有close_raw/pre_close_raw时用原始价格），否则按pct_chg判断
+    - ST状态优先用df的is_st列，其次按stock_basic的当前简称，都没有时视为非ST
+    :return: (is_limit_up, is_limit_down) 布尔数组
+    """
+    if 'is_st' in df.columns:
+        is_st = df['is_st'].fillna(False).to_numpy(dtype=bool)
+    elif stock_basic is not None:
+        basic = stock_basic.drop_duplicates('ts_code')
+        st_codes = set(basic.loc[is_st_name(basic['name']), 'ts_code'].astype(str))
+        is_st = df['ts_code'].astype(str).isin(st_codes).to_numpy() if st_codes else np.zeros(len(df), dtype=bool)
+    else:
+        is_st = np.zeros(len(df), dtype=bool)
+    limit = price_limit_ratio(df['ts_code'], is_st, to_date_key(df['trade_date']))
+
+    close_col = 'close_raw' if 'close_raw' in df.columns else 'close'
+    pre_close_col = 'pre_close_raw' if 'pre_close_raw' in df.columns else 'pre_close'
+    if {close_col, pre_close_col} <= set(df.columns):
+        return limit_hits(df[close_col].to_numpy(dtype=np.float64), df[pre_close_col].to_numpy(dtype=np.float64), limit)
+    pct_chg = df['pct_chg'].to_numpy(dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        return pct_chg >= limit * 100 - 0.1, pct_chg <= -limit * 100 + 0.1
+
+
+def calculate_streak_factors(df, stock_basic=None):
+    """
+    游程类情绪因子
+    - consecutive_limit_up / consecutive_limit_down：连续涨停/跌停天数
+    - consecutive_up_days / consecutive_down_days：连续上涨/下跌天数
+    - days_since_limit_up / days_since_limit_down：距最近一次涨停/跌停的交易日数
+    :return: 按(ts_code, trade_date)排序的df（增加is_limit_up/is_limit_down及上述列）
+    """
+    df = df.sort_values(['ts_code', 'trade_date'], kind='stable').reset_index(drop=True)
+    codes = df['ts_code']
+    pos = segment_positions(codes.cat.codes.to_numpy() if isinstance(codes.dtype, pd.CategoricalDtype) else codes.to_numpy())
+    limit_up, limit_down = limit_flags(df, stock_basic)
+    df['is_limit_up'] = limit_up.astype(np.int8)
+    df['is_limit_down'] = limit_down.astype(np.int8)
+
+    if 'pct_chg' in df.columns:
+        change = df['pct_chg'].to_numpy(dtype=np.float64)
+    else:
+        change = df['close'].to_numpy(dtype=np.float64) - df['pre_close'].to_numpy(dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        up, down = change > 0, change < 0
+
+    df['consecutive_limit_up'] = run_length(limit_up, pos).astype(np.int32)
+    df['consecutive_limit_down'] = run_length(limit_down, pos).astype(np.int32)
+    df['consecutive_up_days'] = run_length(up, pos).astype(np.int32)
+    df['consecutive_down_days'] = run_length(down, pos).astype(np.int32)
+    df['days_since_limit_up'] = days_since(limit_up, pos).astype(np.float32)
+    df['days_since_limit_down'] = days_since(limit_down, pos).astype(np.float32)
+    return df
+
+
+def calculate_sentiment_factors(stock_data, market_data, stock_basic=None, market_summary=None):
     """
     计算情绪因子，包括换手率、连板、市场热度等
     :param stock_data: 个股行情数据（包含涨跌停信息等）
-    :param market_data: 全市场行情数据（用于整体情绪因子计算）
+    :param market_data: 全市场行情数据（用于整体情绪因子计算，已传入market_summary时不使用）
+    :param stock_basic: 可选，股票基础信息（按简称判断ST，用于确定涨跌幅限制）
+    :param market_summary: 可选，全市场每日汇总表（utils.market_summary.build_market_summary）
     :return: 含情绪因子的DataFrame
     """
     df = stock_data.copy()
@@ -18,38 +109,20 @@ def calculate_sentiment_factors(stock_data, market_data):
     else:
         df['turnover_rate'] = None  # 如果无流通股本数据，暂缺失
 
-    # 2. 涨停/跌停标记
-    df['is_limit_up'] = (df['pct_chg'] >= 9.9).astype(int)
-    df['is_limit_down'] = (df['pct_chg'] <= -9.9).astype(int)
-
-    # 3. 连板计数（按个股分组统计）
-    df['consecutive_limit_up'] = 0
-    for ts_code, stock_group in df.groupby('ts_code'):
-        stock_group = stock_group.sort_values('trade_date')
-        consecutive = 0
-        for i, row in stock_group.iterrows():
-            if row['is_limit_up'] == 1:
-                consecutive += 1
-            else:
-                consecutive = 0
-            df.at[i, 'consecutive_limit_up'] = consecutive
-
-    # 4. 市场整体热度（涨停家数/跌停家数比值）
-    if 'is_limit_up' in market_data.columns and 'is_limit_down' in market_data.columns:
-        daily_stats = market_data.groupby('trade_date').agg(
-            limit_up_count=('is_limit_up', 'sum'),
-            limit_down_count=('is_limit_down', 'sum')
-        )
-        daily_stats['market_heat'] = daily_stats['limit_up_count'] / (daily_stats['limit_down_count'] + 1)
-    else:
-        daily_stats = pd.DataFrame(index=market_data['trade_date'].unique())
-        daily_stats['market_heat'] = None
+    # 2-3. 涨停/跌停标记（按板块和ST状态的涨跌幅限制）、连板及连涨连跌等游程因子
+    df = calculate_streak_factors(df, stock_basic)
+
+    # 4. 市场整体热度（涨停家数/跌停家数比值），读取全市场每日汇总表
+    if market_summary is None:
+        market_summary = build_market_summary(market_data, stock_basic)
 
     # 合并市场情绪热度到个股数据
-    df = df.merge(daily_stats[['market_heat']], on='trade_date', how='left')
+    df = df.merge(market_summary[['market_heat']], on='trade_date', how='left')
 
     # 5. 预留扩展因子（例如龙虎榜净买、舆情得分等）
     df['net_buy_lhb'] = None  # 示例占位
     df['sentiment_score'] = None  # 示例占位，NLP舆情评分
 
-    return df[['ts_code', 'trade_date', 'turnover_rate', 'consecutive_limit_up', 'market_heat', 'net_buy_lhb', 'sentiment_score']]
\ No newline at end of file
+    return df[['ts_code', 'trade_date', 'turnover_rate', 'consecutive_limit_up', 'consecutive_limit_down',
+               'consecutive_up_days', 'consecutive_down_days', 'days_since_limit_up', 'days_since_limit_down',
+               'market_heat', 'net_buy_lhb', 'sentiment_score']]
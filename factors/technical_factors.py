@@ -1,110 +1,211 @@
 # technical_factors.py
 # 技术因子计算模块，窗口参数全部外部配置
+# 所有因子在按(ts_code, trade_date)排序一次后的连续数组上计算：
+# 滚动窗口用累计和相减，股票边界用段内位置（pos）掩码，不使用groupby.apply逐只股票回调
+# 因子和共享中间量（日收益率、均线、EMA等）注册到因子注册表，按依赖只计算一次
 
 import numpy as np
-import pandas as pd
 from config import TECHNICAL_FACTOR_WINDOWS
+from factors.factor_registry import REGISTRY, FactorRegistry, compute_factors
+from factors.segment_ops import group_shift, rolling_mean, rolling_std, group_ema
 
-def calculate_momentum_factors(df):
+
+# ===== 因子注册（中间量只计算一次，被多个因子共享） =====
+
+REGISTRY.add('returns', lambda pos, close: close / group_shift(close, pos, 1) - 1, inputs=['close'], intermediate=True,
+             lookback=1)
+REGISTRY.add('close_delta', lambda pos, close: close - group_shift(close, pos, 1), inputs=['close'], intermediate=True,
+             lookback=1)
+
+
+def _momentum(pos, close, window):
+    return close / group_shift(close, pos, window) - 1
+
+
+def _volatility(pos, returns, window):
+    return rolling_std(returns, pos, window)
+
+
+def _moving_average(pos, close, window):
+    return rolling_mean(close, pos, window)
+
+
+def _bias(pos, close, ma):
+    return (close - ma) / ma
+
+
+for _window in TECHNICAL_FACTOR_WINDOWS:
+    REGISTRY.add(f'momentum_{_window}', _momentum, inputs=['close'], params={'window': _window}, lookback=_window)
+    # 日收益率只计算一次，各窗口共用
+    REGISTRY.add(f'volatility_{_window}', _volatility, inputs=['returns'], params={'window': _window},
+                 lookback=_window - 1)
+    REGISTRY.add(f'ma_{_window}', _moving_average, inputs=['close'], params={'window': _window}, lookback=_window - 1)
+    # 乖离率直接复用同窗口均线
+    REGISTRY.add(f'bias_{_window}', _bias, inputs=['close', f'ma_{_window}'])
+
+
+@REGISTRY.register('turnover_rate', inputs=['vol', 'float_share'])
+def _turnover_rate(pos, vol, float_share):
+    """
+    换手率（成交量/流通股本），无流通股本时为NaN
+    """
+    return vol / float_share
+
+
+@REGISTRY.register('avg_turnover_20', inputs=['turnover_rate'], params={'window': 20}, lookback=19)
+def _avg_turnover(pos, turnover, window):
+    return rolling_mean(turnover, pos, window)
+
+
+def _ema(pos, values, span):
+    return group_ema(values, pos, span)
+
+
+# MACD：短/长期EMA只作为中间量，不写入df
+# EMA依赖全部历史，lookback为None
+REGISTRY.add('ema_12', _ema, inputs=['close'], params={'span': 12}, intermediate=True, lookback=None)
+REGISTRY.add('ema_26', _ema, inputs=['close'], params={'span': 26}, intermediate=True, lookback=None)
+REGISTRY.add('macd', lambda pos, short, long: short - long, inputs=['ema_12', 'ema_26'])
+REGISTRY.add('macd_signal', _ema, inputs=['macd'], params={'span': 9}, lookback=None)
+REGISTRY.add('macd_hist', lambda pos, macd, signal: macd - signal, inputs=['macd', 'macd_signal'])
+
+# RSI：与pandas where语义一致，首行差分为NaN时记为0
+REGISTRY.add('rsi_gain_14', lambda pos, delta, window: rolling_mean(np.where(delta > 0, delta, 0.0), pos, window),
+             inputs=['close_delta'], params={'window': 14}, intermediate=True, lookback=13)
+REGISTRY.add('rsi_loss_14', lambda pos, delta, window: rolling_mean(np.where(delta < 0, -delta, 0.0), pos, window),
+             inputs=['close_delta'], params={'window': 14}, intermediate=True, lookback=13)
+REGISTRY.add('rsi', lambda pos, gain, loss: 100 - 100 / (1 + gain / loss), inputs=['rsi_gain_14', 'rsi_loss_14'])
+
+MOMENTUM_FACTORS = [f'momentum_{window}' for window in TECHNICAL_FACTOR_WINDOWS]
+VOLATILITY_FACTORS = [f'volatility_{window}' for window in TECHNICAL_FACTOR_WINDOWS]
+BIAS_FACTORS = [name for window in TECHNICAL_FACTOR_WINDOWS for name in (f'ma_{window}', f'bias_{window}')]
+TURNOVER_FACTORS = ['turnover_rate', 'avg_turnover_20']
+MACD_FACTORS = ['macd', 'macd_signal', 'macd_hist']
+TECHNICAL_FACTORS = MOMENTUM_FACTORS + VOLATILITY_FACTORS + BIAS_FACTORS + TURNOVER_FACTORS + MACD_FACTORS + ['rsi']
+
+
+# ===== 因子计算（传入pos时df需已按(ts_code, trade_date)排序） =====
+
+def calculate_momentum_factors(df, pos=None):
     """
     计算多周期动量因子（过去N日收益率），窗口N可配置
     """
-    for window in TECHNICAL_FACTOR_WINDOWS:
-        df[f'momentum_{window}'] = df['close'].pct_change(window)
-    return df
+    return compute_factors(df, MOMENTUM_FACTORS, pos=pos)
+
 
-def calculate_volatility_factors(df):
+def calculate_volatility_factors(df, pos=None):
     """
     计算多周期波动率因子（过去N日收益率的标准差），窗口N可配置
     """
-    for window in TECHNICAL_FACTOR_WINDOWS:
-        df[f'volatility_{window}'] = df['close'].pct_change().rolling(window).std()
-    return df
+    return compute_factors(df, VOLATILITY_FACTORS, pos=pos)
+
 
-def calculate_bias_factors(df):
+def calculate_bias_factors(df, pos=None):
     """
     计算多周期均线乖离率因子，窗口N可配置
     """
-    for window in TECHNICAL_FACTOR_WINDOWS:
-        df[f'ma_{window}'] = df['close'].rolling(window).mean()
-        df[f'bias_{window}'] = (df['close'] - df[f'ma_{window}']) / df[f'ma_{window}']
-    return df
+    return compute_factors(df, BIAS_FACTORS, pos=pos)
+
 
-def calculate_turnover_factors(df):
+def calculate_turnover_factors(df, pos=None):
     """
-    换手率（成交量/流通股本），无周期窗口
+    换手率（成交量/流通股本）及其20日均值
     """
-    if 'float_share' in df.columns:
-        df['turnover_rate'] = df['vol'] / df['float_share']
-    else:
-        df['turnover_rate'] = np.nan
-    return df
+    return compute_factors(df, TURNOVER_FACTORS, pos=pos)
+
+
+# ===== 非默认窗口的MACD/RSI：在注册表副本上注册带窗口后缀的节点，不修改全局注册表 =====
+
+def _difference(pos, left, right):
+    return left - right
+
+
+def _rsi_gain(pos, delta, window):
+    return rolling_mean(np.where(delta > 0, delta, 0.0), pos, window)
+
+
+def _rsi_loss(pos, delta, window):
+    return rolling_mean(np.where(delta < 0, -delta, 0.0), pos, window)
+
+
+def _rsi_value(pos, gain, loss):
+    return 100 - 100 / (1 + gain / loss)
 
-def calculate_macd(df, short_window=12, long_window=26, signal_window=9):
+
+def _local_registry():
     """
-    MACD指标（趋势信号），参数可根据风格调节
+    全局注册表的副本（共享已有节点，新增节点只在副本中可见）
     """
-    df['ema_short'] = df['close'].ewm(span=short_window, adjust=False).mean()
-    df['ema_long'] = df['close'].ewm(span=long_window, adjust=False).mean()
-    df['macd'] = df['ema_short'] - df['ema_long']
-    df['macd_signal'] = df['macd'].ewm(span=signal_window, adjust=False).mean()
-    df['macd_hist'] = df['macd'] - df['macd_signal']
-    return df
+    registry = FactorRegistry()
+    registry.nodes = dict(REGISTRY.nodes)
+    return registry
 
-def calculate_rsi(df, window=14):
+
+def _macd_nodes(short_window, long_window, signal_window):
     """
-    RSI相对强弱指标（超买超卖），窗口默认14
+    :return: (注册表, MACD三个节点名)；默认12/26/9直接使用全局注册表的节点
     """
-    delta = df['close'].diff()
-    gain = delta.where(delta > 0, 0).rolling(window).mean()
-    loss = -delta.where(delta < 0, 0).rolling(window).mean()
-    rs = gain / loss
-    df['rsi'] = 100 - 100 / (1 + rs)
-    return df
+    if (short_window, long_window, signal_window) == (12, 26, 9):
+        return REGISTRY, MACD_FACTORS
+    registry = _local_registry()
+    suffix = f'{short_window}_{long_window}_{signal_window}'
+    for span in (short_window, long_window):
+        registry.add(f'ema_{span}', _ema, inputs=['close'], params={'span': span}, intermediate=True, lookback=None)
+    registry.add(f'macd_{suffix}', _difference, inputs=[f'ema_{short_window}', f'ema_{long_window}'], intermediate=True)
+    registry.add(f'macd_signal_{suffix}', _ema, inputs=[f'macd_{suffix}'], params={'span': signal_window},
+                 intermediate=True, lookback=None)
+    registry.add(f'macd_hist_{suffix}', _difference, inputs=[f'macd_{suffix}', f'macd_signal_{suffix}'],
+                 intermediate=True)
+    return registry, [f'macd_{suffix}', f'macd_signal_{suffix}', f'macd_hist_{suffix}']
 
-def calculate_technical_factors(df):
+
+def _rsi_node(window):
     """
-    主调用函数，按配置计算所有技术因子
+    :return: (注册表, RSI节点名)；默认窗口14直接使用全局注册表的节点
     """
-    df = calculate_momentum_factors(df)
-    df = calculate_volatility_factors(df)
-    df = calculate_bias_factors(df)
-    df = calculate_turnover_factors(df)
-    df = calculate_macd(df)
-    df = calculate_rsi(df)
-    return df
-
-# factors/technical_factors.py
-"""
-技术因子计算模块
-包含动量类、波动率类、均线偏离类等因子
-"""
+    if window == 14:
+        return REGISTRY, 'rsi'
+    registry = _local_registry()
+    registry.add(f'rsi_gain_{window}', _rsi_gain, inputs=['close_delta'], params={'window': window},
+                 intermediate=True, lookback=window - 1)
+    registry.add(f'rsi_loss_{window}', _rsi_loss, inputs=['close_delta'], params={'window': window},
+                 intermediate=True, lookback=window - 1)
+    registry.add(f'rsi_{window}', _rsi_value, inputs=[f'rsi_gain_{window}', f'rsi_loss_{window}'], intermediate=True)
+    return registry, f'rsi_{window}'
 
 
-def calculate_technical_factors(all_data):
+def _compute_as(df, registry, names, columns, pos):
     """
-    计算技术因子
-    :param all_data: 包含行情数据（trade_date, ts_code, close等列）
-    :return: all_data（增加技术因子列）
+    在registry上计算names对应的节点并以columns为列名写入df
     """
+    df = compute_factors(df, names, registry=registry, pos=pos)
+    if list(names) != list(columns):
+        df = df.drop(columns=list(columns), errors='ignore').rename(columns=dict(zip(names, columns)))
+    return df
 
-    # 计算各类技术指标
-    def calc_rolling_features(group, windows):
-        for window in windows:
-            col_prefix = f'close_{window}'
-            group[f'ma_{window}'] = group['close'].rolling(window).mean()
-            group[f'bias_{window}'] = (group['close'] - group[f'ma_{window}']) / group[f'ma_{window}']
-            group[f'momentum_{window}'] = group['close'].pct_change(window)
 
-            # 波动率
-            group[f'volatility_{window}'] = group['close'].pct_change().rolling(window).std()
+def calculate_macd(df, short_window=12, long_window=26, signal_window=9, pos=None):
+    """
+    MACD指标（趋势信号），参数可根据风格调节，结果写入macd, macd_signal, macd_hist列
+    """
+    registry, names = _macd_nodes(short_window, long_window, signal_window)
+    return _compute_as(df, registry, names, MACD_FACTORS, pos)
 
-        return group
 
-    all_data = all_data.groupby('ts_code').apply(lambda x: calc_rolling_features(x, [5, 20, 60]))
+def calculate_rsi(df, window=14, pos=None):
+    """
+    RSI相对强弱指标（超买超卖），窗口默认14，结果写入rsi列
+    """
+    registry, name = _rsi_node(window)
+    return _compute_as(df, registry, [name], ['rsi'], pos)
 
-    # 其他因子示例（ATR、量价相关等）
-    all_data['turnover_rate'] = all_data['vol'] / all_data['float_share']
-    all_data['avg_turnover_20'] = all_data.groupby('ts_code')['turnover_rate'].transform(lambda x: x.rolling(20).mean())
 
-    return all_data
\ No newline at end of file
+def calculate_technical_factors(df, factors=None):
+    """
+    主调用函数，按配置计算技术因子
+    只排序一次，所有因子共用同一份段内位置数组和中间量
+    :param df: 包含行情数据（trade_date, ts_code, close, vol等列）
+    :param factors: 可选，只计算这些因子（默认全部技术因子）
+    :return: 按(ts_code, trade_date)排序的df（增加技术因子列）
+    """
+    return compute_factors(df, factors or TECHNICAL_FACTORS)
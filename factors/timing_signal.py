@@ -3,6 +3,7 @@
 
 import pandas as pd
 import numpy as np
+from utils.market_summary import build_market_summary
 
 def calculate_ma_timing_signal(index_df, short_window=20, long_window=60):
     """
@@ -13,12 +14,15 @@ def calculate_ma_timing_signal(index_df, short_window=20, long_window=60):
     index_df['ma_signal'] = np.where(index_df['ma_short'] > index_df['ma_long'], 1, 0)
     return index_df[['ma_signal']]
 
-def calculate_breadth_timing_signal(stock_universe_df, date_col='trade_date'):
+def calculate_breadth_timing_signal(stock_universe_df, date_col='trade_date', market_summary=None):
     """
     市场宽度择时信号：每日上涨股票占比
+    :param stock_universe_df: 个股行情（trade_date/date_col, ts_code, pct_chg；没有pct_chg时需要close和pre_close）
+    :param market_summary: 可选，全市场每日汇总表（utils.market_summary.build_market_summary），不传入时由stock_universe_df构建
     """
-    stock_universe_df['up'] = stock_universe_df['pct_chg'] > 0
-    breadth_df = stock_universe_df.groupby(date_col)['up'].mean()
+    if market_summary is None:
+        market_summary = build_market_summary(stock_universe_df.rename(columns={date_col: 'trade_date'}))
+    breadth_df = market_summary['up_ratio']
     breadth_signal = np.where(breadth_df > 0.6, 1, np.where(breadth_df < 0.4, 0, np.nan))
     return pd.DataFrame(breadth_signal, index=breadth_df.index, columns=['breadth_signal'])
 
@@ -30,11 +34,13 @@ def calculate_momentum_timing_signal(index_df, window=20):
     index_df['momentum_signal'] = np.where(index_df['momentum'] > 0, 1, 0)
     return index_df[['momentum_signal']]
 
-def calculate_weighted_timing_signal(index_df, stock_universe_df, weights=None, long_threshold=0.6, short_threshold=0.4):
+def calculate_weighted_timing_signal(index_df, stock_universe_df, weights=None, long_threshold=0.6, short_threshold=0.4,
+                                     market_summary=None):
     """
     加权择时信号：
     - 按权重综合三种择时信号
     - 加权得分高于long_threshold时做多，低于short_threshold时空仓
+    :param market_summary: 可选，全市场每日汇总表，市场宽度直接读取
     """
     if weights is None:
         # 默认权重（可以根据历史回测效果微调）
@@ -46,7 +52,7 @@ def calculate_weighted_timing_signal(index_df, stock_universe_df, weights=None,
 
     # 计算各单项信号
     ma_signal = calculate_ma_timing_signal(index_df)['ma_signal']
-    breadth_signal = calculate_breadth_timing_signal(stock_universe_df)['breadth_signal']
+    breadth_signal = calculate_breadth_timing_signal(stock_universe_df, market_summary=market_summary)['breadth_signal']
     momentum_signal = calculate_momentum_timing_signal(index_df)['momentum_signal']
 
     # 合并信号
@@ -1,8 +1,22 @@
 import pandas as pd
-from utils.data_loader import load_market_data, load_financial_data
-from factors.financial_factors import calculate_financial_factors
-from factors.technical_factors import calculate_technical_factors
-from factors.factor_analysis import evaluate_and_filter_factors
+from utils.data_loader import (load_market_data, load_financial_data, load_index_data, load_adj_factor,
+                               load_daily_basic, load_statement_data, load_stock_basic_with_retry,
+                               load_name_history)
+from utils.fetch_executor import FetchExecutor
+from utils.schema import compact_frame, drop_intermediate_columns, memory_usage_mb
+from utils.asof_join import asof_join
+from utils.adjustment import build_adjusted_panel_store, apply_adjusted_prices
+from utils.universe import build_universe
+from utils.market_summary import build_market_summary
+from factors.financial_factors import merge_report_tables, build_quarterly_financials, calculate_financial_factors
+from factors.technical_factors import TECHNICAL_FACTORS
+from factors.factor_cache import compute_factors_cached
+from factors.factor_analysis import evaluate_and_filter_factors, get_factor_columns, calculate_ic_decay
+from factors.preprocessing import preprocess_factors
+from factors.neutralization import neutralize_factors, NEUTRALIZE_RIDGE
+from factors.ic_store import ICStore
+from factors.quantile_backtest import quantile_backtest
+from factors.redundancy import prune_redundant_factors
 from strategy.stock_selection import construct_positions
 from strategy.backtest import run_backtest
 from strategy.timing_signal import generate_combined_timing_signal
@@ -17,22 +31,72 @@ def main():
     os.makedirs('output', exist_ok=True)
 
     print("📊 正在加载市场和财务数据...")
-    market_data = load_market_data()
-    financial_data = load_financial_data()
+    stock_basic = load_stock_basic_with_retry()
+    stock_list = stock_basic['ts_code'].tolist()
+    executor = FetchExecutor()  # 市场和财务数据共用同一个限速器
+    market_data = load_market_data(stock_list=stock_list, executor=executor)
+    # 财报按公告日向前多取两年：区间起点能连接到最近一期已公告的报告，且该报告能匹配到上年同期计算同比/TTM
+    financial_data = load_financial_data(start_date='20210101', stock_list=stock_list, executor=executor)
+    income_data = load_statement_data('income', start_date='20210101', stock_list=stock_list, executor=executor)
+    balance_data = load_statement_data('balancesheet', start_date='20210101', stock_list=stock_list, executor=executor)
+    daily_basic = load_daily_basic(stock_list=stock_list, executor=executor)
+    index_data = load_index_data(executor=executor)
+    adj_factor = load_adj_factor(stock_list=stock_list, executor=executor)
+    # 曾用名记录：按历史区间还原ST状态，避免用当前简称判断历史ST（前视偏差）
+    name_history = load_name_history(stock_list=stock_list, executor=executor)
+
+    # 复权价格面板只在数据变化时重新计算，因子和回测统一使用复权价格
+    adjusted_store = build_adjusted_panel_store(market_data, adj_factor)
+    market_data = apply_adjusted_prices(market_data, adjusted_store)
+    # 每日指标（总市值、流通股本）并入行情，用于估值因子和换手率
+    market_data = compact_frame(market_data.merge(daily_basic, on=['ts_code', 'trade_date'], how='left'))
+
+    # 股票池掩码（上市满N日、非ST、未停牌、可买、可卖）每次加载数据后只构建一次
+    universe = build_universe(market_data, stock_basic, name_history=name_history)
+    # 全市场每日汇总（涨跌家数、涨跌停家数、成交量额、创新高/新低家数），择时和情绪因子共用
+    market_summary = build_market_summary(market_data, stock_basic)
 
     # 合并数据并计算因子
     print("📊 正在计算财务因子和技术因子...")
-    all_data = market_data.merge(financial_data, on=['trade_date', 'ts_code'], how='left')
-    all_data = calculate_financial_factors(all_data)
-    all_data = calculate_technical_factors(all_data)
+    # 同比/TTM等报告期指标先在 股票×报告期 的季度表上计算，
+    # 再按公告日as-of连接：每份报告从公告后的下一个交易日起生效，直到下一份报告公告
+    quarterly_financials = build_quarterly_financials(merge_report_tables(income_data, balance_data, financial_data))
+    all_data = asof_join(market_data, quarterly_financials, left_on='trade_date', right_on='ann_date')
+    all_data = compact_frame(calculate_financial_factors(all_data))
+    # 技术因子按定义指纹缓存，未变化的因子直接读取，只增量计算新增日期
+    all_data = compact_frame(drop_intermediate_columns(compute_factors_cached(all_data, TECHNICAL_FACTORS)))
+    print(f"📊 因子宽表内存占用: {memory_usage_mb(all_data):.1f} MB")
 
     # 计算未来5日收益率，作为IC评估基础
     all_data = all_data.sort_values(by=['ts_code', 'trade_date'])
-    all_data['future_5d_return'] = all_data.groupby('ts_code')['close'].shift(-5) / all_data['close'] - 1
+    all_data['future_5d_return'] = all_data.groupby('ts_code', observed=True)['close'].shift(-5) / all_data['close'] - 1
+
+    # 截面预处理（去极值、标准化）对所有候选因子一次完成
+    # 缺失值保持NaN：IC、IC衰减、分层回测和相关性分析都在未填充的因子块上计算，只有选股评分使用填充后的因子块
+    print("📊 正在进行因子截面预处理...")
+    preprocess_settings = {'winsorize': 'mad', 'n_mad': 5.0, 'universe_masks': ('tradable',), 'fill': False}
+    factor_block = preprocess_factors(all_data, get_factor_columns(all_data), universe=universe, **preprocess_settings)
+    # 行业+市值中性化：每日对行业哑变量和对数市值回归取残差，IC评估和选股评分都使用中性化后的因子
+    print("📊 正在进行行业市值中性化...")
+    neutralize_settings = {'mcap_col': 'total_mv', 'standardize': True, 'fill': False}
+    factor_block = neutralize_factors(factor_block, all_data, stock_basic, **neutralize_settings)
+    neutral_data = all_data[['ts_code', 'trade_date', 'close', 'future_5d_return']].copy()
+    neutral_data[factor_block.factors] = factor_block.lookup(neutral_data)
 
     # 评估因子表现并筛选有效因子
     print("📊 正在评估因子表现并筛选...")
-    selected_factors, ic_df, monthly_ic, icir_df = evaluate_and_filter_factors(all_data, future_return_col='future_5d_return')
+    selected_factors, ic_df, monthly_ic, icir_df = evaluate_and_filter_factors(
+        neutral_data, future_return_col='future_5d_return', universe=universe,
+        ic_store=ICStore('future_5d_return', horizon=5, settings={
+            'preprocess': preprocess_settings, 'neutralize': {**neutralize_settings, 'ridge': NEUTRALIZE_RIDGE},
+            'ic_universe': 'tradable'}))
+
+    # 冗余剔除：在全部候选因子上计算时间平均截面秩相关矩阵，
+    # 已选因子中相关高于阈值的归为一类，只保留全样本月度ICIR均值最高的代表因子
+    print("📊 正在剔除高相关冗余因子...")
+    selected_factors, factor_corr, factor_clusters = prune_redundant_factors(
+        factor_block, selected_factors, icir_df.mean())
+    factor_corr.to_csv('output/factor_correlation.csv')
 
     print(f"✅ 选中的有效因子: {selected_factors}")
 
@@ -42,16 +106,20 @@ def main():
     # 构建仓位（选股+因子加权评分）
     print("📊 正在构建选股仓位...")
     factor_weights = {factor: 1 / len(selected_factors) for factor in selected_factors}
-    positions = construct_positions(all_data, factor_weights, top_n=50)
+    # 综合评分不能处理NaN，缺失因子值填0（截面均值）
+    positions = construct_positions(all_data, factor_weights, top_n=50, universe=universe,
+                                    factor_block=factor_block.filled())
 
     # 生成市场择时信号
     print("📊 正在生成市场择时信号...")
-    timing_signals = generate_combined_timing_signal(market_data)
+    # 择时信号需要上证指数行情（ts_code='000001.SH'），与个股行情拼接后传入
+    timing_data = pd.concat([market_data, index_data], ignore_index=True)
+    timing_signals = generate_combined_timing_signal(timing_data, market_summary=market_summary)
     timing_signals.to_csv('output/timing_signals.csv', index=False)
 
     # 执行回测（结合择时信号和仓位）
     print("📊 正在运行回测...")
-    portfolio_value, daily_positions = run_backtest(positions, market_data, timing_signals)
+    portfolio_value, daily_positions = run_backtest(positions, market_data, timing_signals, universe=universe)
 
     # 保存每日净值和持仓记录
     portfolio_value.to_csv('output/portfolio_value.csv', index=False)
@@ -67,6 +135,13 @@ def main():
     for factor in monthly_ic.columns:
         ic_summary[f'ICIR_{factor}'] = icir_df[factor]
     ic_summary.to_csv('output/ic_summary.csv')
+    # IC衰减：同一价格面板上一次生成多个周期的未来收益，输出各因子各周期的IC、ICIR和IC半衰期，用于匹配调仓频率
+    ic_decay = calculate_ic_decay(factor_block, all_data)
+    ic_decay.to_csv('output/ic_decay.csv', index=False)
+    # 分层回测：所有因子同时分组，输出各组及多空的收益、回撤、换手率汇总和净值面板
+    quantile_summary, quantile_nav = quantile_backtest(factor_block, all_data)
+    quantile_summary.to_csv('output/quantile_summary.csv', index=False)
+    quantile_nav.to_parquet('output/quantile_nav.parquet')
 
     # 绘制组合净值曲线+择时信号
     print("📊 生成净值及择时信号图表...")
@@ -74,7 +149,7 @@ def main():
 
     # 绘制回测 vs 上证指数 vs 择时信号对比图
     print("📊 生成回测与实盘信号对比图...")
-    plot_backtest_vs_market(portfolio_value, market_data, timing_signals, output_file='output/backtest_vs_market.png')
+    plot_backtest_vs_market(portfolio_value, timing_data, timing_signals, output_file='output/backtest_vs_market.png')
 
     print("✅ 全流程运行完毕，结果保存至output文件夹！")
 
@@ -1,22 +1,49 @@
 import pandas as pd
 import numpy as np
+from utils.panel_store import long_to_panel
+from utils.schema import to_date_key, from_date_key
 
-def run_backtest(positions, market_data, timing_signals, initial_capital=1e7):
+
+class _DailyPrices:
+    """
+    单日收盘价视图：面板的一行 + 代码到列下标的映射，无行情（停牌）返回NaN
+    """
+
+    def __init__(self, daily_close, symbol_index):
+        self.daily_close = daily_close
+        self.symbol_index = symbol_index
+
+    def get(self, ts_code):
+        i = self.symbol_index.get(ts_code)
+        return np.nan if i is None else float(self.daily_close[i])
+
+
+def run_backtest(positions, market_data, timing_signals, initial_capital=1e7, universe=None):
     """
     完整回测逻辑：
     - 支持持仓动态跟踪
     - 支持择时信号（多头/空仓切换）
     - 支持停牌补全
     - 支持分红除权价格（默认行情数据已为复权价）
+    - 支持涨跌停约束（传入universe时：封涨停无法买入，封跌停或停牌无法卖出）
 
     :param positions: 每期选股仓位（trade_date, ts_code, weight）
     :param market_data: 市场行情数据（包含trade_date, ts_code, close等列）
     :param timing_signals: 择时信号（trade_date, final_signal=0/1）
     :param initial_capital: 初始资金
+    :param universe: 可选，股票池掩码（utils.universe.Universe）
     :return: 每日净值DataFrame, 每日持仓快照
     """
 
-    all_dates = market_data['trade_date'].sort_values().unique()
+    # 收盘价对齐为 date×stock 面板，每日行情直接取面板的一行，不再逐日筛选长表
+    date_keys, symbols, panels = long_to_panel(market_data, ['close'])
+    close_panel = panels['close']
+    all_dates = from_date_key(date_keys)
+    symbol_index = {code: i for i, code in enumerate(symbols)}
+
+    signal_by_date = dict(zip(to_date_key(timing_signals['trade_date']), timing_signals['final_signal']))
+    positions = positions.assign(date_key=to_date_key(positions['trade_date']))
+    positions_by_date = {date_key: group for date_key, group in positions.groupby('date_key')}
 
     portfolio_value = []
     daily_positions = []
@@ -25,30 +52,36 @@ def run_backtest(positions, market_data, timing_signals, initial_capital=1e7):
     current_positions = {}  # 股票 -> 股数
     last_prices = {}        # 股票 -> 上个有效收盘价（用于停牌补全）
 
-    for trade_date in all_dates:
-        daily_market = market_data[market_data['trade_date'] == trade_date]
-        timing_signal = timing_signals.loc[timing_signals['trade_date'] == trade_date, 'final_signal'].values
-
-        if len(timing_signal) > 0:
-            timing_signal = timing_signal[0]
-        else:
-            timing_signal = 1  # 无信号默认多头持仓
+    for t, trade_date in enumerate(all_dates):
+        daily_close = close_panel[t]
+        daily_prices = _DailyPrices(daily_close, symbol_index)
+        timing_signal = signal_by_date.get(date_keys[t], 1)  # 无信号默认多头持仓
 
         # === 调仓日处理 ===
-        if trade_date in positions['trade_date'].values:
-            daily_positions_data = positions[positions['trade_date'] == trade_date]
-
+        if date_keys[t] in positions_by_date:
+            daily_positions_data = positions_by_date[date_keys[t]]
+
+            locked_positions = {}
+            if universe is not None:
+                # 无法卖出的持仓继续持有，无法买入的股票剔除（权重在其余股票间重新分配）
+                held = list(current_positions)
+                can_sell = universe.lookup(date_keys[t], held, 'can_sell')
+                locked_positions = {stock: current_positions[stock] for stock, ok in zip(held, can_sell) if not ok}
+                can_buy = universe.lookup(date_keys[t], daily_positions_data['ts_code'].astype(str), 'can_buy')
+                daily_positions_data = daily_positions_data[can_buy & ~daily_positions_data['ts_code'].isin(locked_positions)]
+
+            locked_value = sum(shares * last_prices.get(stock, 0) for stock, shares in locked_positions.items())
             if timing_signal == 1:  # 正常持仓
-                current_positions = adjust_positions(daily_positions_data, daily_market, capital)
+                current_positions = adjust_positions(daily_positions_data, daily_prices, capital - locked_value)
             else:  # 空仓信号，清仓
                 current_positions = {}
+            current_positions.update(locked_positions)
 
         # === 计算每日市值 ===
         daily_value = 0
         for stock, shares in current_positions.items():
-            price_row = daily_market[daily_market['ts_code'] == stock]
-            if not price_row.empty:
-                close_price = price_row['close'].values[0]
+            close_price = daily_prices.get(stock)
+            if not np.isnan(close_price):
                 last_prices[stock] = close_price  # 更新有效价格
             else:
                 close_price = last_prices.get(stock, np.nan)  # 如果停牌，使用最近价格
@@ -76,24 +109,21 @@ def run_backtest(positions, market_data, timing_signals, initial_capital=1e7):
     return portfolio_value_df, daily_positions_df
 
 
-def adjust_positions(positions_data, daily_market, capital):
+def adjust_positions(positions_data, daily_prices, capital):
     """
     按仓位权重分配资金，计算股数（支持停牌补全逻辑）
     :param positions_data: 当日选股结果（仓位）
-    :param daily_market: 当日行情
+    :param daily_prices: 当日收盘价，get(ts_code)返回价格，停牌返回NaN
     :param capital: 总资金
     :return: 股票 -> 持仓股数
     """
     positions = {}
     effective_weights = {}
 
-    for _, row in positions_data.iterrows():
-        ts_code = row['ts_code']
-        weight = row['weight']
-        price_row = daily_market[daily_market['ts_code'] == ts_code]
+    for ts_code, weight in zip(positions_data['ts_code'], positions_data['weight']):
+        close_price = daily_prices.get(ts_code)
 
-        if not price_row.empty:
-            close_price = price_row['close'].values[0]
+        if not np.isnan(close_price):
             shares = (capital * weight) / close_price
             positions[ts_code] = shares
             effective_weights[ts_code] = weight
@@ -106,10 +136,8 @@ def adjust_positions(positions_data, daily_market, capital):
             effective_weights[ts_code] /= total_effective_weight
 
         for ts_code, weight in effective_weights.items():
-            price_row = daily_market[daily_market['ts_code'] == ts_code]
-            if not price_row.empty:
-                close_price = price_row['close'].values[0]
-                shares = (capital * weight) / close_price
-                positions[ts_code] = shares
+            close_price = daily_prices.get(ts_code)
+            shares = (capital * weight) / close_price
+            positions[ts_code] = shares
 
     return positions
\ No newline at end of file
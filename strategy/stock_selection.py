@@ -1,37 +1,69 @@
 import pandas as pd
 import numpy as np
 import os
+from factors.preprocessing import preprocess_factors
+from utils.schema import from_date_key
 
-def standardize_and_score(group, factor_weights):
+
+def composite_score(factor_block, factor_weights):
     """
-    对单期因子数据进行标准化并计算综合评分
+    用预处理（去极值+标准化+缺失填0）后的因子块计算综合评分
+    :return: [n_dates, n_stocks] 评分面板（没有数据的 股票×日期 为NaN）
     """
-    for factor in factor_weights:
-        group[f'{factor}_z'] = (group[factor] - group[factor].mean()) / (group[factor].std() + 1e-8)
-    group['composite_score'] = sum(group[f'{factor}_z'] * weight for factor, weight in factor_weights.items())
-    return group
+    weights = np.array([factor_weights[factor] for factor in factor_weights], dtype=np.float64)
+    columns = [factor_block.factors.index(factor) for factor in factor_weights]
+    return factor_block.values[:, :, columns].astype(np.float64) @ weights
+
 
-def select_stocks_by_score(group, top_n=50):
+def select_top_n(score, top_n=50):
     """
-    根据因子评分选出Top N股票，并计算等权权重（可替换为评分加权）
+    每个日期选出评分最高的Top N股票（评分为NaN的不入选），等权配置
+    :return: (date_idx, stock_idx, weight)，按日期、评分从高到低排列
     """
-    group = group.sort_values(by='composite_score', ascending=False).head(top_n)
-    group['weight'] = 1 / len(group)  # 等权配置，你也可以改成按评分加权
-    return group[['trade_date', 'ts_code', 'weight']]
+    ranked = np.where(np.isnan(score), -np.inf, score)
+    order = np.argsort(-ranked, axis=1, kind='stable')[:, :top_n]
+    n_valid = np.minimum((~np.isnan(score)).sum(axis=1), top_n)
+    keep = np.arange(order.shape[1])[None, :] < n_valid[:, None]
+    date_idx = np.repeat(np.arange(score.shape[0])[:, None], order.shape[1], axis=1)[keep]
+    stock_idx = order[keep]
+    weight = 1 / n_valid[date_idx]  # 等权配置，你也可以改成按评分加权
+    return date_idx, stock_idx, weight
 
-def construct_positions(factor_data, factor_weights, top_n=50, output_dir='output'):
+
+def construct_positions(factor_data, factor_weights, top_n=50, output_dir='output', universe=None, factor_block=None):
     """
-    完整流程：因子标准化 -> 综合评分 -> 选股 -> 计算权重 -> 保存持仓文件
+    完整流程：股票池过滤 -> 因子标准化 -> 综合评分 -> 选股 -> 计算权重 -> 保存持仓文件
+    :param universe: 可选，股票池掩码（utils.universe.Universe），只在可交易且可买入的股票中选股
+    :param factor_block: 可选，已预处理的因子块（factors.preprocessing.FactorBlock），需包含factor_weights中的因子；
+                         不传入时在可交易且可买入的股票上预处理
     """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # 逐期标准化和评分
-    factor_data = factor_data.groupby('trade_date').apply(lambda x: standardize_and_score(x, factor_weights))
+    if factor_block is None:
+        factor_block = preprocess_factors(factor_data, list(factor_weights), universe=universe,
+                                          universe_masks=('tradable', 'can_buy'))
+
+    # 所有日期一次完成评分
+    score = composite_score(factor_block, factor_weights)
+    if universe is not None:
+        # 因子块与股票池的日历/代码可能不同，按日期键和代码对齐掩码
+        row = np.searchsorted(universe.dates, factor_block.dates)
+        col = np.searchsorted(universe.symbols, factor_block.symbols)
+        row_ok = (row < len(universe.dates)) & (universe.dates[np.minimum(row, len(universe.dates) - 1)] == factor_block.dates)
+        col_ok = (col < len(universe.symbols)) & (universe.symbols[np.minimum(col, len(universe.symbols) - 1)] == factor_block.symbols)
+        mask = universe.mask('tradable', 'can_buy')[np.ix_(np.minimum(row, len(universe.dates) - 1),
+                                                           np.minimum(col, len(universe.symbols) - 1))]
+        mask &= row_ok[:, None] & col_ok[None, :]
+        score = np.where(mask, score, np.nan)
 
     # 逐期选股并生成仓位
-    positions = factor_data.groupby('trade_date').apply(lambda x: select_stocks_by_score(x, top_n))
-    positions = positions.reset_index(drop=True)
+    date_idx, stock_idx, weight = select_top_n(score, top_n)
+    positions = pd.DataFrame({
+        'trade_date': from_date_key(factor_block.dates[date_idx]).to_numpy(),
+        'ts_code': factor_block.symbols[stock_idx],
+        'weight': weight,
+    })
 
     # 保存到positions.csv
     positions.to_csv(os.path.join(output_dir, 'positions.csv'), index=False)
@@ -41,7 +73,7 @@ def construct_positions(factor_data, factor_weights, top_n=50, output_dir='outpu
 if __name__ == "__main__":
     # 示例因子数据（实盘请替换成真实数据）
     data = {
-        'trade_date': ['2024-03-01'] * 5 + ['2024-03-02'] * 5,
+        'trade_date': pd.to_datetime(['2024-03-01'] * 5 + ['2024-03-04'] * 5),
         'ts_code': ['000001.SZ', '600519.SH', '002230.SZ', '000858.SZ', '300750.SZ'] * 2,
         'pe_ttm': [12, 25, 30, 15, 40, 12, 24, 29, 16, 38],
         'roe': [0.15, 0.22, 0.18, 0.21, 0.13, 0.14, 0.21, 0.17, 0.20, 0.12],
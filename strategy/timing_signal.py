@@ -4,8 +4,8 @@
 包含均线择时、市场宽度、成交量趋势等信号计算
 """
 
-import pandas as pd
 import numpy as np
+from utils.market_summary import build_market_summary
 
 def calculate_moving_average_signals(market_data):
     """
@@ -19,19 +19,19 @@ def calculate_moving_average_signals(market_data):
     index_data['ma_signal'] = np.where(index_data['ma20'] > index_data['ma60'], 1, 0)
     return index_data[['trade_date', 'ma_signal']]
 
-def calculate_market_breadth_signals(market_data):
+def calculate_market_breadth_signals(market_data, market_summary=None):
     """
     市场宽度指标：
     - 上涨家数占比 > 60%：多头市场
     - 上涨家数占比 < 40%：空头市场
+    :param market_data: 行情数据（trade_date, ts_code, pct_chg；没有pct_chg时需要close和pre_close）
+    :param market_summary: 可选，全市场每日汇总表（utils.market_summary.build_market_summary），
+                           不传入时由market_data中的个股行情构建
     """
-    def daily_breadth(group):
-        up_stocks = (group['pct_chg'] > 0).sum()
-        total_stocks = len(group)
-        return up_stocks / total_stocks
+    if market_summary is None:
+        market_summary = build_market_summary(market_data[market_data['ts_code'] != '000001.SH'])
 
-    breadth_df = market_data.groupby('trade_date').apply(daily_breadth).reset_index()
-    breadth_df.columns = ['trade_date', 'up_ratio']
+    breadth_df = market_summary[['up_ratio']].reset_index()
     breadth_df['breadth_signal'] = np.where(breadth_df['up_ratio'] > 0.6, 1,
                                              np.where(breadth_df['up_ratio'] < 0.4, 0, np.nan))
 
@@ -49,13 +49,14 @@ def calculate_volume_trend_signals(market_data):
     index_data['volume_signal'] = np.where(index_data['vol_ma5'] > index_data['vol_ma20'], 1, 0)
     return index_data[['trade_date', 'volume_signal']]
 
-def generate_combined_timing_signal(market_data):
+def generate_combined_timing_signal(market_data, market_summary=None):
     """
     综合多个择时信号生成最终择时信号
     信号权重可以根据策略经验调整
+    :param market_summary: 可选，全市场每日汇总表，市场宽度直接读取
     """
     ma_signals = calculate_moving_average_signals(market_data)
-    breadth_signals = calculate_market_breadth_signals(market_data)
+    breadth_signals = calculate_market_breadth_signals(market_data, market_summary)
     volume_signals = calculate_volume_trend_signals(market_data)
 
     combined = ma_signals.merge(breadth_signals, on='trade_date', how='left')
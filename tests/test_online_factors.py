@@ -0,0 +1,50 @@
+# test_online_factors.py
+# 在线技术因子：历史回放建立状态 -> 保存/加载 -> 逐日增量更新，结果应与批量计算一致
+
+import numpy as np
+import pandas as pd
+from factors.online_factors import OnlineTechnicalState
+from factors.technical_factors import calculate_technical_factors
+
+WINDOWS = [5, 20]
+
+
+def _make_bars(n_dates=80, n_stocks=6, seed=0):
+    """
+    随机行情：含停牌缺行和晚上市股票，收盘价量级较大以放大滚动和的浮点误差
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2023-01-02', periods=n_dates)
+    frames = []
+    for i in range(n_stocks):
+        close = 1000.0 * np.exp(np.cumsum(rng.normal(0, 0.02, n_dates)))
+        bars = pd.DataFrame({'ts_code': f'{i:06d}.SZ', 'trade_date': dates, 'close': close,
+                             'vol': rng.uniform(1e5, 1e6, n_dates), 'float_share': rng.uniform(1e4, 2e4, n_dates)})
+        keep = rng.random(n_dates) > 0.1
+        keep[:i * 5] = False  # 第i只股票晚上市
+        frames.append(bars[keep])
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_online_matches_batch_after_save_and_load(tmp_path):
+    bars = _make_bars()
+    dates = np.sort(bars['trade_date'].unique())
+    split = dates[len(dates) // 2]
+
+    state, history = OnlineTechnicalState.from_history(bars[bars['trade_date'] < split], windows=WINDOWS)
+    state.save(tmp_path / 'state.npz')
+    state = OnlineTechnicalState.load(tmp_path / 'state.npz')
+    frames = [history] + [state.update(day) for _, day in bars[bars['trade_date'] >= split].groupby('trade_date')]
+    online = pd.concat(frames, ignore_index=True)
+
+    factor_cols = [col for col in online.columns if col not in ('ts_code', 'trade_date')]
+    batch = calculate_technical_factors(bars.copy())
+    batch['ts_code'] = batch['ts_code'].astype(str)
+    merged = online.merge(batch, on=['ts_code', 'trade_date'], suffixes=('_online', '_batch'))
+    assert len(merged) == len(bars)
+    for col in factor_cols:
+        if f'{col}_batch' not in merged.columns:
+            continue
+        np.testing.assert_allclose(merged[f'{col}_online'].to_numpy(dtype=np.float64),
+                                   merged[f'{col}_batch'].to_numpy(dtype=np.float64),
+                                   rtol=1e-4, atol=1e-5, equal_nan=True, err_msg=col)
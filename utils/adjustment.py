@@ -0,0 +1,102 @@
+# adjustment.py
+# 复权价格面板：由复权因子一次性向量化计算前复权/后复权OHLC，持久化为面板存储，因子和回测直接读取
+
+import os
+import numpy as np
+from config import ADJUSTED_PANEL_DIR, PRICE_ADJUST
+from utils.panel_store import PanelStore, long_to_panel
+from utils.schema import to_date_key
+
+PRICE_FIELDS = ['open', 'high', 'low', 'close', 'pre_close']
+
+
+def _ffill_panel(panel):
+    """
+    沿日期方向向前填充NaN（按列独立，向量化）
+    """
+    valid = ~np.isnan(panel)
+    idx = np.where(valid, np.arange(panel.shape[0])[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    filled = np.take_along_axis(panel, idx, axis=0)
+    # 第一个有效值之前保持NaN
+    filled[~np.maximum.accumulate(valid, axis=0)] = np.nan
+    return filled
+
+
+def compute_adjusted_panels(market_data, adj_factor):
+    """
+    一次性计算后复权（hfq）和前复权（qfq）价格面板
+    - 后复权价 = 原始价 × 复权因子
+    - 前复权价 = 原始价 × 复权因子 / 该股票最新复权因子
+    停牌日没有复权因子时沿用之前的复权因子
+    :return: dates, symbols, {f'{field}_hfq' / f'{field}_qfq' / 'adj_factor': 面板}
+    """
+    fields = [field for field in PRICE_FIELDS if field in market_data.columns]
+    dates, symbols, prices = long_to_panel(market_data, fields)
+    _, _, adj = long_to_panel(adj_factor, ['adj_factor'], dates=dates, symbols=symbols)
+
+    factor = _ffill_panel(adj['adj_factor'].astype(np.float64))
+    # 首个复权因子之前的日期沿用首个复权因子，完全没有复权因子的股票视为不复权
+    factor = _ffill_panel(factor[::-1])[::-1]
+    factor[np.isnan(factor)] = 1.0
+    latest = factor[-1]
+    panels = {'adj_factor': factor.astype(np.float32)}
+    for field in fields:
+        raw = prices[field].astype(np.float64)
+        hfq = raw * factor
+        panels[f'{field}_hfq'] = hfq.astype(np.float32)
+        panels[f'{field}_qfq'] = (hfq / latest).astype(np.float32)
+    return dates, symbols, panels
+
+
+def _panel_signature(market_data, adj_factor):
+    """
+    输入数据签名：日期区间、股票数、行数、复权因子的最新日期和数值和，数据有变化时重新计算
+    """
+    date_keys = to_date_key(market_data['trade_date'])
+    return {
+        'start': int(date_keys.min()),
+        'end': int(date_keys.max()),
+        'n_symbols': int(market_data['ts_code'].nunique()),
+        'n_rows': int(len(market_data)),
+        'adj_rows': int(len(adj_factor)),
+        'adj_sum': float(adj_factor['adj_factor'].astype(np.float64).sum()),
+    }
+
+
+def build_adjusted_panel_store(market_data, adj_factor, root=ADJUSTED_PANEL_DIR):
+    """
+    计算并持久化复权价格面板；输入数据没有变化时直接复用已保存的面板，不重复计算
+    :return: PanelStore
+    """
+    signature = _panel_signature(market_data, adj_factor)
+    if os.path.exists(os.path.join(root, 'dates.npy')):
+        store = PanelStore(root)
+        if store.load_meta().get('signature') == signature:
+            print("📊 复权价格面板未变化，直接读取缓存")
+            return store
+
+    print("📊 正在计算复权价格面板...")
+    dates, symbols, panels = compute_adjusted_panels(market_data, adj_factor)
+    store = PanelStore.create(root, dates, symbols)
+    for field, panel in panels.items():
+        store.write(field, panel)
+    store.save_meta(signature=signature)
+    return store
+
+
+def apply_adjusted_prices(market_data, store, how=PRICE_ADJUST):
+    """
+    用面板中的复权价格替换行情中的OHLC（原始收盘价/昨收保留为close_raw/pre_close_raw，用于涨跌停等按原始价格判断的场景）
+    :param how: 'hfq' 后复权；'qfq' 前复权
+    """
+    df = market_data.copy()
+    row = np.searchsorted(store.dates, to_date_key(df['trade_date']))
+    col = np.searchsorted(store.symbols, df['ts_code'].astype(str).to_numpy())
+    for field in ('close', 'pre_close'):
+        if field in df.columns:
+            df[f'{field}_raw'] = df[field]
+    for field in PRICE_FIELDS:
+        if field in df.columns:
+            df[field] = np.asarray(store[f'{field}_{how}'])[row, col]
+    return df
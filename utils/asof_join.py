@@ -0,0 +1,67 @@
+# asof_join.py
+# 按公告日的时点（point-in-time）as-of 连接：每份财报从公告后的下一个交易日起向后广播，直到下一份财报公告
+
+import numpy as np
+import pandas as pd
+from utils.schema import to_date_key
+
+# 组合键 = 股票编号 * KEY_BASE + YYYYMMDD日期键（日期键 < 1e8）
+KEY_BASE = 100_000_000
+
+
+def asof_join(left, right, left_on='trade_date', right_on='ann_date', by='ts_code', period_col='end_date',
+              allow_exact_matches=False):
+    """
+    把right（如财务指标）按as-of规则连接到left（如日线行情）上：
+    left每一行取同一只股票、公告日早于该交易日的最新一份报告
+    - 同一天公告多份报告时取报告期最新的一份
+    - 先公告了新报告期、之后又公告旧报告期（补充/更正）时，旧报告期不会覆盖新报告期
+    - allow_exact_matches=False：公告当天不可用（公告多在盘后发布），避免未来函数
+    全程在预排序的整数组合键上用一次searchsorted完成，不对日频宽表做整体ffill
+
+    :param left: 日频数据，需包含by和left_on列
+    :param right: 报告数据，需包含by、right_on和period_col列
+    :return: left（原行顺序）+ right的其余列，无可用报告的行为缺失值
+    """
+    left_codes = left[by].astype(str).to_numpy()
+    right_codes = right[by].astype(str).to_numpy()
+    symbols = np.union1d(np.unique(left_codes), np.unique(right_codes))
+
+    left_key = np.searchsorted(symbols, left_codes).astype(np.int64) * KEY_BASE + to_date_key(left[left_on])
+    right_code_idx = np.searchsorted(symbols, right_codes).astype(np.int64)
+    right_date = to_date_key(right[right_on]).astype(np.int64)
+    right_period = to_date_key(right[period_col]).astype(np.int64)
+
+    # 丢弃没有公告日的记录，按 (股票, 公告日, 报告期) 排序
+    has_date = right_date > 0
+    order = np.lexsort((right_period[has_date], right_date[has_date], right_code_idx[has_date]))
+    rows = np.flatnonzero(has_date)[order]
+    right_key = right_code_idx[rows] * KEY_BASE + right_date[rows]
+    period_key = right_code_idx[rows] * KEY_BASE + right_period[rows]
+
+    # 只保留报告期不早于此前已公告最新报告期的记录（组合键跨股票单调，可直接全局累计最大值）
+    keep = period_key >= np.maximum.accumulate(period_key) if len(period_key) else np.zeros(0, dtype=bool)
+    # 同一股票同一公告日只保留报告期最新的一条（排序后的最后一条）
+    keep[:-1] &= right_key[:-1] != right_key[1:]
+    rows, right_key = rows[keep], right_key[keep]
+
+    side = 'right' if allow_exact_matches else 'left'
+    match = np.searchsorted(right_key, left_key, side=side) - 1
+    valid = match >= 0
+    valid[valid] = (right_key[match[valid]] // KEY_BASE) == (left_key[valid] // KEY_BASE)
+    source_rows = rows[np.where(valid, match, 0)] if len(rows) else np.zeros(len(left_key), dtype=np.int64)
+
+    joined = left.reset_index(drop=True).copy()
+    for col in right.columns:
+        if col == by or col in joined.columns:
+            continue
+        values = right[col].to_numpy()[source_rows] if len(rows) else np.zeros(len(left_key), dtype=right[col].dtype)
+        if pd.api.types.is_integer_dtype(right[col]):
+            # 日期键等整数列沿用0表示缺失
+            joined[col] = np.where(valid, values, 0).astype(right[col].dtype)
+        elif pd.api.types.is_float_dtype(right[col]):
+            joined[col] = np.where(valid, values, np.nan).astype(right[col].dtype)
+        else:
+            joined[col] = pd.Series(values).where(valid)
+    joined.index = left.index
+    return joined
@@ -0,0 +1,141 @@
+# data_cache.py
+# 本地分区列式缓存：按 数据集/年/月 分区存储为Parquet，记录每只股票已覆盖的日期区间，支持增量补齐
+
+import os
+import json
+import pandas as pd
+from config import DATA_CACHE_DIR
+
+
+def _dataset_dir(dataset, cache_dir=DATA_CACHE_DIR):
+    return os.path.join(cache_dir, dataset)
+
+
+def _partition_path(dataset, year, month, cache_dir=DATA_CACHE_DIR):
+    return os.path.join(_dataset_dir(dataset, cache_dir), f'year={year}', f'month={month:02d}', 'data.parquet')
+
+
+def _meta_path(dataset, cache_dir=DATA_CACHE_DIR):
+    return os.path.join(_dataset_dir(dataset, cache_dir), '_coverage.json')
+
+
+def _shift_date(date_str, days):
+    return (pd.Timestamp(date_str) + pd.Timedelta(days=days)).strftime('%Y%m%d')
+
+
+def load_cache_meta(dataset, cache_dir=DATA_CACHE_DIR):
+    """
+    读取缓存覆盖信息：{ts_code: [start_date, end_date]}，日期格式YYYYMMDD
+    """
+    path = _meta_path(dataset, cache_dir)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_cache_meta(dataset, meta, cache_dir=DATA_CACHE_DIR):
+    """
+    保存缓存覆盖信息（先写临时文件再替换，避免中断导致文件损坏）
+    """
+    path = _meta_path(dataset, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, path)
+
+
+def update_cache_meta(meta, ts_codes, start_date, end_date):
+    """
+    将[start_date, end_date]合并进指定股票的覆盖区间
+    覆盖区间只会在已有区间两端连续扩展（缺口由plan_missing_ranges负责补齐），因此取并集即可
+    """
+    for ts_code in ts_codes:
+        if ts_code in meta:
+            old_start, old_end = meta[ts_code]
+            meta[ts_code] = [min(old_start, start_date), max(old_end, end_date)]
+        else:
+            meta[ts_code] = [start_date, end_date]
+    return meta
+
+
+def clamp_end_date(end_date):
+    """
+    覆盖区间最多记到昨天，当天及未来日期的数据尚未发布，不能标记为已缓存
+    """
+    yesterday = (pd.Timestamp.today().normalize() - pd.Timedelta(days=1)).strftime('%Y%m%d')
+    return min(end_date, yesterday)
+
+
+def plan_missing_ranges(meta, stock_list, start_date, end_date):
+    """
+    根据缓存覆盖信息，计算每只股票还需要下载的日期区间
+    - 新上市/未缓存股票：下载完整区间
+    - 已缓存股票：只下载覆盖区间之前或之后缺失的部分（含与请求区间之间的空档）
+    :return: {(start_date, end_date): [ts_code, ...]}，相同缺失区间的股票归并到一起
+    """
+    missing = {}
+    for ts_code in stock_list:
+        if ts_code not in meta:
+            ranges = [(start_date, end_date)]
+        else:
+            cached_start, cached_end = meta[ts_code]
+            ranges = []
+            # 向两端扩展时从覆盖区间边界开始下载，保证覆盖区间始终连续
+            if start_date < cached_start:
+                ranges.append((start_date, _shift_date(cached_start, -1)))
+            if end_date > cached_end:
+                ranges.append((_shift_date(cached_end, 1), end_date))
+        for date_range in ranges:
+            if date_range[0] <= date_range[1]:
+                missing.setdefault(date_range, []).append(ts_code)
+    return missing
+
+
+def write_cache(dataset, df, date_col='trade_date', key_cols=('ts_code',), cache_dir=DATA_CACHE_DIR):
+    """
+    将新下载的数据按年/月分区追加到缓存
+    同一分区内按 key_cols + date_col 去重，保留最新写入的记录
+    """
+    if df is None or df.empty:
+        return
+
+    dates = pd.to_datetime(df[date_col].astype(str), format='%Y%m%d', errors='coerce')
+    df = df[dates.notna()]
+    dates = dates[dates.notna()]
+    subset = list(key_cols) + [date_col]
+
+    for (year, month), part in df.groupby([dates.dt.year, dates.dt.month]):
+        path = _partition_path(dataset, year, month, cache_dir)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            part = pd.concat([pd.read_parquet(path), part], ignore_index=True)
+        part = part.drop_duplicates(subset=subset, keep='last')
+        tmp_path = path + '.tmp'
+        part.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+
+def read_cache(dataset, start_date, end_date, date_col='trade_date', ts_codes=None, cache_dir=DATA_CACHE_DIR):
+    """
+    读取缓存中[start_date, end_date]范围内的数据，只扫描涉及的年/月分区
+    :param ts_codes: 可选，只返回指定股票
+    :return: DataFrame（无缓存时返回空DataFrame）
+    """
+    months = pd.period_range(pd.Timestamp(start_date), pd.Timestamp(end_date), freq='M')
+    parts = []
+    for period in months:
+        path = _partition_path(dataset, period.year, period.month, cache_dir)
+        if os.path.exists(path):
+            parts.append(pd.read_parquet(path))
+
+    if not parts:
+        return pd.DataFrame()
+
+    df = pd.concat(parts, ignore_index=True)
+    date_str = df[date_col].astype(str)
+    df = df[(date_str >= start_date) & (date_str <= end_date)]
+    if ts_codes is not None:
+        df = df[df['ts_code'].isin(ts_codes)]
+    return df.reset_index(drop=True)
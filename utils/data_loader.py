@@ -1,73 +1,287 @@
-import tushare as ts
 import pandas as pd
 import time
 import requests
-from config import TUSHARE_TOKEN
+from utils.data_cache import (load_cache_meta, save_cache_meta, update_cache_meta, clamp_end_date,
+                              plan_missing_ranges, write_cache, read_cache)
+from utils.fetch_executor import FetchExecutor, save_failed_manifest
+from utils.data_source import get_data_source
+from utils.schema import compact_frame
 
-# 设置Tushare Token
-ts.set_token(TUSHARE_TOKEN)
-pro = ts.pro_api()
+# 每日指标只保留市值和股本（换手率等由技术因子计算，避免列名冲突）
+DAILY_BASIC_FIELDS = ['ts_code', 'trade_date', 'total_mv', 'float_share']
 
-# 获取全市场股票列表（带重试）
-def get_stock_list_with_retry(max_retries=5):
+# 各数据集的基本列（与Tushare接口返回的列名一致），没有任何数据时返回带这些列的空表，下游按列名取值不会报错
+DATASET_COLUMNS = {
+    'daily': ['ts_code', 'trade_date', 'open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg', 'vol', 'amount'],
+    'daily_basic': ['ts_code', 'trade_date', 'close', 'turnover_rate', 'pe_ttm', 'pb', 'total_share', 'float_share',
+                    'total_mv', 'circ_mv'],
+    'adj_factor': ['ts_code', 'trade_date', 'adj_factor'],
+    'index_daily': ['ts_code', 'trade_date', 'open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg', 'vol',
+                    'amount'],
+    'fina_indicator': ['ts_code', 'ann_date', 'end_date', 'grossprofit_margin', 'debt_to_assets'],
+    'income': ['ts_code', 'ann_date', 'f_ann_date', 'end_date', 'report_type', 'total_revenue', 'n_income_attr_p',
+               'ebitda'],
+    'balancesheet': ['ts_code', 'ann_date', 'f_ann_date', 'end_date', 'report_type', 'total_hldr_eqy_exc_min_int',
+                     'total_liab', 'money_cap'],
+    'namechange': ['ts_code', 'name', 'start_date', 'end_date', 'ann_date', 'change_reason'],
+}
+
+# 获取全市场股票基础信息（带重试）
+def load_stock_basic_with_retry(max_retries=5, api=None):
     """
-    获取全市场股票列表，并加入重试机制，防止Tushare超时或限流导致失败
+    获取全市场上市股票基础信息（ts_code, name, industry, market, list_date等），
+    并加入重试机制，防止Tushare超时或限流导致失败
     """
+    api = api or get_data_source()
     for attempt in range(max_retries):
         try:
             print(f"正在获取股票列表，尝试 {attempt+1}/{max_retries}...")
-            stock_list = pro.stock_basic(exchange='', list_status='L')['ts_code'].tolist()
-            print(f"成功获取股票列表，共 {len(stock_list)} 只股票")
-            return stock_list
+            stock_basic = api.stock_basic(exchange='', list_status='L')
+            print(f"成功获取股票列表，共 {len(stock_basic)} 只股票")
+            return stock_basic
         except requests.exceptions.RequestException as e:
             print(f"获取股票列表失败，重试 {attempt+1}/{max_retries}，错误信息：{e}")
             time.sleep(5)  # 每次重试前等待5秒
     raise Exception("多次重试后，获取股票列表依然失败")
 
-# 分批获取市场数据
-def load_market_data(start_date='20230101', end_date='20240306', batch_size=50):
+# 获取全市场股票列表（带重试）
+def get_stock_list_with_retry(max_retries=5, api=None):
+    """
+    获取全市场股票列表，并加入重试机制，防止Tushare超时或限流导致失败
+    """
+    return load_stock_basic_with_retry(max_retries=max_retries, api=api)['ts_code'].tolist()
+
+# 获取交易日历
+def get_trade_calendar(start_date, end_date, api=None):
     """
-    分批获取市场数据，每批最多获取batch_size只股票，每批之间延时5秒，防止Tushare限流
+    获取[start_date, end_date]内的交易日列表（YYYYMMDD字符串，升序）
     """
-    stock_list = get_stock_list_with_retry()
+    api = api or get_data_source()
+    cal = api.trade_cal(exchange='SSE', start_date=start_date, end_date=end_date, is_open='1')
+    cal = cal[cal['is_open'].astype(int) == 1]
+    return sorted(cal['cal_date'].astype(str).tolist())
+
+# 选择下载方式
+def plan_fetch_mode(missing, trade_dates):
+    """
+    比较两种下载方式所需的接口调用次数，选择调用次数更少的方式
+    - by_stock：每只股票每个缺失区间调用一次
+    - by_date：每个缺失的交易日调用一次，一次返回全市场截面
+    :param missing: plan_missing_ranges的结果 {(start_date, end_date): [ts_code, ...]}
+    :param trade_dates: 交易日列表
+    :return: ('by_date' 或 'by_stock', 需要按日期下载的交易日列表)
+    """
+    n_stock_calls = sum(len(codes) for codes in missing.values())
+    missing_dates = sorted({d for (range_start, range_end) in missing for d in trade_dates if range_start <= d <= range_end})
+    mode = 'by_date' if len(missing_dates) < n_stock_calls else 'by_stock'
+    return mode, missing_dates
+
+# 按股票逐只下载
+def _fetch_by_stock(missing, fetch_func, executor, label):
+    """
+    :return: 下载到的DataFrame列表, [((start_date, end_date), 成功的股票列表), ...], 失败请求列表
+    """
+    tasks = [((ts_code, range_start, range_end), {'ts_code': ts_code, 'start_date': range_start, 'end_date': range_end})
+             for (range_start, range_end), codes in missing.items() for ts_code in codes]
+    results, failures = executor.run(fetch_func, tasks, label=label)
+
+    covered = []
+    for (range_start, range_end), codes in missing.items():
+        succeeded = [ts_code for ts_code in codes if (ts_code, range_start, range_end) in results]
+        covered.append(((range_start, range_end), succeeded))
+    failed = [{'ts_code': ts_code, 'start_date': range_start, 'end_date': range_end, 'error': error}
+              for (ts_code, range_start, range_end), error in failures.items()]
+    return list(results.values()), covered, failed
+
+# 按交易日下载全市场截面
+def _fetch_by_date(missing, fetch_func, missing_dates, executor, label):
+    """
+    每个交易日一次调用取回全市场截面，只保留需要的股票
+    某只股票的缺失区间内只要有一个交易日下载失败，该区间就不记为已缓存
+    :return: 下载到的DataFrame列表, [((start_date, end_date), 成功的股票列表), ...], 失败请求列表
+    """
+    wanted = {ts_code for codes in missing.values() for ts_code in codes}
+    tasks = [(trade_date, {'trade_date': trade_date}) for trade_date in missing_dates]
+    results, failures = executor.run(fetch_func, tasks, label=label)
+    fetched = [df[df['ts_code'].isin(wanted)] for df in results.values()]
+
+    covered = []
+    for (range_start, range_end), codes in missing.items():
+        range_ok = not any(range_start <= d <= range_end for d in failures)
+        covered.append(((range_start, range_end), codes if range_ok else []))
+    failed = [{'trade_date': trade_date, 'error': error} for trade_date, error in failures.items()]
+    return fetched, covered, failed
+
+# 空数据时的表结构
+def _empty_frame(dataset):
+    """
+    带数据集基本列的空表（未登记的数据集返回无列的空表）
+    """
+    return pd.DataFrame(columns=DATASET_COLUMNS.get(dataset, []))
+
+# 先读缓存，只下载缺失部分
+def _load_with_cache(dataset, fetch_func, date_col, key_cols, stock_list, start_date, end_date, use_cache, label,
+                     fetch_mode='by_stock', trade_dates=None, executor=None):
+    """
+    通用的缓存加载流程：
+    1. 根据缓存覆盖信息计算每只股票缺失的日期区间（新上市股票下载完整区间）
+    2. 按股票或按交易日（fetch_mode='auto'时自动选择调用次数更少的方式）并发下载缺失部分，
+       追加写入按年/月分区的Parquet缓存；重试后仍失败的请求写入失败清单，下次加载时自动重新下载
+    3. 从缓存读取完整的[start_date, end_date]数据（没有任何数据时返回带DATASET_COLUMNS列的空表）
+    """
+    executor = executor or FetchExecutor()
+    meta = load_cache_meta(dataset) if use_cache else {}
+    missing = plan_missing_ranges(meta, stock_list, start_date, end_date)
+
+    missing_dates = []
+    if fetch_mode != 'by_stock':
+        auto_mode, missing_dates = plan_fetch_mode(missing, trade_dates)
+        if fetch_mode == 'auto':
+            fetch_mode = auto_mode
+    n_calls = len(missing_dates) if fetch_mode == 'by_date' else sum(len(codes) for codes in missing.values())
+    print(f"{label}缓存检查完成，下载方式 {fetch_mode}，需要调用接口 {n_calls} 次")
+
+    if fetch_mode == 'by_date':
+        fetched, covered, failed = _fetch_by_date(missing, fetch_func, missing_dates, executor, label)
+    else:
+        fetched, covered, failed = _fetch_by_stock(missing, fetch_func, executor, label)
+    save_failed_manifest(dataset, failed)
+
+    if not use_cache:
+        return pd.concat(fetched, ignore_index=True) if fetched else _empty_frame(dataset)
+
+    for (range_start, range_end), succeeded in covered:
+        coverage_end = clamp_end_date(range_end)
+        if range_start <= coverage_end:
+            update_cache_meta(meta, succeeded, range_start, coverage_end)
 
-    all_data = []
-    for i in range(0, len(stock_list), batch_size):
-        batch = stock_list[i:i+batch_size]
-        print(f"正在获取第 {i//batch_size + 1} 批市场数据，共 {len(batch)} 只股票...")
-        for ts_code in batch:
-            try:
-                df = pro.daily(ts_code=ts_code, start_date=start_date, end_date=end_date)
-                all_data.append(df)
-            except Exception as e:
-                print(f"获取 {ts_code} 行情数据失败，跳过。错误信息：{e}")
-        time.sleep(5)  # 每批次间隔5秒，降低触发限流风险
+    # 先写数据再写覆盖信息，中断时最多重复下载，不会误认为已缓存
+    if fetched:
+        write_cache(dataset, pd.concat(fetched, ignore_index=True), date_col=date_col, key_cols=key_cols)
+    save_cache_meta(dataset, meta)
 
-    market_data = pd.concat(all_data, ignore_index=True)
+    cached = read_cache(dataset, start_date, end_date, date_col=date_col, ts_codes=stock_list)
+    # 缓存中没有任何分区时read_cache返回无列的空表
+    return cached if len(cached.columns) else _empty_frame(dataset)
+
+# 并发获取市场数据
+def load_market_data(start_date='20230101', end_date='20240306', use_cache=True, fetch_mode='auto', api=None,
+                     stock_list=None, executor=None):
+    """
+    并发获取市场数据，整体调用频率由令牌桶控制在配置的每分钟调用上限以内
+    优先读取本地缓存，只下载缺失的日期区间和新上市股票
+    :param fetch_mode: 'by_stock' 按股票逐只下载；'by_date' 按交易日下载全市场截面；
+                       'auto' 根据交易日历自动选择接口调用次数更少的方式
+    :param api: 数据源（默认按config.DATA_SOURCE创建，可替换为回放数据源或本地桩接口用于测试）
+    :param stock_list: 股票列表（可与财务数据共用，避免重复获取）
+    :param executor: FetchExecutor（可与财务数据共用同一个限速器）
+    """
+    api = api or get_data_source()
+    stock_list = stock_list if stock_list is not None else get_stock_list_with_retry(api=api)
+    trade_dates = get_trade_calendar(start_date, end_date, api=api) if fetch_mode != 'by_stock' else None
+
+    market_data = _load_with_cache('daily', api.daily, 'trade_date', ('ts_code',), stock_list, start_date, end_date,
+                                   use_cache, label='市场数据', fetch_mode=fetch_mode, trade_dates=trade_dates,
+                                   executor=executor)
     market_data['trade_date'] = pd.to_datetime(market_data['trade_date'])
 
-    return market_data
+    return compact_frame(market_data)
+
+# 并发获取财务数据
+def load_financial_data(start_date='20230101', end_date='20240306', use_cache=True, api=None, stock_list=None,
+                        executor=None):
+    """
+    并发获取财务数据，整体调用频率由令牌桶控制在配置的每分钟调用上限以内
+    优先读取本地缓存（按公告日ann_date分区），只下载缺失的日期区间和新上市股票
+    :param api: 数据源（默认按config.DATA_SOURCE创建）
+    :param stock_list: 股票列表（可与市场数据共用，避免重复获取）
+    :param executor: FetchExecutor（可与市场数据共用同一个限速器）
+    """
+    api = api or get_data_source()
+    stock_list = stock_list if stock_list is not None else get_stock_list_with_retry(api=api)
+
+    financial_data = _load_with_cache('fina_indicator', api.fina_indicator, 'ann_date', ('ts_code', 'end_date'), stock_list,
+                                      start_date, end_date, use_cache, label='财务数据', executor=executor)
+
+    # ann_date/end_date转为int32日期键（YYYYMMDD）
+    return compact_frame(financial_data)
+
+# 获取每日指标
+def load_daily_basic(start_date='20230101', end_date='20240306', use_cache=True, fetch_mode='auto', api=None,
+                     stock_list=None, executor=None, fields=DAILY_BASIC_FIELDS):
+    """
+    获取每日指标（总市值、流通股本），与日线行情相同的缓存和按股票/按交易日下载方式
+    :param fields: 需要的列（总市值total_mv单位为万元）
+    """
+    api = api or get_data_source()
+    stock_list = stock_list if stock_list is not None else get_stock_list_with_retry(api=api)
+    trade_dates = get_trade_calendar(start_date, end_date, api=api) if fetch_mode != 'by_stock' else None
+
+    daily_basic = _load_with_cache('daily_basic', api.daily_basic, 'trade_date', ('ts_code',), stock_list, start_date,
+                                   end_date, use_cache, label='每日指标', fetch_mode=fetch_mode, trade_dates=trade_dates,
+                                   executor=executor)
+    daily_basic['trade_date'] = pd.to_datetime(daily_basic['trade_date'])
+
+    return compact_frame(daily_basic[[col for col in fields if col in daily_basic.columns]])
 
-# 分批获取财务数据
-def load_financial_data(start_date='20230101', end_date='20240306', batch_size=50):
+# 获取财务报表
+def load_statement_data(statement, start_date='20230101', end_date='20240306', use_cache=True, api=None,
+                        stock_list=None, executor=None):
     """
-    分批获取财务数据，每批最多获取batch_size只股票，每批之间延时5秒，防止Tushare限流
+    获取利润表（statement='income'）或资产负债表（statement='balancesheet'），按公告日缓存
     """
-    stock_list = get_stock_list_with_retry()
+    api = api or get_data_source()
+    stock_list = stock_list if stock_list is not None else get_stock_list_with_retry(api=api)
 
-    all_data = []
-    for i in range(0, len(stock_list), batch_size):
-        batch = stock_list[i:i+batch_size]
-        print(f"正在获取第 {i//batch_size + 1} 批财务数据，共 {len(batch)} 只股票...")
-        for ts_code in batch:
-            try:
-                df = pro.fina_indicator(ts_code=ts_code, start_date=start_date, end_date=end_date)
-                all_data.append(df)
-            except Exception as e:
-                print(f"获取 {ts_code} 财务数据失败，跳过。错误信息：{e}")
-        time.sleep(5)  # 每批次间隔5秒，降低触发限流风险
+    label = {'income': '利润表', 'balancesheet': '资产负债表'}[statement]
+    statement_data = _load_with_cache(statement, getattr(api, statement), 'ann_date', ('ts_code', 'end_date'),
+                                      stock_list, start_date, end_date, use_cache, label=label, executor=executor)
+
+    return compact_frame(statement_data)
+
+# 获取复权因子
+def load_adj_factor(start_date='20230101', end_date='20240306', use_cache=True, fetch_mode='auto', api=None,
+                    stock_list=None, executor=None):
+    """
+    获取复权因子（与日线行情相同的缓存和按股票/按交易日下载方式）
+    """
+    api = api or get_data_source()
+    stock_list = stock_list if stock_list is not None else get_stock_list_with_retry(api=api)
+    trade_dates = get_trade_calendar(start_date, end_date, api=api) if fetch_mode != 'by_stock' else None
+
+    adj_factor = _load_with_cache('adj_factor', api.adj_factor, 'trade_date', ('ts_code',), stock_list, start_date, end_date,
+                                  use_cache, label='复权因子', fetch_mode=fetch_mode, trade_dates=trade_dates,
+                                  executor=executor)
+    adj_factor['trade_date'] = pd.to_datetime(adj_factor['trade_date'])
+
+    return compact_frame(adj_factor)
+
+# 获取股票曾用名
+def load_name_history(start_date='19900101', end_date='20240306', use_cache=True, api=None, stock_list=None,
+                      executor=None):
+    """
+    获取股票曾用名记录（ts_code, name, start_date, end_date），用于按历史区间还原ST状态
+    接口按公告日期过滤，默认从1990年起取全部历史，按名称启用日start_date缓存，之后只增量下载新公告
+    """
+    api = api or get_data_source()
+    stock_list = stock_list if stock_list is not None else get_stock_list_with_retry(api=api)
+
+    name_history = _load_with_cache('namechange', api.namechange, 'start_date', ('ts_code',), stock_list, start_date,
+                                    end_date, use_cache, label='曾用名', executor=executor)
+
+    return compact_frame(name_history)
+
+# 获取指数行情
+def load_index_data(index_codes=('000001.SH',), start_date='20230101', end_date='20240306', use_cache=True, api=None,
+                    executor=None):
+    """
+    获取指数日线行情（用于择时信号和基准对比），同样走本地缓存
+    :param index_codes: 指数代码列表
+    """
+    api = api or get_data_source()
 
-    financial_data = pd.concat(all_data, ignore_index=True)
-    financial_data['trade_date'] = pd.to_datetime(financial_data['trade_date'])
+    index_data = _load_with_cache('index_daily', api.index_daily, 'trade_date', ('ts_code',), list(index_codes),
+                                  start_date, end_date, use_cache, label='指数行情', executor=executor)
+    index_data['trade_date'] = pd.to_datetime(index_data['trade_date'])
 
-    return financial_data
\ No newline at end of file
+    return compact_frame(index_data)
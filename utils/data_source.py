@@ -0,0 +1,234 @@
+# data_source.py
+# 可插拔数据源：统一的数据接口 + Tushare实现 + 录制/回放实现（离线、可复现地运行和压测全流程）
+
+import os
+import json
+import hashlib
+import pandas as pd
+from config import TUSHARE_TOKEN, DATA_SOURCE, REPLAY_DIR
+
+
+class ReplayMissError(LookupError):
+    """
+    回放数据中没有对应请求的记录（不可重试）
+    """
+
+
+class DataSource:
+    """
+    数据源接口，方法名和参数与Tushare pro接口保持一致，返回相同结构的DataFrame
+    - stock_basic：股票列表
+    - trade_cal：交易日历
+    - daily：日线行情
+    - fina_indicator：财务指标
+    - index_daily：指数日线
+    - adj_factor：复权因子
+    - daily_basic：每日指标（总市值、流通股本等）
+    - income：利润表（累计值）
+    - balancesheet：资产负债表
+    - namechange：股票曾用名（用于还原历史ST状态）
+    """
+
+    def stock_basic(self, **kwargs):
+        raise NotImplementedError
+
+    def trade_cal(self, **kwargs):
+        raise NotImplementedError
+
+    def daily(self, **kwargs):
+        raise NotImplementedError
+
+    def fina_indicator(self, **kwargs):
+        raise NotImplementedError
+
+    def index_daily(self, **kwargs):
+        raise NotImplementedError
+
+    def adj_factor(self, **kwargs):
+        raise NotImplementedError
+
+    def daily_basic(self, **kwargs):
+        raise NotImplementedError
+
+    def income(self, **kwargs):
+        raise NotImplementedError
+
+    def balancesheet(self, **kwargs):
+        raise NotImplementedError
+
+    def namechange(self, **kwargs):
+        raise NotImplementedError
+
+
+class TushareDataSource(DataSource):
+    """
+    Tushare数据源，首次调用时才连接，导入本模块不需要网络和Token
+    """
+
+    def __init__(self, token=TUSHARE_TOKEN):
+        self.token = token
+        self._pro = None
+
+    @property
+    def pro(self):
+        if self._pro is None:
+            import tushare as ts
+            self._pro = ts.pro_api(self.token)
+        return self._pro
+
+    def stock_basic(self, **kwargs):
+        return self.pro.stock_basic(**kwargs)
+
+    def trade_cal(self, **kwargs):
+        return self.pro.trade_cal(**kwargs)
+
+    def daily(self, **kwargs):
+        return self.pro.daily(**kwargs)
+
+    def fina_indicator(self, **kwargs):
+        return self.pro.fina_indicator(**kwargs)
+
+    def index_daily(self, **kwargs):
+        return self.pro.index_daily(**kwargs)
+
+    def adj_factor(self, **kwargs):
+        return self.pro.adj_factor(**kwargs)
+
+    def daily_basic(self, **kwargs):
+        return self.pro.daily_basic(**kwargs)
+
+    def income(self, **kwargs):
+        return self.pro.income(**kwargs)
+
+    def balancesheet(self, **kwargs):
+        return self.pro.balancesheet(**kwargs)
+
+    def namechange(self, **kwargs):
+        return self.pro.namechange(**kwargs)
+
+
+def _request_path(replay_dir, method, kwargs):
+    """
+    请求 -> 回放文件路径：{replay_dir}/{接口名}/{参数哈希}.parquet
+    """
+    key = json.dumps({k: str(v) for k, v in kwargs.items()}, sort_keys=True)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(replay_dir, method, f'{digest}.parquet')
+
+
+class RecordingDataSource(DataSource):
+    """
+    录制数据源：转发请求给底层数据源，并把每次返回结果按请求参数保存到replay_dir
+    """
+
+    def __init__(self, source, replay_dir=REPLAY_DIR):
+        self.source = source
+        self.replay_dir = replay_dir
+
+    def _record(self, method, kwargs):
+        df = getattr(self.source, method)(**kwargs)
+        path = _request_path(self.replay_dir, method, kwargs)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        return df
+
+    def stock_basic(self, **kwargs):
+        return self._record('stock_basic', kwargs)
+
+    def trade_cal(self, **kwargs):
+        return self._record('trade_cal', kwargs)
+
+    def daily(self, **kwargs):
+        return self._record('daily', kwargs)
+
+    def fina_indicator(self, **kwargs):
+        return self._record('fina_indicator', kwargs)
+
+    def index_daily(self, **kwargs):
+        return self._record('index_daily', kwargs)
+
+    def adj_factor(self, **kwargs):
+        return self._record('adj_factor', kwargs)
+
+    def daily_basic(self, **kwargs):
+        return self._record('daily_basic', kwargs)
+
+    def income(self, **kwargs):
+        return self._record('income', kwargs)
+
+    def balancesheet(self, **kwargs):
+        return self._record('balancesheet', kwargs)
+
+    def namechange(self, **kwargs):
+        return self._record('namechange', kwargs)
+
+
+class ReplayDataSource(DataSource):
+    """
+    回放数据源：按请求参数读取RecordingDataSource录制的结果，不访问网络
+    请求未被录制过时抛出ReplayMissError
+    """
+
+    def __init__(self, replay_dir=REPLAY_DIR):
+        self.replay_dir = replay_dir
+
+    def _replay(self, method, kwargs):
+        path = _request_path(self.replay_dir, method, kwargs)
+        if not os.path.exists(path):
+            raise ReplayMissError(f'回放数据中没有 {method}({kwargs}) 的记录')
+        return pd.read_parquet(path)
+
+    def stock_basic(self, **kwargs):
+        return self._replay('stock_basic', kwargs)
+
+    def trade_cal(self, **kwargs):
+        return self._replay('trade_cal', kwargs)
+
+    def daily(self, **kwargs):
+        return self._replay('daily', kwargs)
+
+    def fina_indicator(self, **kwargs):
+        return self._replay('fina_indicator', kwargs)
+
+    def index_daily(self, **kwargs):
+        return self._replay('index_daily', kwargs)
+
+    def adj_factor(self, **kwargs):
+        return self._replay('adj_factor', kwargs)
+
+    def daily_basic(self, **kwargs):
+        return self._replay('daily_basic', kwargs)
+
+    def income(self, **kwargs):
+        return self._replay('income', kwargs)
+
+    def balancesheet(self, **kwargs):
+        return self._replay('balancesheet', kwargs)
+
+    def namechange(self, **kwargs):
+        return self._replay('namechange', kwargs)
+
+
+_default_source = None
+
+
+def get_data_source(name=None):
+    """
+    按配置创建数据源（默认数据源只创建一次）
+    :param name: 'tushare' 直连Tushare；'record' 直连并录制；'replay' 离线回放。None表示使用config.DATA_SOURCE
+    """
+    global _default_source
+    if name is None:
+        if _default_source is None:
+            _default_source = get_data_source(DATA_SOURCE)
+        return _default_source
+
+    if name == 'tushare':
+        return TushareDataSource()
+    if name == 'record':
+        return RecordingDataSource(TushareDataSource())
+    if name == 'replay':
+        return ReplayDataSource()
+    raise ValueError(f'未知数据源: {name}')
@@ -0,0 +1,132 @@
+# fetch_executor.py
+# 并发下载执行器：有界线程池 + 令牌桶限速（每分钟调用次数）+ 指数退避重试 + 失败清单
+
+import os
+import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+from config import DATA_CACHE_DIR, FETCH_MAX_WORKERS, TUSHARE_CALLS_PER_MINUTE, FETCH_MAX_RETRIES
+from utils.data_source import ReplayMissError
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶：按 calls_per_minute 匀速补充令牌，桶容量 burst 允许短时突发
+    """
+
+    def __init__(self, calls_per_minute, burst=None):
+        self.rate = calls_per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1, int(self.rate))
+        self.tokens = float(self.capacity)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        取一个令牌，令牌不足时阻塞等待
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class FetchExecutor:
+    """
+    并发执行一批数据接口请求：
+    - 最多 max_workers 个请求同时进行
+    - 所有请求共享一个令牌桶，整体调用频率不超过 calls_per_minute
+    - 单个请求失败后按指数退避重试，最多 max_retries 次
+    - 重试耗尽的请求记录在 failures 中，不会静默丢弃
+    """
+
+    def __init__(self, max_workers=FETCH_MAX_WORKERS, calls_per_minute=TUSHARE_CALLS_PER_MINUTE,
+                 max_retries=FETCH_MAX_RETRIES, backoff_base=1.0, backoff_max=60.0):
+        self.max_workers = max_workers
+        self.bucket = TokenBucket(calls_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def _call_with_retry(self, fetch_func, kwargs):
+        for attempt in range(self.max_retries):
+            self.bucket.acquire()
+            try:
+                return fetch_func(**kwargs)
+            except ReplayMissError:
+                raise  # 回放数据缺失不可重试（接口返回的KeyError/IndexError等仍按普通错误重试）
+            except Exception:
+                if attempt == self.max_retries - 1:
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+                time.sleep(delay + random.uniform(0, self.backoff_base))
+
+    def run(self, fetch_func, tasks, label=''):
+        """
+        :param fetch_func: 接口函数，如 pro.daily
+        :param tasks: [(任务标识, 调用参数dict), ...]
+        :return: ({任务标识: 返回结果}（按tasks顺序）, {任务标识: 错误信息})
+        """
+        results = {}
+        failures = {}
+        if not tasks:
+            return results, failures
+
+        report_every = max(1, len(tasks) // 20)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self._call_with_retry, fetch_func, kwargs): key for key, kwargs in tasks}
+            for done, future in enumerate(as_completed(futures), start=1):
+                key = futures[future]
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    failures[key] = str(e)
+                    print(f"获取 {key} {label}失败（已重试{self.max_retries}次）。错误信息：{e}")
+                if done % report_every == 0 or done == len(tasks):
+                    print(f"{label}下载进度 {done}/{len(tasks)}，失败 {len(failures)}")
+
+        # 按任务顺序返回，保证结果与完成顺序无关、可复现
+        results = {key: results[key] for key, _ in tasks if key in results}
+        return results, failures
+
+
+def _manifest_path(dataset, cache_dir=DATA_CACHE_DIR):
+    return os.path.join(cache_dir, dataset, '_failed.json')
+
+
+def save_failed_manifest(dataset, failures, cache_dir=DATA_CACHE_DIR):
+    """
+    保存失败清单（覆盖上一次的清单）
+    失败的请求不会写入缓存覆盖信息，下次加载同一区间时会自动重新下载
+    :param failures: [{'ts_code'/'trade_date': ..., 'start_date': ..., 'end_date': ..., 'error': ...}, ...]
+    """
+    path = _manifest_path(dataset, cache_dir)
+    if not failures:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'updated_at': str(pd.Timestamp.now()), 'failures': failures}, f, ensure_ascii=False, indent=2)
+    print(f"⚠️ {dataset} 有 {len(failures)} 个请求失败，清单已保存至 {path}")
+
+
+def load_failed_manifest(dataset, cache_dir=DATA_CACHE_DIR):
+    """
+    读取失败清单
+    :return: 失败请求列表（无失败时为空列表）
+    """
+    path = _manifest_path(dataset, cache_dir)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)['failures']
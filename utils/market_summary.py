@@ -0,0 +1,87 @@
+# market_summary.py
+# 全市场每日汇总表：每次加载数据后在 date×stock 面板上一次性计算涨跌家数、涨跌停家数、成交量/成交额合计和创新高/新低家数，
+# 择时信号和市场情绪因子统一读取该表，不再各自对全市场行情做groupby
+
+import numpy as np
+import pandas as pd
+from config import MARKET_HIGH_LOW_WINDOW, MARKET_HIGH_LOW_MIN_DAYS
+from utils.panel_store import long_to_panel
+from utils.schema import from_date_key
+from utils.universe import price_limit_ratio, limit_hits, is_st_name
+
+
+def _rolling_extreme(panel, window, how, min_periods):
+    """
+    沿日期轴的前window个交易日（不含当日）中有交易日期的最高/最低值（停牌、未上市的NaN跳过），
+    窗口内有交易的天数不足min_periods时为NaN
+    """
+    frame = pd.DataFrame(panel).rolling(window, min_periods=min_periods)
+    extreme = frame.max() if how == 'max' else frame.min()
+    return extreme.shift(1).to_numpy()
+
+
+def build_market_summary(market_data, stock_basic=None, high_low_window=MARKET_HIGH_LOW_WINDOW,
+                         high_low_min_days=MARKET_HIGH_LOW_MIN_DAYS):
+    """
+    构建全市场每日汇总表
+    :param market_data: 个股行情（ts_code, trade_date，以及pct_chg或close/pre_close；可选vol, amount；
+                        有close_raw/pre_close_raw时用原始价格判断涨跌停），不应包含指数行情
+                        只有pct_chg时涨跌停按涨跌幅判断，没有close时创新高/新低家数为NaN
+    :param stock_basic: 可选，股票基础信息（按简称判断ST，用于确定涨跌幅限制）
+    :param high_low_window: 创新高/新低的回看交易日数（需要行情起始日早于分析区间这么多交易日，见config）
+    :param high_low_min_days: 回看窗口内至少有交易的天数，不足的股票不参与创新高/新低统计
+    :return: 以trade_date为索引的DataFrame：
+             n_traded, advance, decline, up_ratio, advance_decline_ratio,
+             limit_up_count, limit_down_count, market_heat, total_vol, total_amount, new_high_count, new_low_count
+    """
+    close_col = 'close_raw' if 'close_raw' in market_data.columns else 'close'
+    pre_close_col = 'pre_close_raw' if 'pre_close_raw' in market_data.columns else 'pre_close'
+    fields = [field for field in dict.fromkeys(['close', close_col, pre_close_col, 'pct_chg', 'vol', 'amount'])
+              if field in market_data.columns]
+    dates, symbols, panels = long_to_panel(market_data, fields)
+    has_prices = {close_col, pre_close_col} <= set(panels)
+    if 'pct_chg' in panels:
+        change = panels['pct_chg'].astype(np.float64)
+    else:
+        change = panels[close_col].astype(np.float64) - panels[pre_close_col].astype(np.float64)
+    traded = ~np.isnan(change)
+
+    # 涨跌停按板块和ST状态的涨跌幅限制判断
+    is_st = np.zeros(len(symbols), dtype=bool)
+    if stock_basic is not None:
+        names = stock_basic.drop_duplicates('ts_code').set_index('ts_code')['name'].reindex(symbols)
+        is_st = is_st_name(names.to_numpy())
+    limit = price_limit_ratio(symbols, is_st[None, :], dates[:, None])
+    if has_prices:
+        limit_up, limit_down = limit_hits(panels[close_col].astype(np.float64),
+                                          panels[pre_close_col].astype(np.float64), limit)
+    else:
+        with np.errstate(invalid='ignore'):
+            limit_up, limit_down = change >= limit * 100 - 0.1, change <= -limit * 100 + 0.1
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if 'close' in panels:
+            close = panels['close'].astype(np.float64)
+            new_high = (close > _rolling_extreme(close, high_low_window, 'max', high_low_min_days)).sum(axis=1)
+            new_low = (close < _rolling_extreme(close, high_low_window, 'min', high_low_min_days)).sum(axis=1)
+        else:
+            new_high = new_low = np.nan
+
+        n_traded = traded.sum(axis=1)
+        advance = (change > 0).sum(axis=1)
+        decline = (change < 0).sum(axis=1)
+        summary = pd.DataFrame({
+            'n_traded': n_traded,
+            'advance': advance,
+            'decline': decline,
+            'up_ratio': np.where(n_traded > 0, advance / n_traded, np.nan),
+            'advance_decline_ratio': advance / np.maximum(decline, 1),
+            'limit_up_count': limit_up.sum(axis=1),
+            'limit_down_count': limit_down.sum(axis=1),
+        }, index=pd.Index(from_date_key(dates), name='trade_date'))
+    summary['market_heat'] = summary['limit_up_count'] / (summary['limit_down_count'] + 1)
+    for field, column in (('vol', 'total_vol'), ('amount', 'total_amount')):
+        summary[column] = np.nansum(panels[field], axis=1, dtype=np.float64) if field in panels else np.nan
+    summary['new_high_count'] = new_high
+    summary['new_low_count'] = new_low
+    return summary
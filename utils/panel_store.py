@@ -0,0 +1,167 @@
+# panel_store.py
+# date×stock 稠密面板存储：所有字段对齐到同一交易日历和股票代码索引，按字段保存为可内存映射的.npy文件
+
+import os
+import json
+import numpy as np
+import pandas as pd
+from utils.schema import to_date_key, from_date_key
+
+
+def long_to_panel(df, fields, dates=None, symbols=None, date_col='trade_date'):
+    """
+    长表（每行一个 股票×日期）-> 面板（每个字段一个[n_dates, n_stocks]数组）
+    :param fields: 需要转换的字段列表
+    :param dates: 可选，int32日期键（YYYYMMDD）升序数组，默认取df中出现的全部日期
+    :param symbols: 可选，股票代码升序数组，默认取df中出现的全部代码
+    :return: dates, symbols, {field: float32数组}（未出现的 股票×日期 为NaN）
+    """
+    date_keys = to_date_key(df[date_col])
+    codes = df['ts_code'].astype(str).to_numpy()
+    dates = np.unique(date_keys) if dates is None else np.asarray(dates, dtype=np.int32)
+    symbols = np.unique(codes) if symbols is None else np.asarray(symbols)
+
+    row = np.searchsorted(dates, date_keys)
+    col = np.searchsorted(symbols, codes)
+    # 不在指定日历/代码范围内的行直接丢弃
+    valid = (row < len(dates)) & (col < len(symbols))
+    valid[valid] = (dates[row[valid]] == date_keys[valid]) & (symbols[col[valid]] == codes[valid])
+    row, col = row[valid], col[valid]
+
+    panels = {}
+    for field in fields:
+        panel = np.full((len(dates), len(symbols)), np.nan, dtype=np.float32)
+        panel[row, col] = df[field].to_numpy(dtype=np.float32)[valid]
+        panels[field] = panel
+    return dates, symbols, panels
+
+
+def panel_to_long(dates, symbols, panels, dropna=True, date_col='trade_date'):
+    """
+    面板 -> 长表（trade_date为datetime64，按ts_code, trade_date排序）
+    :param dropna: 是否丢弃所有字段都为NaN的 股票×日期
+    """
+    fields = list(panels)
+    n_dates, n_stocks = len(dates), len(symbols)
+    # 转置成 stock-major 顺序，与按(ts_code, trade_date)排序的长表一致
+    columns = {field: np.asarray(panels[field]).T.reshape(-1) for field in fields}
+    stock_idx = np.repeat(np.arange(n_stocks), n_dates)
+    date_idx = np.tile(np.arange(n_dates), n_stocks)
+
+    if dropna and fields:
+        keep = np.zeros(n_dates * n_stocks, dtype=bool)
+        for values in columns.values():
+            keep |= ~np.isnan(values)
+        stock_idx, date_idx = stock_idx[keep], date_idx[keep]
+        columns = {field: values[keep] for field, values in columns.items()}
+
+    df = pd.DataFrame({
+        'ts_code': pd.Categorical.from_codes(stock_idx, categories=symbols),
+        date_col: from_date_key(np.asarray(dates)[date_idx]).to_numpy(),
+    })
+    for field, values in columns.items():
+        df[field] = values
+    return df
+
+
+class PanelStore:
+    """
+    面板存储目录：
+    - dates.npy：int32日期键（YYYYMMDD）升序
+    - symbols.npy：股票代码升序
+    - {field}.npy：[n_dates, n_stocks] float32面板，读取时内存映射（零拷贝，只读）
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.dates = np.load(os.path.join(root, 'dates.npy'))
+        self.symbols = np.load(os.path.join(root, 'symbols.npy'), allow_pickle=False)
+        self._symbol_index = None
+
+    @classmethod
+    def create(cls, root, dates, symbols):
+        """
+        新建（或覆盖）面板存储，只写入日历和代码索引
+        """
+        os.makedirs(root, exist_ok=True)
+        np.save(os.path.join(root, 'dates.npy'), np.asarray(dates, dtype=np.int32))
+        np.save(os.path.join(root, 'symbols.npy'), np.asarray(symbols).astype(str))
+        return cls(root)
+
+    @classmethod
+    def from_long(cls, df, root, fields, date_col='trade_date'):
+        """
+        长表 -> 面板存储
+        """
+        dates, symbols, panels = long_to_panel(df, fields, date_col=date_col)
+        store = cls.create(root, dates, symbols)
+        for field, panel in panels.items():
+            store.write(field, panel)
+        return store
+
+    @property
+    def shape(self):
+        return len(self.dates), len(self.symbols)
+
+    @property
+    def fields(self):
+        return sorted(name[:-4] for name in os.listdir(self.root)
+                      if name.endswith('.npy') and name not in ('dates.npy', 'symbols.npy'))
+
+    def write(self, field, panel):
+        """
+        写入一个字段（形状必须与日历×代码一致）
+        """
+        panel = np.asarray(panel, dtype=np.float32)
+        if panel.shape != self.shape:
+            raise ValueError(f'{field} 形状 {panel.shape} 与面板 {self.shape} 不一致')
+        path = os.path.join(self.root, f'{field}.npy')
+        tmp_path = path + '.tmp.npy'
+        np.save(tmp_path, panel)
+        os.replace(tmp_path, path)
+
+    def __getitem__(self, field):
+        """
+        内存映射读取一个字段（只读，不会把整个文件读入内存）
+        """
+        return np.load(os.path.join(self.root, f'{field}.npy'), mmap_mode='r')
+
+    def __contains__(self, field):
+        return os.path.exists(os.path.join(self.root, f'{field}.npy'))
+
+    def symbol_index(self, ts_codes):
+        """
+        股票代码 -> 列下标（不存在的代码返回-1）
+        """
+        if self._symbol_index is None:
+            self._symbol_index = {code: i for i, code in enumerate(self.symbols)}
+        return np.array([self._symbol_index.get(code, -1) for code in ts_codes], dtype=np.int64)
+
+    def date_slice(self, start_date=None, end_date=None):
+        """
+        日期区间 -> 行切片（连续切片，对内存映射数组切片同样是零拷贝）
+        """
+        start = 0 if start_date is None else np.searchsorted(self.dates, to_date_key(pd.to_datetime([start_date]))[0], side='left')
+        end = len(self.dates) if end_date is None else np.searchsorted(self.dates, to_date_key(pd.to_datetime([end_date]))[0], side='right')
+        return slice(start, end)
+
+    def to_long(self, fields=None, dropna=True):
+        """
+        面板存储 -> 长表
+        """
+        fields = fields or self.fields
+        return panel_to_long(self.dates, self.symbols, {field: self[field] for field in fields}, dropna=dropna)
+
+    def save_meta(self, **meta):
+        """
+        保存面板附加信息（如数据区间、复权方式）
+        """
+        with open(os.path.join(self.root, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    def load_meta(self):
+        path = os.path.join(self.root, 'meta.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
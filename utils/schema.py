@@ -0,0 +1,76 @@
+# schema.py
+# 全流程统一的紧凑数据类型约定，降低all_data等宽表的内存占用
+# - 股票代码：category
+# - 公告日/报告期等日期键：int32（YYYYMMDD）
+# - trade_date：保留datetime64，下游的月度IC、回撤恢复天数、画图都依赖日期运算
+# - 价格、成交量、财务指标和因子：float32（计算过程仍用float64，只在落表时降精度）
+
+import numpy as np
+import pandas as pd
+
+SYMBOL_COLS = ['ts_code']
+DATE_KEY_COLS = ['ann_date', 'f_ann_date', 'end_date', 'list_date', 'delist_date', 'cal_date']
+
+# 只在计算过程中使用的中间列，用完即删
+INTERMEDIATE_COLS = ['ema_short', 'ema_long']
+
+
+def to_date_key(values):
+    """
+    日期（字符串YYYYMMDD / datetime）-> int32日期键YYYYMMDD，缺失值记为0
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_integer_dtype(values):
+        return values.to_numpy(dtype=np.int32)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        dates = values
+    else:
+        dates = pd.to_datetime(values.astype(str), format='%Y%m%d', errors='coerce')
+    keys = dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day
+    return keys.fillna(0).to_numpy(dtype=np.int32)
+
+
+def from_date_key(keys):
+    """
+    int32日期键YYYYMMDD -> datetime64，0视为缺失
+    """
+    keys = pd.Series(keys)
+    return pd.to_datetime(keys.where(keys > 0).astype('Int64').astype(str), format='%Y%m%d', errors='coerce')
+
+
+def compact_frame(df):
+    """
+    按统一约定原地压缩DataFrame的数据类型（merge/concat之后category会退化为object，需要再次调用）
+    :return: df
+    """
+    for col in SYMBOL_COLS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            # 类别只取实际出现的代码，groupby时observed=True/False结果一致
+            df[col] = pd.Categorical(df[col], categories=np.sort(df[col].dropna().unique()))
+
+    for col in DATE_KEY_COLS:
+        if col in df.columns and not pd.api.types.is_integer_dtype(df[col]):
+            df[col] = to_date_key(df[col])
+
+    for col in df.columns:
+        dtype = df[col].dtype
+        if dtype == np.float64:
+            df[col] = df[col].astype(np.float32)
+        elif dtype == np.int64 and col not in DATE_KEY_COLS:
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+
+    return df
+
+
+def drop_intermediate_columns(df):
+    """
+    删除只在计算过程中使用的中间列
+    """
+    return df.drop(columns=[col for col in INTERMEDIATE_COLS if col in df.columns])
+
+
+def memory_usage_mb(df):
+    """
+    DataFrame实际内存占用（MB）
+    """
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
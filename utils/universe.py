@@ -0,0 +1,210 @@
+# universe.py
+# 可交易股票池：每次加载数据后一次性构建 date×stock 布尔掩码面板，选股、IC计算和回测统一用一次向量化AND过滤
+# - listed：上市满N个交易日（剔除次新股）
+# - not_st：非ST/*ST
+# - not_suspended：当日有成交
+# - can_buy：未停牌且收盘未封涨停
+# - can_sell：未停牌且收盘未封跌停
+
+import numpy as np
+import pandas as pd
+from config import NEW_STOCK_DAYS
+from utils.panel_store import long_to_panel
+from utils.schema import to_date_key
+
+# 创业板注册制改革生效日，此后创业板涨跌幅限制由10%调整为20%
+CHINEXT_REFORM_DATE = 20200824
+
+
+def board_of(ts_codes):
+    """
+    根据代码判断所属板块：main（主板）、chinext（创业板）、star（科创板）、bse（北交所）
+    """
+    # 长表中代码大量重复，只对去重后的代码做字符串判断
+    index, codes = pd.factorize(pd.Series(ts_codes))
+    codes = pd.Series(codes).astype(str)
+    board = np.full(len(codes), 'main', dtype=object)
+    board[codes.str.startswith(('300', '301')).to_numpy()] = 'chinext'
+    board[codes.str.startswith(('688', '689')).to_numpy()] = 'star'
+    board[codes.str.endswith('.BJ').to_numpy()] = 'bse'
+    return board[index]
+
+
+def is_st_name(names):
+    """
+    股票简称是否为ST/*ST/S*ST
+    """
+    return pd.Series(names).fillna('').astype(str).str.upper().str.contains('ST').to_numpy()
+
+
+def price_limit_ratio(ts_codes, is_st, date_keys):
+    """
+    按板块和ST状态计算涨跌幅限制比例（可广播：ts_codes为[n_stocks]，is_st/date_keys可为[n_dates, 1]或[n_dates, n_stocks]）
+    - 主板10%，主板ST 5%
+    - 创业板（改革后）、科创板20%，北交所30%，不区分ST
+    """
+    board = board_of(ts_codes)
+    date_keys = np.asarray(date_keys)
+    limit = np.where(is_st, 0.05, 0.10)
+    limit = np.where((board == 'chinext') & (date_keys >= CHINEXT_REFORM_DATE), 0.20, limit)
+    limit = np.where(board == 'star', 0.20, limit)
+    limit = np.where(board == 'bse', 0.30, limit)
+    return limit
+
+
+def _round_price(price):
+    """
+    按交易所规则四舍五入到分
+    """
+    return np.floor(price * 100 + 0.5) / 100
+
+
+def limit_hits(close, pre_close, limit):
+    """
+    收盘是否封涨停/跌停：收盘价达到按昨收和涨跌幅限制计算（四舍五入到分）的涨停价/跌停价
+    :return: (limit_up, limit_down) 布尔数组（价格缺失时为False）
+    """
+    with np.errstate(invalid='ignore'):
+        limit_up = close >= _round_price(pre_close * (1 + limit)) - 0.005
+        limit_down = close <= _round_price(pre_close * (1 - limit)) + 0.005
+    return limit_up, limit_down
+
+
+class Universe:
+    """
+    股票池掩码集合：dates（int32日期键）× symbols 的布尔面板
+    """
+
+    def __init__(self, dates, symbols, masks):
+        self.dates = dates
+        self.symbols = symbols
+        self.masks = masks
+        self._symbol_index = {code: i for i, code in enumerate(symbols)}
+
+    def mask(self, *names):
+        """
+        多个掩码做AND，默认使用tradable（上市满N日 & 非ST & 未停牌）
+        """
+        names = names or ('tradable',)
+        result = self.masks[names[0]].copy()
+        for name in names[1:]:
+            result &= self.masks[name]
+        return result
+
+    def mask_long(self, df, *names, date_col='trade_date'):
+        """
+        把掩码映射到长表的每一行（不在日历/代码范围内的行为False）
+        :return: 与df行对齐的布尔数组
+        """
+        panel = self.mask(*names)
+        date_keys = to_date_key(df[date_col])
+        codes = df['ts_code'].astype(str).to_numpy()
+        row = np.searchsorted(self.dates, date_keys)
+        col = np.searchsorted(self.symbols, codes)
+        valid = (row < len(self.dates)) & (col < len(self.symbols))
+        valid[valid] = (self.dates[row[valid]] == date_keys[valid]) & (self.symbols[col[valid]] == codes[valid])
+        result = np.zeros(len(df), dtype=bool)
+        result[valid] = panel[row[valid], col[valid]]
+        return result
+
+    def filter(self, df, *names, date_col='trade_date'):
+        """
+        只保留掩码为True的行
+        """
+        return df[self.mask_long(df, *names, date_col=date_col)]
+
+    def lookup(self, date_key, ts_codes, *names):
+        """
+        查询某一天若干股票的掩码（用于回测逐日调仓）
+        """
+        t = np.searchsorted(self.dates, date_key)
+        if t >= len(self.dates) or self.dates[t] != date_key:
+            return np.zeros(len(ts_codes), dtype=bool)
+        row = self.mask(*names)[t]
+        return np.array([row[self._symbol_index[code]] if code in self._symbol_index else False for code in ts_codes])
+
+
+def _st_mask(dates, symbols, stock_basic, name_history):
+    """
+    ST掩码：有曾用名记录（ts_code, name, start_date, end_date）时按历史区间标记，
+    否则按当前简称标记（把当前ST状态套用到全部历史，有前视偏差，只适合临时分析）
+    同一股票的名称区间最晚截止到下一条记录的启用日（缓存中较早记录的end_date可能尚未更新）
+    """
+    st = np.zeros((len(dates), len(symbols)), dtype=bool)
+    if name_history is not None and not name_history.empty:
+        records = pd.DataFrame({'ts_code': name_history['ts_code'].astype(str).to_numpy(),
+                                'name': name_history['name'].to_numpy(),
+                                'start_key': to_date_key(name_history['start_date']),
+                                'end_key': to_date_key(name_history['end_date'])})
+        records = records.sort_values(['ts_code', 'start_key']).drop_duplicates(['ts_code', 'start_key'], keep='last')
+        next_start = records.groupby('ts_code')['start_key'].shift(-1).fillna(0).to_numpy(dtype=np.int32)
+        is_st = is_st_name(records['name'].to_numpy())
+        records, next_start = records[is_st], next_start[is_st]
+
+        codes = records['ts_code'].to_numpy()
+        col = np.searchsorted(symbols, codes)
+        # 只保留代码在symbols中的记录（searchsorted对不存在的代码返回相邻位置）
+        matched = col < len(symbols)
+        matched[matched] = symbols[col[matched]] == codes[matched]
+        start = np.searchsorted(dates, records['start_key'].to_numpy(), side='left')
+        end_keys = records['end_key'].to_numpy()
+        end = np.where(end_keys > 0, np.searchsorted(dates, end_keys, side='right'), len(dates))
+        end = np.where(next_start > 0, np.minimum(end, np.searchsorted(dates, next_start, side='left')), end)
+        for c, s, e in zip(col[matched], start[matched], end[matched]):
+            st[s:e, c] = True
+        return st
+
+    print("⚠️ 未提供曾用名记录，按当前简称判断全部历史的ST状态（存在前视偏差，回测应传入name_history）")
+    basic = stock_basic.set_index('ts_code')
+    names = basic['name'].reindex(symbols)
+    st[:] = is_st_name(names.to_numpy())[None, :]
+    return st
+
+
+def build_universe(market_data, stock_basic, new_stock_days=NEW_STOCK_DAYS, name_history=None):
+    """
+    构建股票池掩码
+    :param market_data: 行情数据（trade_date, ts_code, close, pre_close, vol；有close_raw/pre_close_raw时用原始价格判断涨跌停）
+    :param stock_basic: 股票基础信息（ts_code, name, list_date）
+    :param new_stock_days: 上市不足该交易日数的次新股不纳入股票池
+    :param name_history: 曾用名记录（ts_code, name, start_date, end_date，见utils.data_loader.load_name_history），
+                         用于还原历史ST状态；回测时必须传入，缺省时按当前简称判断全部历史（前视偏差）
+    :return: Universe
+    """
+    close_col = 'close_raw' if 'close_raw' in market_data.columns else 'close'
+    pre_close_col = 'pre_close_raw' if 'pre_close_raw' in market_data.columns else 'pre_close'
+    fields = [close_col, pre_close_col] + (['vol'] if 'vol' in market_data.columns else [])
+    dates, symbols, panels = long_to_panel(market_data, fields)
+    close = panels[close_col].astype(np.float64)
+    pre_close = panels[pre_close_col].astype(np.float64)
+
+    # 上市天数：在日历上的位置 - 上市日位置；上市日早于日历起点的按工作日数估算
+    list_keys = pd.Series(to_date_key(stock_basic['list_date']), index=stock_basic['ts_code'].astype(str).to_numpy())
+    list_keys = list_keys.reindex(symbols).fillna(0).to_numpy(dtype=np.int32)
+    list_pos = np.searchsorted(dates, list_keys).astype(np.int64)
+    before = (list_keys > 0) & (list_keys < dates[0])
+    if before.any():
+        first_day = pd.to_datetime(str(dates[0]), format='%Y%m%d').to_datetime64().astype('datetime64[D]')
+        list_days = pd.to_datetime(list_keys[before].astype(str), format='%Y%m%d').values.astype('datetime64[D]')
+        list_pos[before] = -np.busday_count(list_days, first_day)
+    list_pos[list_keys == 0] = -new_stock_days  # 无上市日期（如已退市）视为非次新股
+    listed = (np.arange(len(dates))[:, None] - list_pos[None, :]) >= new_stock_days
+
+    not_st = ~_st_mask(dates, symbols, stock_basic, name_history)
+
+    not_suspended = ~np.isnan(close)
+    if 'vol' in panels:
+        not_suspended &= panels['vol'] > 0
+
+    limit = price_limit_ratio(symbols, ~not_st, dates[:, None])
+    limit_up, limit_down = limit_hits(close, pre_close, limit)
+
+    masks = {
+        'listed': listed,
+        'not_st': not_st,
+        'not_suspended': not_suspended,
+        'can_buy': not_suspended & ~limit_up,
+        'can_sell': not_suspended & ~limit_down,
+    }
+    masks['tradable'] = listed & not_st & not_suspended
+    return Universe(dates, symbols, masks)